@@ -2,6 +2,7 @@
 FastAPI应用主文件
 提供图片特征向量提取和初始化的REST API
 """
+import asyncio
 import logging
 import uvicorn
 from fastapi import FastAPI, HTTPException, UploadFile, File
@@ -9,20 +10,34 @@ from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from typing import List, Optional
 import os
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import wait, FIRST_COMPLETED
+from itertools import islice
 from threading import Lock
 
 from models.image_feature_extractor import get_feature_extractor
+from models.inference_batcher import get_inference_batcher
+from models.request_coalescer import get_request_coalescer
 from utils.db import (
-    Database,
+    FEATURE_TABLE,
     save_feature_vector,
     save_feature_vectors_batch,
     check_feature_exists,
     check_features_exist_batch,
     get_image_url,
-    get_all_images,
+    get_image_urls,
+    image_url_cache_stats,
+    get_feature_vector_by_url,
+    iter_images_keyset,
     get_total_image_count
 )
+from utils.pipeline import IngestionPipeline
+from utils.feature_rebuild import FeatureRebuild, RebuildInProgressError
+from utils.backfill_jobs import get_backfill_manager
+from utils.downloader import get_image_downloader
+from utils.embedding_cache import get_embedding_cache
+from utils.decode_pool import get_decode_pool, close_decode_pool
+from utils.processed_index import get_processed_index, close_processed_index
+from utils.executors import get_io_executor, get_decode_executor, get_db_executor, executor_stats, shutdown_executors
 from config import settings
 
 # 配置日志
@@ -85,6 +100,7 @@ class ProcessAllImagesRequest(BaseModel):
     limit: Optional[int] = None  # 限制处理数量，None表示处理所有
     skip_processed: bool = True  # 是否跳过已处理的图片
     force_reprocess: bool = False  # 是否强制重新处理（即使已存在）
+    approximate_count: bool = False  # 总数使用统计信息估算（不扫描表，适合超大表）
 
 
 class ProcessAllImagesResponse(BaseModel):
@@ -96,6 +112,7 @@ class ProcessAllImagesResponse(BaseModel):
     skipped: int  # 跳过数量（已存在）
     failed_ids: List[str] = []  # 失败的图片ID
     message: str
+    stage_stats: Optional[dict] = None  # 流水线各阶段吞吐与队列深度（仅流水线接口返回）
 
 
 class ProcessAllImagesParallelRequest(BaseModel):
@@ -103,16 +120,27 @@ class ProcessAllImagesParallelRequest(BaseModel):
     limit: Optional[int] = None  # 限制处理数量，None表示处理所有
     skip_processed: bool = True  # 是否跳过已处理的图片
     force_reprocess: bool = False  # 是否强制重新处理（即使已存在）
-    max_workers: Optional[int] = None  # 最大线程数，None表示使用配置值
+    approximate_count: bool = False  # 总数使用统计信息估算（不扫描表，适合超大表）
+    max_workers: Optional[int] = None  # 同时处理的最大图片数（在共享I/O线程池中执行），None表示使用配置值
 
 
 class ProcessAllImagesParallelBatchRequest(BaseModel):
-    """批量并行处理所有图片请求（每个线程处理100张）"""
+    """流水线批量处理所有图片请求"""
     limit: Optional[int] = None  # 限制处理数量，None表示处理所有
     skip_processed: bool = True  # 是否跳过已处理的图片
     force_reprocess: bool = False  # 是否强制重新处理（即使已存在）
-    max_workers: Optional[int] = None  # 最大线程数，None表示使用配置值
-    batch_size_per_thread: int = 100  # 每个线程处理的图片数量
+    approximate_count: bool = False  # 总数使用统计信息估算（不扫描表，适合超大表）
+    max_workers: Optional[int] = None  # 下载阶段线程数，None表示使用配置值
+    batch_size_per_thread: int = 100  # 每次批量检查是否已处理的图片数量
+    full_rebuild: bool = False  # 全量重建：重新处理所有图片写入影子表，完成后一次切换为正式表
+
+
+class BackfillJobRequest(BaseModel):
+    """创建后台回填任务请求"""
+    limit: Optional[int] = None  # 限制处理数量，None表示处理所有
+    skip_processed: bool = True  # 是否跳过已处理的图片
+    force_reprocess: bool = False  # 是否强制重新处理（即使已存在）
+    page_size: Optional[int] = None  # 每页处理数量（每页写一次断点），None表示使用配置值
 
 
 @app.on_event("startup")
@@ -122,12 +150,34 @@ async def startup_event():
     try:
         extractor = get_feature_extractor()
         dimension = extractor.get_feature_dimension()
+        get_inference_batcher()
+        # 配置了解码子进程时提前创建共享内存和进程池
+        get_decode_pool()
+        # 后台加载已处理ID索引，加载完成前存在性检查仍查询数据库
+        get_processed_index()
+        await get_request_coalescer().start()
         logger.info(f"特征提取器初始化完成，特征维度: {dimension}")
+        # 加载回填任务断点，上次运行中的任务标记为中断（可配置自动恢复）；
+        # 任务状态只在单个进程内，多进程时每个进程都会恢复同一个任务，因此不运行回填任务
+        if settings.api_workers > 1:
+            logger.warning(f"服务以 {settings.api_workers} 个工作进程运行，不恢复后台回填任务，回填任务接口不可用")
+        else:
+            get_backfill_manager().recover()
     except Exception as e:
         logger.error(f"特征提取器初始化失败: {e}")
         raise
 
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """应用关闭时停止在线请求合并器，关闭下载连接池、共享线程池、解码进程池和已处理ID索引"""
+    await get_request_coalescer().stop()
+    get_image_downloader().close(timeout=5)
+    shutdown_executors(wait=False)
+    close_decode_pool()
+    close_processed_index()
+
+
 @app.get("/")
 async def root():
     """根路径"""
@@ -143,13 +193,54 @@ async def root():
 async def health_check():
     """健康检查"""
     extractor = get_feature_extractor()
+    embedding_cache = get_embedding_cache()
+    decode_pool = get_decode_pool()
+    processed_index = get_processed_index()
     return {
         "status": "healthy",
         "model_loaded": extractor.model is not None,
-        "feature_dimension": extractor.get_feature_dimension()
+        "feature_dimension": extractor.get_feature_dimension(),
+        "inference_batcher": get_inference_batcher().stats(),
+        "downloader": get_image_downloader().stats(),
+        "embedding_cache": embedding_cache.stats() if embedding_cache else None,
+        "image_url_cache": image_url_cache_stats(),
+        "executors": executor_stats(),
+        "decode_pool": decode_pool.stats() if decode_pool else None,
+        "processed_index": processed_index.stats() if processed_index else None
     }
 
 
+async def _extract_url_cached(image_url: str):
+    """按URL提取特征向量：先查进程内缓存，可选再查数据库中已保存的向量，最后下载并推理"""
+    cache = get_embedding_cache()
+    if cache is None:
+        # 并发请求在合并器中凑批推理，不阻塞事件循环
+        return await get_request_coalescer().extract_from_url(image_url)
+    
+    feature_vector = cache.get(image_url)
+    if feature_vector is not None:
+        return feature_vector
+    
+    if settings.embedding_cache_db_lookup:
+        loop = asyncio.get_running_loop()
+        try:
+            feature_vector = await loop.run_in_executor(
+                get_db_executor(),
+                get_feature_vector_by_url,
+                image_url,
+                get_feature_extractor().model_version
+            )
+        except Exception as e:
+            logger.warning(f"按URL查询已保存的特征向量失败: {e}")
+        if feature_vector is not None:
+            cache.put(image_url, feature_vector, from_db=True)
+            return feature_vector
+    
+    feature_vector = await get_request_coalescer().extract_from_url(image_url)
+    cache.put(image_url, feature_vector)
+    return feature_vector
+
+
 @app.post("/extract/url", response_model=FeatureVectorResponse)
 async def extract_features_from_url(image_url: str):
     """
@@ -158,13 +249,13 @@ async def extract_features_from_url(image_url: str):
     - **image_url**: 图片的URL地址
     """
     try:
-        extractor = get_feature_extractor()
-        feature_vector = extractor.extract_features_from_url(image_url)
+        feature_vector = await _extract_url_cached(image_url)
         dimension = len(feature_vector)
         
         return FeatureVectorResponse(
-            feature_vector=feature_vector,
-            dimension=dimension
+            feature_vector=feature_vector.tolist(),  # 只在JSON响应边界转换为列表
+            dimension=dimension,
+            model_version=get_feature_extractor().model_version
         )
     except Exception as e:
         logger.error(f"从URL提取特征失败: {e}")
@@ -182,13 +273,13 @@ async def extract_features_from_upload(file: UploadFile = File(...)):
         # 读取上传的文件
         image_bytes = await file.read()
         
-        extractor = get_feature_extractor()
-        feature_vector = extractor.extract_features_from_bytes(image_bytes)
+        feature_vector = await get_request_coalescer().extract_from_bytes(image_bytes)
         dimension = len(feature_vector)
         
         return FeatureVectorResponse(
-            feature_vector=feature_vector,
-            dimension=dimension
+            feature_vector=feature_vector.tolist(),  # 只在JSON响应边界转换为列表
+            dimension=dimension,
+            model_version=get_feature_extractor().model_version
         )
     except Exception as e:
         logger.error(f"从上传文件提取特征失败: {e}")
@@ -203,11 +294,13 @@ async def process_image(request: ProcessImageRequest):
     - **image_id**: 图片ID
     - **image_url**: 图片URL（可选，如果不提供则从数据库查询）
     """
+    loop = asyncio.get_running_loop()
+    db_executor = get_db_executor()
     try:
-        # 检查是否已存在
-        if check_feature_exists(request.image_id):
+        # 检查当前模型版本的特征向量是否已存在（数据库调用在共享数据库线程池中执行，不阻塞事件循环）
+        extractor = get_feature_extractor()
+        if await loop.run_in_executor(db_executor, check_feature_exists, request.image_id, extractor.model_version):
             logger.info(f"图片 {request.image_id} 的特征向量已存在，跳过")
-            extractor = get_feature_extractor()
             return ProcessImageResponse(
                 success=True,
                 image_id=request.image_id,
@@ -218,24 +311,26 @@ async def process_image(request: ProcessImageRequest):
         # 获取图片URL
         image_url = request.image_url
         if not image_url:
-            image_url = get_image_url(request.image_id)
+            image_url = await loop.run_in_executor(db_executor, get_image_url, request.image_id)
             if not image_url:
                 raise HTTPException(
                     status_code=404,
                     detail=f"图片ID {request.image_id} 不存在或没有URL"
                 )
         
-        # 提取特征向量
+        # 提取特征向量（与在线接口一样经请求合并器凑批推理）
         extractor = get_feature_extractor()
-        feature_vector = extractor.extract_features_from_url(image_url)
+        feature_vector = await get_request_coalescer().extract_from_url(image_url)
         dimension = len(feature_vector)
         
         # 保存到数据库
-        save_feature_vector(
-            image_id=request.image_id,
-            feature_vector=feature_vector,
-            vector_dimension=dimension,
-            model_version="MobileNetV2-GPU"
+        await loop.run_in_executor(
+            db_executor,
+            save_feature_vector,
+            request.image_id,
+            feature_vector,
+            dimension,
+            extractor.model_version
         )
         
         logger.info(f"图片 {request.image_id} 的特征向量已保存")
@@ -254,77 +349,112 @@ async def process_image(request: ProcessImageRequest):
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.post("/process/batch", response_model=BatchProcessResponse)
-async def process_batch_images(image_ids: List[str]):
-    """
-    批量处理图片：提取特征向量并保存到数据库
+def _decode_for_batch(image_bytes: Optional[bytes]):
+    """解码并预处理下载结果，下载或解码失败返回None"""
+    if image_bytes is None:
+        return None
+    try:
+        return get_feature_extractor().preprocess_image_bytes(image_bytes)
+    except Exception as e:
+        logger.warning(f"解码图片失败: {e}")
+        return None
+
+
+def _process_image_batch(image_ids: List[str]) -> BatchProcessResponse:
+    """按集合处理一批图片ID（同步执行，在线程池中调用）
     
-    - **image_ids**: 图片ID列表
+    已存在检查和URL查询各一次查询，所有图片并发下载、按批推理，最后一次批量upsert写库
     """
-    success_count = 0
-    failed_count = 0
-    failed_ids = []
-    
     extractor = get_feature_extractor()
     
+    # 规范化ID（与数据库中的bigint一致），非数字ID直接失败，重复ID只处理一次
+    normalized = {}
     for image_id in image_ids:
         try:
-            # 检查是否已存在
-            if check_feature_exists(image_id):
-                logger.info(f"图片 {image_id} 的特征向量已存在，跳过")
-                success_count += 1
-                continue
-            
-            # 获取图片URL
-            image_url = get_image_url(image_id)
-            if not image_url:
-                logger.warning(f"图片ID {image_id} 不存在或没有URL")
-                failed_count += 1
-                failed_ids.append(image_id)
+            normalized[image_id] = str(int(image_id))
+        except (TypeError, ValueError):
+            logger.warning(f"图片ID {image_id} 无效")
+    unique_ids = list(dict.fromkeys(normalized.values()))
+    
+    # 已存在的视为成功，与逐张处理时的行为一致
+    succeeded = check_features_exist_batch(unique_ids, extractor.model_version)
+    if succeeded:
+        logger.info(f"{len(succeeded)} 张图片的特征向量已存在，跳过")
+    pending_ids = [image_id for image_id in unique_ids if image_id not in succeeded]
+    urls = get_image_urls(pending_ids)
+    for image_id in pending_ids:
+        if image_id not in urls:
+            logger.warning(f"图片ID {image_id} 不存在或没有URL")
+    
+    tasks = [(image_id, urls[image_id]) for image_id in pending_ids if image_id in urls]
+    batcher = get_inference_batcher()
+    rows = []
+    # 分块下载和解码，限制同时驻留内存的预处理数组数量
+    for start in range(0, len(tasks), settings.process_chunk_size):
+        chunk = tasks[start:start + settings.process_chunk_size]
+        contents = get_image_downloader().download_many(
+            [image_url for _, image_url in chunk],
+            concurrency=settings.download_workers
+        )
+        arrays = list(get_decode_executor().map(_decode_for_batch, contents))
+        ready = [(image_id, img_array) for (image_id, _), img_array in zip(chunk, arrays) if img_array is not None]
+        futures = batcher.submit_many([img_array for _, img_array in ready])
+        for (image_id, _), future in zip(ready, futures):
+            try:
+                feature_vector = future.result()
+            except Exception as e:
+                logger.error(f"图片 {image_id} 推理失败: {e}")
                 continue
-            
-            # 提取特征向量
-            feature_vector = extractor.extract_features_from_url(image_url)
-            dimension = len(feature_vector)
-            
-            # 保存到数据库
-            save_feature_vector(
-                image_id=image_id,
-                feature_vector=feature_vector,
-                vector_dimension=dimension,
-                model_version="MobileNetV2-GPU"
-            )
-            
-            success_count += 1
-            logger.info(f"图片 {image_id} 处理成功")
-            
+            rows.append((image_id, feature_vector, len(feature_vector), extractor.model_version))
+    
+    if rows:
+        try:
+            save_feature_vectors_batch(rows)
+            succeeded.update(row[0] for row in rows)
         except Exception as e:
-            logger.error(f"处理图片 {image_id} 失败: {e}")
-            failed_count += 1
-            failed_ids.append(image_id)
+            logger.error(f"批量保存 {len(rows)} 条特征向量失败: {e}")
     
+    failed_ids = [image_id for image_id in image_ids if normalized.get(image_id) not in succeeded]
+    logger.info(f"批量处理完成：共 {len(image_ids)} 张，新处理 {len(rows)} 张，失败 {len(failed_ids)} 张")
     return BatchProcessResponse(
         total=len(image_ids),
-        success=success_count,
-        failed=failed_count,
+        success=len(image_ids) - len(failed_ids),
+        failed=len(failed_ids),
         failed_ids=failed_ids
     )
 
 
-@app.post("/process/all", response_model=ProcessAllImagesResponse)
-async def process_all_images(request: ProcessAllImagesRequest):
+@app.post("/process/batch", response_model=BatchProcessResponse)
+async def process_batch_images(image_ids: List[str]):
     """
-    处理所有图片：从ecai.tb_image表读取所有图片，提取特征向量并保存到tb_hsx_img_value表
+    批量处理图片：提取特征向量并保存到数据库
     
-    - **limit**: 限制处理数量，None表示处理所有
-    - **skip_processed**: 是否跳过已处理的图片（默认True）
-    - **force_reprocess**: 是否强制重新处理（即使已存在，默认False）
+    - **image_ids**: 图片ID列表
+    
+    已存在检查和URL查询按集合各执行一次，图片并发下载、按批推理，结果一次批量写库
     """
     try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(get_io_executor(), _process_image_batch, image_ids)
+    except Exception as e:
+        logger.error(f"批量处理图片失败: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+def _process_all_images(request: ProcessAllImagesRequest) -> ProcessAllImagesResponse:
+    """逐批处理所有图片（在I/O线程池中执行，不阻塞事件循环）"""
+    try:
+        extractor = get_feature_extractor()
+        
         # 获取总图片数
-        total_count = get_total_image_count(skip_processed=request.skip_processed)
+        total_count = get_total_image_count(
+            skip_processed=request.skip_processed,
+            approximate=request.approximate_count,
+            model_version=extractor.model_version
+        )
         
-        if total_count == 0:
+        # 估算值可能为0（表未分析过），此时仍然按实际查询结果处理
+        if total_count == 0 and not request.approximate_count:
             return ProcessAllImagesResponse(
                 total=0,
                 processed=0,
@@ -334,44 +464,44 @@ async def process_all_images(request: ProcessAllImagesRequest):
                 message="没有需要处理的图片"
             )
         
-        # 获取所有图片
-        images = get_all_images(limit=request.limit, skip_processed=request.skip_processed)
-        
-        if not images:
-            return ProcessAllImagesResponse(
-                total=total_count,
-                processed=0,
-                success=0,
-                failed=0,
-                skipped=0,
-                message="没有找到需要处理的图片"
-            )
+        # 按主键分页查找图片，边查边处理
+        images = iter_images_keyset(
+            skip_processed=request.skip_processed,
+            limit=request.limit,
+            model_version=extractor.model_version
+        )
+        expected_count = min(total_count, request.limit) if request.limit else total_count
         
-        logger.info(f"开始处理 {len(images)} 张图片（总计: {total_count}）")
+        logger.info(f"开始处理约 {expected_count} 张图片（总计: {total_count}）")
         
-        extractor = get_feature_extractor()
         success_count = 0
         failed_count = 0
         skipped_count = 0
         failed_ids = []
+        processed_count = 0
         
         # 分批处理，避免一次性处理过多数据
         chunk_size = settings.process_chunk_size
-        total_chunks = (len(images) + chunk_size - 1) // chunk_size
+        total_chunks = (expected_count + chunk_size - 1) // chunk_size
         
-        logger.info(f"将分 {total_chunks} 批处理，每批 {chunk_size} 张图片")
+        logger.info(f"将分约 {total_chunks} 批处理，每批 {chunk_size} 张图片")
         
-        for chunk_idx in range(total_chunks):
-            start_idx = chunk_idx * chunk_size
-            end_idx = min(start_idx + chunk_size, len(images))
-            chunk_images = images[start_idx:end_idx]
+        chunk_idx = -1
+        while True:
+            chunk_images = list(islice(images, chunk_size))
+            if not chunk_images:
+                break
+            chunk_idx += 1
+            start_idx = processed_count
+            end_idx = start_idx + len(chunk_images)
+            processed_count = end_idx
             
             logger.info(f"[批次 {chunk_idx + 1}/{total_chunks}] 处理图片 {start_idx + 1}-{end_idx}（共 {len(chunk_images)} 张）...")
             
             # 批量检查已存在的图片（优化数据库查询）
             if not request.force_reprocess:
                 chunk_image_ids = [img[0] for img in chunk_images]
-                existing_ids = check_features_exist_batch(chunk_image_ids)
+                existing_ids = check_features_exist_batch(chunk_image_ids, extractor.model_version)
                 # 过滤掉已存在的图片
                 chunk_images = [(img_id, url) for img_id, url in chunk_images if img_id not in existing_ids]
                 skipped_count += len(existing_ids)
@@ -380,18 +510,7 @@ async def process_all_images(request: ProcessAllImagesRequest):
                 logger.info(f"[批次 {chunk_idx + 1}/{total_chunks}] 本批次所有图片已处理，跳过")
                 continue
             
-            # 如果强制重新处理，批量删除旧数据
-            if request.force_reprocess:
-                chunk_image_ids = [img[0] for img in chunk_images]
-                existing_ids = check_features_exist_batch(chunk_image_ids)
-                if existing_ids:
-                    conn = Database.get_connection()
-                    cursor = conn.cursor()
-                    existing_ints = [int(img_id) for img_id in existing_ids]
-                    cursor.execute("DELETE FROM tb_hsx_img_value WHERE image_id = ANY(%s)", (existing_ints,))
-                    conn.commit()
-                    cursor.close()
-                    Database.return_connection(conn)
+            # 强制重新处理时不删除旧数据，批量保存时由upsert直接覆盖
             
             # 过滤无效URL
             valid_chunk_images = []
@@ -430,7 +549,7 @@ async def process_all_images(request: ProcessAllImagesRequest):
             for image_id, feature_vector in zip(chunk_image_ids, feature_results):
                 if feature_vector is not None:
                     dimension = len(feature_vector)
-                    batch_data.append((image_id, feature_vector, dimension, "MobileNetV2-GPU"))
+                    batch_data.append((image_id, feature_vector, dimension, extractor.model_version))
                 else:
                     failed_count += 1
                     failed_ids.append(image_id)
@@ -463,12 +582,15 @@ async def process_all_images(request: ProcessAllImagesRequest):
                             failed_ids.append(image_id)
                             failed_count += 1
         
-        message = f"处理完成：成功 {success_count}，失败 {failed_count}，跳过 {skipped_count}"
+        if processed_count == 0:
+            message = "没有找到需要处理的图片"
+        else:
+            message = f"处理完成：成功 {success_count}，失败 {failed_count}，跳过 {skipped_count}"
         logger.info(message)
         
         return ProcessAllImagesResponse(
             total=total_count,
-            processed=len(images),
+            processed=processed_count,
             success=success_count,
             failed=failed_count,
             skipped=skipped_count,
@@ -481,10 +603,25 @@ async def process_all_images(request: ProcessAllImagesRequest):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/process/all", response_model=ProcessAllImagesResponse)
+async def process_all_images(request: ProcessAllImagesRequest):
+    """
+    处理所有图片：从ecai.tb_image表读取所有图片，提取特征向量并保存到tb_hsx_img_value表
+    
+    - **limit**: 限制处理数量，None表示处理所有
+    - **skip_processed**: 是否跳过已处理的图片（默认True）
+    - **force_reprocess**: 是否强制重新处理（即使已存在，默认False）
+    - **approximate_count**: 总数是否使用统计信息估算（默认False，精确计数需要扫描两张表）
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_io_executor(), _process_all_images, request)
+
+
 def _process_single_image(
     image_id: str,
     image_url: str,
     extractor,
+    batcher,
     request: ProcessAllImagesParallelRequest,
     stats_lock: Lock,
     stats: dict,
@@ -499,21 +636,12 @@ def _process_single_image(
     try:
         # 检查是否已存在（如果force_reprocess为False）
         if not request.force_reprocess:
-            if check_feature_exists(image_id):
+            if check_feature_exists(image_id, extractor.model_version):
                 with stats_lock:
                     stats['skipped'] += 1
                     processed_count['count'] += 1
                 return (False, True, None)
         
-        # 如果强制重新处理，先删除旧数据
-        if request.force_reprocess and check_feature_exists(image_id):
-            conn = Database.get_connection()
-            cursor = conn.cursor()
-            cursor.execute("DELETE FROM tb_hsx_img_value WHERE image_id = %s", (int(image_id),))
-            conn.commit()
-            cursor.close()
-            Database.return_connection(conn)
-        
         # 验证URL
         if not image_url:
             with stats_lock:
@@ -522,9 +650,13 @@ def _process_single_image(
                 processed_count['count'] += 1
             return (False, False, image_id)
         
-        # 提取特征向量（单张图片）
+        # 提取特征向量（下载和预处理在本线程完成，推理交给共享批处理器凑批）
         try:
-            feature_vector = extractor.extract_features_from_url(image_url)
+            image_bytes = extractor.download_image_bytes(image_url)
+            if image_bytes is None:
+                raise ValueError("图片下载失败")
+            img_array = extractor.preprocess_image_bytes(image_bytes)
+            feature_vector = batcher.submit(img_array).result()
             dimension = len(feature_vector)
         except Exception as e:
             logger.warning(f"图片 {image_id} 特征提取失败: {e}")
@@ -540,7 +672,7 @@ def _process_single_image(
                 image_id=image_id,
                 feature_vector=feature_vector,
                 vector_dimension=dimension,
-                model_version="MobileNetV2-GPU"
+                model_version=extractor.model_version
             )
             
             with stats_lock:
@@ -571,21 +703,29 @@ def _process_single_image(
         return (False, False, image_id)
 
 
-@app.post("/process/all/parallel", response_model=ProcessAllImagesResponse)
-async def process_all_images_parallel(request: ProcessAllImagesParallelRequest):
-    """
-    并行处理所有图片：使用多线程，每个线程处理一张图片，大幅提升处理速度
-    
-    - **limit**: 限制处理数量，None表示处理所有
-    - **skip_processed**: 是否跳过已处理的图片（默认True）
-    - **force_reprocess**: 是否强制重新处理（即使已存在，默认False）
-    - **max_workers**: 最大线程数，None表示使用配置值（默认4）
-    """
+def _log_task_errors(futures):
+    """记录已完成任务中未被捕获的异常（结果已在任务内部更新统计信息）"""
+    for future in futures:
+        try:
+            future.result()
+        except Exception as e:
+            logger.error(f"处理任务异常: {e}")
+
+
+def _process_all_images_parallel(request: ProcessAllImagesParallelRequest) -> ProcessAllImagesResponse:
+    """并行处理所有图片（在默认线程池中执行，不阻塞事件循环）"""
     try:
+        extractor = get_feature_extractor()
+        
         # 获取总图片数
-        total_count = get_total_image_count(skip_processed=request.skip_processed)
+        total_count = get_total_image_count(
+            skip_processed=request.skip_processed,
+            approximate=request.approximate_count,
+            model_version=extractor.model_version
+        )
         
-        if total_count == 0:
+        # 估算值可能为0（表未分析过），此时仍然按实际查询结果处理
+        if total_count == 0 and not request.approximate_count:
             return ProcessAllImagesResponse(
                 total=0,
                 processed=0,
@@ -596,28 +736,23 @@ async def process_all_images_parallel(request: ProcessAllImagesParallelRequest):
                 message="没有需要处理的图片"
             )
         
-        # 获取所有图片
-        images = get_all_images(limit=request.limit, skip_processed=request.skip_processed)
-        
-        if not images:
-            return ProcessAllImagesResponse(
-                total=total_count,
-                processed=0,
-                success=0,
-                failed=0,
-                skipped=0,
-                failed_ids=[],
-                message="没有找到需要处理的图片"
-            )
+        # 按主键分页查找图片，边查边提交
+        images = iter_images_keyset(
+            skip_processed=request.skip_processed,
+            limit=request.limit,
+            model_version=extractor.model_version
+        )
+        expected_count = min(total_count, request.limit) if request.limit else total_count
         
-        logger.info(f"开始多线程并行处理 {len(images)} 张图片（总计: {total_count}）")
+        logger.info(f"开始多线程并行处理约 {expected_count} 张图片（总计: {total_count}）")
         
-        extractor = get_feature_extractor()
+        batcher = get_inference_batcher()
         
         # 确定配置参数
         max_workers = request.max_workers if request.max_workers is not None else settings.parallel_workers
         
-        logger.info(f"将使用 {max_workers} 个线程，每个线程处理一张图片")
+        executor = get_io_executor()
+        logger.info(f"最多同时处理 {max_workers} 张图片（共享I/O线程池 {executor.stats()['max_workers']} 个线程），推理由共享批处理器合并")
         
         # 线程安全的统计信息
         stats_lock = Lock()
@@ -631,40 +766,50 @@ async def process_all_images_parallel(request: ProcessAllImagesParallelRequest):
         # 处理计数器（用于进度显示）
         processed_count = {'count': 0}
         
-        # 使用线程池并行处理，每个线程处理一张图片
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            # 提交所有图片处理任务
-            futures = [
-                executor.submit(
-                    _process_single_image,
-                    image_id,
-                    image_url,
-                    extractor,
-                    request,
-                    stats_lock,
-                    stats,
-                    len(images),
-                    processed_count
-                )
-                for image_id, image_url in images
-            ]
-            
-            # 等待所有任务完成
-            completed = 0
-            for future in as_completed(futures):
-                try:
-                    future.result()  # 获取结果（结果已在函数内部更新统计信息）
-                    completed += 1
-                except Exception as e:
-                    logger.error(f"处理任务异常: {e}")
-                    completed += 1
+        # 在共享I/O线程池中并行处理，每个任务处理一张图片
+        # 本请求同时在途的任务数不超过 max_workers，图片列表边读边提交，不会一次性堆积全部任务
+        submitted = 0
+        pending = set()
+        for image_id, image_url in images:
+            if len(pending) >= max_workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                _log_task_errors(done)
+            pending.add(executor.submit(
+                _process_single_image,
+                image_id,
+                image_url,
+                extractor,
+                batcher,
+                request,
+                stats_lock,
+                stats,
+                expected_count,
+                processed_count
+            ))
+            submitted += 1
+        
+        # 等待剩余任务完成
+        done, _ = wait(pending)
+        _log_task_errors(done)
+        
+        if submitted == 0:
+            return ProcessAllImagesResponse(
+                total=total_count,
+                processed=0,
+                success=0,
+                failed=0,
+                skipped=0,
+                failed_ids=[],
+                message="没有找到需要处理的图片"
+            )
         
         message = f"并行处理完成：成功 {stats['success']}，失败 {stats['failed']}，跳过 {stats['skipped']}"
         logger.info(message)
+        logger.info(f"共享推理批处理器统计: {batcher.stats()}")
         
         return ProcessAllImagesResponse(
             total=total_count,
-            processed=len(images),
+            processed=submitted,
             success=stats['success'],
             failed=stats['failed'],
             skipped=stats['skipped'],
@@ -677,189 +822,52 @@ async def process_all_images_parallel(request: ProcessAllImagesParallelRequest):
         raise HTTPException(status_code=500, detail=str(e))
 
 
-def _process_batch_images(
-    batch_images: List[tuple],
-    extractor,
-    request: ProcessAllImagesParallelBatchRequest,
-    stats_lock: Lock,
-    stats: dict,
-    total_images: int,
-    processed_count: dict,
-    batch_idx: int,
-    total_batches: int
-) -> None:
-    """处理一批图片（线程安全）
-    
-    Args:
-        batch_images: 图片列表，每个元素为 (image_id, image_url)
-        extractor: 特征提取器
-        request: 请求参数
-        stats_lock: 统计信息锁
-        stats: 统计信息字典
-        total_images: 总图片数
-        processed_count: 处理计数器
-        batch_idx: 当前批次索引
-        total_batches: 总批次数
-    """
-    try:
-        batch_image_ids = [img[0] for img in batch_images]
-        batch_urls = [img[1] for img in batch_images]
-        
-        logger.info(f"[批次 {batch_idx + 1}/{total_batches}] 开始处理 {len(batch_images)} 张图片...")
-        
-        # 检查是否已存在（如果force_reprocess为False）
-        if not request.force_reprocess:
-            existing_ids = check_features_exist_batch(batch_image_ids)
-            if existing_ids:
-                # 过滤掉已存在的图片
-                valid_data = [(img_id, url) for img_id, url in batch_images if img_id not in existing_ids]
-                if len(valid_data) < len(batch_images):
-                    skipped = len(batch_images) - len(valid_data)
-                    with stats_lock:
-                        stats['skipped'] += skipped
-                        processed_count['count'] += skipped
-                    logger.info(f"[批次 {batch_idx + 1}/{total_batches}] 跳过 {skipped} 张已存在的图片")
-                
-                if not valid_data:
-                    logger.info(f"[批次 {batch_idx + 1}/{total_batches}] 本批次所有图片已处理，跳过")
-                    return
-                
-                batch_images = valid_data
-                batch_image_ids = [img[0] for img in batch_images]
-                batch_urls = [img[1] for img in batch_images]
-        
-        # 如果强制重新处理，先删除旧数据
-        if request.force_reprocess:
-            existing_ids = check_features_exist_batch(batch_image_ids)
-            if existing_ids:
-                conn = Database.get_connection()
-                cursor = conn.cursor()
-                existing_ints = [int(img_id) for img_id in existing_ids]
-                cursor.execute("DELETE FROM tb_hsx_img_value WHERE image_id = ANY(%s)", (existing_ints,))
-                conn.commit()
-                cursor.close()
-                Database.return_connection(conn)
-                logger.info(f"[批次 {batch_idx + 1}/{total_batches}] 已删除 {len(existing_ids)} 条旧记录")
-        
-        # 过滤无效URL
-        valid_batch_images = []
-        for image_id, image_url in batch_images:
-            if not image_url:
-                logger.warning(f"[批次 {batch_idx + 1}/{total_batches}] 图片ID {image_id} 没有URL，跳过")
-                with stats_lock:
-                    stats['failed'] += 1
-                    stats['failed_ids'].append(image_id)
-                    processed_count['count'] += 1
-                continue
-            valid_batch_images.append((image_id, image_url))
-        
-        if not valid_batch_images:
-            logger.warning(f"[批次 {batch_idx + 1}/{total_batches}] 本批次没有有效图片")
-            return
-        
-        # 提取URL列表
-        valid_image_ids = [img[0] for img in valid_batch_images]
-        valid_urls = [img[1] for img in valid_batch_images]
-        
-        # 批量下载并提取特征向量
-        try:
-            feature_results = extractor.extract_features_from_urls_batch(
-                valid_urls,
-                batch_size=settings.batch_size
-            )
-        except Exception as e:
-            logger.error(f"[批次 {batch_idx + 1}/{total_batches}] 批量提取特征失败: {e}")
-            # 标记本批次所有图片为失败
-            with stats_lock:
-                for image_id in valid_image_ids:
-                    stats['failed'] += 1
-                    stats['failed_ids'].append(image_id)
-                    processed_count['count'] += 1
-            return
-        
-        # 准备批量保存的数据
-        batch_data = []
-        for image_id, feature_vector in zip(valid_image_ids, feature_results):
-            if feature_vector is not None:
-                dimension = len(feature_vector)
-                batch_data.append((image_id, feature_vector, dimension, "MobileNetV2-GPU"))
-            else:
-                with stats_lock:
-                    stats['failed'] += 1
-                    stats['failed_ids'].append(image_id)
-                    processed_count['count'] += 1
-        
-        # 批量保存到数据库
-        if batch_data:
-            try:
-                # 分批保存，避免单次事务过大
-                db_batch_size = settings.db_batch_size
-                saved_count = 0
-                for i in range(0, len(batch_data), db_batch_size):
-                    db_batch = batch_data[i:i+db_batch_size]
-                    try:
-                        saved = save_feature_vectors_batch(db_batch)
-                        saved_count += saved
-                    except Exception as e:
-                        logger.error(f"[批次 {batch_idx + 1}/{total_batches}] 批量保存失败（子批次 {i//db_batch_size + 1}）: {e}")
-                        # 记录失败的图片ID
-                        with stats_lock:
-                            for img_id, _, _, _ in db_batch:
-                                if img_id not in stats['failed_ids']:
-                                    stats['failed_ids'].append(img_id)
-                                    stats['failed'] += 1
-                                    processed_count['count'] += 1
-                
-                with stats_lock:
-                    stats['success'] += saved_count
-                    processed_count['count'] += len(batch_images)
-                    current_count = processed_count['count']
-                
-                logger.info(f"[批次 {batch_idx + 1}/{total_batches}] 完成：成功 {saved_count}，失败 {len(valid_image_ids) - saved_count}")
-                
-                # 每处理500张图片输出一次进度
-                if current_count % 500 == 0:
-                    logger.info(f"总进度: {current_count}/{total_images} | 成功 {stats['success']}, 失败 {stats['failed']}, 跳过 {stats['skipped']}")
-                    
-            except Exception as e:
-                logger.error(f"[批次 {batch_idx + 1}/{total_batches}] 保存到数据库失败: {e}")
-                with stats_lock:
-                    for image_id in valid_image_ids:
-                        if image_id not in stats['failed_ids']:
-                            stats['failed_ids'].append(image_id)
-                            stats['failed'] += 1
-                            processed_count['count'] += 1
-        else:
-            logger.warning(f"[批次 {batch_idx + 1}/{total_batches}] 没有成功提取的特征向量")
-            with stats_lock:
-                processed_count['count'] += len(batch_images)
-        
-    except Exception as e:
-        logger.error(f"[批次 {batch_idx + 1}/{total_batches}] 处理批次时发生异常: {e}")
-        with stats_lock:
-            for image_id, _ in batch_images:
-                if image_id not in stats['failed_ids']:
-                    stats['failed_ids'].append(image_id)
-                    stats['failed'] += 1
-            processed_count['count'] += len(batch_images)
-
-
-@app.post("/process/all/parallel-batch", response_model=ProcessAllImagesResponse)
-async def process_all_images_parallel_batch(request: ProcessAllImagesParallelBatchRequest):
+@app.post("/process/all/parallel", response_model=ProcessAllImagesResponse)
+async def process_all_images_parallel(request: ProcessAllImagesParallelRequest):
     """
-    批量并行处理所有图片：使用多线程，每个线程同时下载和处理100张图片
+    并行处理所有图片：使用多线程，每个线程处理一张图片，大幅提升处理速度
     
     - **limit**: 限制处理数量，None表示处理所有
     - **skip_processed**: 是否跳过已处理的图片（默认True）
     - **force_reprocess**: 是否强制重新处理（即使已存在，默认False）
-    - **max_workers**: 最大线程数，None表示使用配置值（默认4）
-    - **batch_size_per_thread**: 每个线程处理的图片数量（默认100）
+    - **approximate_count**: 总数是否使用统计信息估算（默认False，精确计数需要扫描两张表）
+    - **max_workers**: 同时处理的最大图片数，None表示使用配置值（默认4）；任务在进程级共享I/O线程池中执行
     """
+    loop = asyncio.get_running_loop()
+    # 各图片的处理任务提交到共享I/O线程池，调度本身不占用I/O线程池，避免等待自己的任务
+    return await loop.run_in_executor(None, _process_all_images_parallel, request)
+
+
+def _require_single_worker(feature: str = "回填任务", alternative: str = "或 scripts/bulk_backfill.py"):
+    """多进程部署时拒绝只能在单进程中运行的功能
+    
+    - 回填任务：任务状态和线程只存在于处理创建请求的进程中，后续的查询、暂停请求会落到其他进程
+    - 全量重建：切换影子表后只有执行重建的进程能立即更新进程内状态（已处理ID索引等），
+      其他进程在下次对账前仍使用切换前的状态
+    """
+    if settings.api_workers > 1:
+        raise HTTPException(
+            status_code=503,
+            detail=f"服务以 {settings.api_workers} 个工作进程运行，{feature}不可用，"
+                   f"请使用单进程实例（python run.py --workers 1）{alternative}"
+        )
+
+
+def _process_all_images_parallel_batch(request: ProcessAllImagesParallelBatchRequest) -> ProcessAllImagesResponse:
+    """流水线批量处理所有图片（在I/O线程池中执行，不阻塞事件循环）"""
+    skip_processed = request.skip_processed and not request.full_rebuild
     try:
+        extractor = get_feature_extractor()
+        
         # 获取总图片数
-        total_count = get_total_image_count(skip_processed=request.skip_processed)
+        total_count = get_total_image_count(
+            skip_processed=skip_processed,
+            approximate=request.approximate_count,
+            model_version=extractor.model_version
+        )
         
-        if total_count == 0:
+        # 估算值可能为0（表未分析过），此时仍然按实际查询结果处理
+        if total_count == 0 and not request.approximate_count:
             return ProcessAllImagesResponse(
                 total=0,
                 processed=0,
@@ -870,97 +878,151 @@ async def process_all_images_parallel_batch(request: ProcessAllImagesParallelBat
                 message="没有需要处理的图片"
             )
         
-        # 获取所有图片
-        images = get_all_images(limit=request.limit, skip_processed=request.skip_processed)
-        
-        if not images:
-            return ProcessAllImagesResponse(
-                total=total_count,
-                processed=0,
-                success=0,
-                failed=0,
-                skipped=0,
-                failed_ids=[],
-                message="没有找到需要处理的图片"
-            )
-        
-        # 确定配置参数
-        max_workers = request.max_workers if request.max_workers is not None else settings.parallel_workers
-        batch_size_per_thread = request.batch_size_per_thread
-        
-        logger.info(f"开始批量并行处理 {len(images)} 张图片（总计: {total_count}）")
-        logger.info(f"配置：{max_workers} 个线程，每个线程处理 {batch_size_per_thread} 张图片")
-        
-        extractor = get_feature_extractor()
-        
-        # 将图片分成批次
-        total_batches = (len(images) + batch_size_per_thread - 1) // batch_size_per_thread
-        batches = []
-        for i in range(0, len(images), batch_size_per_thread):
-            batch = images[i:i+batch_size_per_thread]
-            batches.append(batch)
+        # 按主键分页查找图片，发现阶段边读边分发
+        images = iter_images_keyset(
+            skip_processed=skip_processed,
+            limit=request.limit,
+            model_version=extractor.model_version
+        )
         
-        logger.info(f"共分成 {total_batches} 个批次，将使用 {max_workers} 个线程并行处理")
+        logger.info(f"开始流水线处理（总计: {total_count}）")
         
-        # 线程安全的统计信息
-        stats_lock = Lock()
-        stats = {
-            'success': 0,
-            'failed': 0,
-            'skipped': 0,
-            'failed_ids': []
-        }
-        
-        # 处理计数器（用于进度显示）
-        processed_count = {'count': 0}
+        def run_pipeline(table: str) -> dict:
+            pipeline = IngestionPipeline(
+                extractor,
+                force_reprocess=request.force_reprocess or request.full_rebuild,
+                check_chunk_size=request.batch_size_per_thread,
+                download_workers=request.max_workers,
+                table=table
+            )
+            return pipeline.run(images)
         
-        # 使用线程池并行处理，每个线程处理一批图片
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            # 提交所有批次处理任务
-            futures = [
-                executor.submit(
-                    _process_batch_images,
-                    batch,
-                    extractor,
-                    request,
-                    stats_lock,
-                    stats,
-                    len(images),
-                    processed_count,
-                    batch_idx,
-                    total_batches
-                )
-                for batch_idx, batch in enumerate(batches)
-            ]
-            
-            # 等待所有任务完成
-            completed = 0
-            for future in as_completed(futures):
-                try:
-                    future.result()  # 获取结果（结果已在函数内部更新统计信息）
-                    completed += 1
-                except Exception as e:
-                    logger.error(f"处理批次任务异常: {e}")
-                    completed += 1
+        swap = None
+        if request.full_rebuild:
+            # 全量重建时写入影子表，正式表在切换前保持不变；失败时退出上下文会删除影子表
+            with FeatureRebuild() as rebuild:
+                result = run_pipeline(rebuild.rebuild_table)
+                swap = rebuild.swap()
+            # 正式表已被整体替换，内存中的已处理ID不再可信，按新表重新加载
+            processed_index = get_processed_index()
+            if processed_index is not None:
+                processed_index.reload()
+        else:
+            result = run_pipeline(FEATURE_TABLE)
         
-        message = f"批量并行处理完成：成功 {stats['success']}，失败 {stats['failed']}，跳过 {stats['skipped']}"
+        if result['total'] == 0:
+            message = "没有找到需要处理的图片"
+        else:
+            message = f"流水线处理完成：成功 {result['success']}，失败 {result['failed']}，跳过 {result['skipped']}"
+        if swap is not None:
+            message += (
+                f"；影子表已切换为正式表（{swap['rows']} 行，保留旧向量 {swap['carried_over']} 行，"
+                f"补入重建期间的写入 {swap['updated_during_rebuild']} 行）"
+            )
         logger.info(message)
         
         return ProcessAllImagesResponse(
             total=total_count,
-            processed=len(images),
-            success=stats['success'],
-            failed=stats['failed'],
-            skipped=stats['skipped'],
-            failed_ids=stats['failed_ids'],
-            message=message
+            processed=result['total'],
+            success=result['success'],
+            failed=result['failed'],
+            skipped=result['skipped'],
+            failed_ids=result['failed_ids'],
+            message=message,
+            stage_stats=result['stage_stats']
         )
         
+    except RebuildInProgressError as e:
+        raise HTTPException(status_code=409, detail=str(e))
     except Exception as e:
-        logger.error(f"批量并行处理所有图片失败: {e}")
+        logger.error(f"流水线处理所有图片失败: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/process/all/parallel-batch", response_model=ProcessAllImagesResponse)
+async def process_all_images_parallel_batch(request: ProcessAllImagesParallelBatchRequest):
+    """
+    流水线批量处理所有图片：下载、解码、推理、写库分阶段并行，阶段之间通过有界队列连接
+    
+    - **limit**: 限制处理数量，None表示处理所有
+    - **skip_processed**: 是否跳过已处理的图片（默认True）
+    - **force_reprocess**: 是否强制重新处理（即使已存在，默认False）
+    - **approximate_count**: 总数是否使用统计信息估算（默认False，精确计数需要扫描两张表）
+    - **max_workers**: 下载阶段线程数，None表示使用配置值
+    - **batch_size_per_thread**: 每次批量检查是否已处理的图片数量（默认100）
+    - **full_rebuild**: 全量重建（默认False）：忽略 skip_processed/force_reprocess 处理所有图片，写入影子表，
+      完成后建索引并切换为正式表，正式表上没有逐行更新；失败的图片保留旧向量。同一时间只能有一个全量重建（跨进程），
+      已有重建在运行时返回409；多进程部署时不可用（返回503）
+    
+    响应中的 stage_stats 给出各阶段吞吐、利用率和队列深度，用于定位瓶颈阶段
+    """
+    if request.full_rebuild:
+        _require_single_worker("全量重建", alternative="")
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_io_executor(), _process_all_images_parallel_batch, request)
+
+
+@app.post("/jobs/backfill")
+def start_backfill_job(request: BackfillJobRequest):
+    """
+    创建并启动后台回填任务，立即返回任务状态
+    
+    任务按主键分页处理 ecai.tb_image，每页完成后把断点写入本地文件，
+    暂停或服务重启后可以从断点继续，已完成的ID范围不会重新扫描；多进程部署时不可用
+    
+    /jobs/backfill* 接口会同步写入并fsync任务状态文件，定义为普通函数，由FastAPI在线程池中执行，不阻塞事件循环
+    """
+    _require_single_worker()
+    try:
+        return get_backfill_manager().start(
+            limit=request.limit,
+            skip_processed=request.skip_processed,
+            force_reprocess=request.force_reprocess,
+            page_size=request.page_size
+        )
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+
+@app.get("/jobs/backfill")
+def list_backfill_jobs():
+    """列出所有回填任务（按创建时间倒序）"""
+    _require_single_worker()
+    return get_backfill_manager().list_jobs()
+
+
+@app.get("/jobs/backfill/{job_id}")
+def get_backfill_job(job_id: str):
+    """查询回填任务状态：断点、计数和失败ID"""
+    _require_single_worker()
+    try:
+        return get_backfill_manager().status(job_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"回填任务不存在: {job_id}")
+
+
+@app.post("/jobs/backfill/{job_id}/pause")
+def pause_backfill_job(job_id: str):
+    """暂停回填任务：当前页处理完并写入断点后停止"""
+    _require_single_worker()
+    try:
+        return get_backfill_manager().pause(job_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"回填任务不存在: {job_id}")
+
+
+@app.post("/jobs/backfill/{job_id}/resume")
+def resume_backfill_job(job_id: str):
+    """从断点恢复暂停、中断或失败的回填任务"""
+    _require_single_worker()
+    try:
+        return get_backfill_manager().resume(job_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"回填任务不存在: {job_id}")
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+
 if __name__ == "__main__":
     uvicorn.run(
         "app:app",
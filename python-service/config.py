@@ -3,7 +3,7 @@
 支持从环境变量读取配置
 """
 import os
-from typing import Optional
+from typing import List, Optional
 
 try:
     from pydantic_settings import BaseSettings
@@ -25,10 +25,22 @@ class Settings(BaseSettings):
     # 服务配置
     api_host: str = "0.0.0.0"
     api_port: int = 8000
+    api_workers: int = 1  # 服务工作进程数，每个进程加载自己的模型（run.py --workers 会写入环境变量传给各进程）；大于1时不运行后台回填任务
+    api_reload: bool = True  # 单进程启动时是否自动重载代码（开发模式），多进程时忽略
+    tf_intra_op_threads: int = 0  # TensorFlow单个算子内部线程数，0表示自动：多进程或启用解码子进程时为 (CPU核数-解码子进程数)/进程数，否则由TensorFlow决定
+    tf_inter_op_threads: int = 0  # TensorFlow并行执行算子的线程数，0表示自动（同上）
     
     # 模型配置
     model_input_size: int = 224  # MobileNetV2输入尺寸
     model_alpha: float = 1.0  # MobileNetV2 alpha参数
+    inference_mode: str = "predict"  # 推理方式：predict 使用 model.predict；function 使用预先trace的tf.function
+    inference_batch_buckets: List[int] = [1, 4, 8, 16, 32]  # function模式下预先trace的批次大小，输入补齐到不小于它的最小桶
+    fused_preprocessing: bool = False  # 模型直接接收uint8图片，像素缩放和L2归一化在计算图内完成
+    preprocess_mode: str = "legacy"  # 像素缩放方式：legacy 缩放到[0,1]（历史数据）；mobilenet_v2 缩放到[-1,1]（与ImageNet权重一致）
+    
+    # 图片解码配置
+    jpeg_draft_decode: bool = False  # JPEG按DCT缩放直接解码到接近输入尺寸再缩放（大图解码快数倍，特征向量有轻微偏差，见 scripts/benchmark_decode.py）
+    decode_processes: int = 0  # 整台机器的图片解码子进程总数（结果经共享内存返回），多进程部署时平均分给各工作进程，0表示在线程中解码；CPU推理节点建议设为核数的一半左右
     
     # GPU配置
     gpu_memory_growth: bool = True  # 允许GPU内存动态增长
@@ -36,10 +48,64 @@ class Settings(BaseSettings):
     
     # 批量处理配置
     batch_size: int = 32  # GPU批量推理的批次大小
-    download_workers: int = 8  # 并行下载图片的线程数
+    download_workers: int = 8  # 批量下载图片时每批的并发数
+    download_max_connections: int = 64  # 共享下载器的全局并发上限（同时也是连接池大小）
+    download_max_per_host: int = 16  # 共享下载器对单个主机的并发上限
+    download_timeout: float = 30.0  # 单张图片下载超时（秒）
+    download_http2: bool = False  # 是否启用HTTP/2（需要安装h2：pip install httpx[http2]）
+    download_keepalive_expiry: float = 30.0  # 空闲keep-alive连接的保留时间（秒）
+    image_cache_enabled: bool = False  # 是否启用本地磁盘图片缓存（重新处理时从磁盘读取，不再访问CDN）
+    image_cache_dir: str = "image_cache"  # 磁盘图片缓存目录
+    image_cache_max_bytes: int = 10 * 1024 ** 3  # 磁盘图片缓存大小上限（字节），超出后按最近最少使用淘汰
+    image_cache_fresh_seconds: float = 86400.0  # 缓存在该时间内直接使用，超过后用ETag/Last-Modified向源站确认
+    tensor_cache_enabled: bool = False  # 是否缓存解码缩放后的uint8图片数组（更换模型重新提取特征时跳过下载和解码）
+    tensor_cache_dir: str = "tensor_cache"  # 张量缓存目录（内存映射分片文件 + SQLite索引）
+    tensor_cache_shard_size: int = 4096  # 每个分片文件容纳的图片数（224尺寸约 600 MB/分片）
+    embedding_cache_enabled: bool = True  # /extract/url 是否按URL缓存特征向量（进程内LRU）
+    embedding_cache_max_entries: int = 20000  # 特征向量缓存条目上限（1280维float32约5 KB/条）
+    embedding_cache_ttl_seconds: float = 3600.0  # 缓存条目有效期（秒），0表示不过期
+    embedding_cache_dtype: str = "float32"  # 缓存存储精度：float32 与重新计算的结果一致；float16 内存减半，误差约1e-3
+    embedding_cache_db_lookup: bool = False  # 缓存未命中时先按URL查 ecai.tb_image 并读取已保存的向量（需要 tb_image.url 上有索引）
     db_batch_size: int = 100  # 批量保存到数据库的批次大小
+    image_url_cache_size: int = 100000  # 图片ID -> URL 进程内LRU缓存条目数，0表示不缓存
+    processed_index_enabled: bool = True  # 启动时把已处理的 image_id 加载到内存有序数组，跳过检查不再查询数据库（每个工作进程各加载一份，1亿条约800MB/进程）
+    processed_index_reconcile_seconds: float = 600.0  # 已处理ID索引与数据库对账的间隔（秒），0表示只在启动时加载
+    db_write_strategy: str = "auto"  # 批量写入方式：auto 按行数自动选择；values 多行VALUES upsert；copy COPY批量写入；executemany 逐行写入
+    db_values_page_size: int = 100  # values方式每条INSERT语句包含的行数
+    db_copy_min_rows: int = 50  # auto方式下行数达到该值时改用COPY写入（二进制COPY几乎没有逐行格式化开销，只有小批次时多行VALUES的往返次数更少）
+    db_copy_binary: bool = True  # COPY批量写入是否使用二进制格式（vector列直接传输float32字节）
+    discover_page_size: int = 1000  # 按主键分页查找待处理图片时每页的行数
     process_chunk_size: int = 500  # 每次处理的图片数量（避免一次性处理过多）
     parallel_workers: int = 4  # 并行处理批次的最大线程数
+    io_executor_workers: int = 32  # 进程级共享I/O线程池大小（/process/all/parallel 等逐张处理任务）
+    decode_executor_workers: int = 4  # 进程级共享解码线程池大小（在线接口的图片解码和预处理），启用解码子进程时不少于子进程数
+    db_executor_workers: int = 8  # 进程级共享数据库线程池大小（不应超过数据库连接池上限20）
+    inference_max_wait_ms: int = 10  # 共享推理批处理器凑批的最长等待时间（毫秒），达到batch_size立即推理
+    
+    # 在线接口（/extract/url、/extract/upload）微批配置
+    online_batch_size: int = 16  # 在线请求合并推理的最大批次大小
+    online_max_latency_ms: int = 5  # 在线请求为凑批最多额外等待的时间（毫秒）
+    
+    # 流水线配置（下载 -> 解码 -> 推理 -> 写库 分阶段并行）
+    pipeline_queue_size: int = 256  # 阶段之间有界队列的容量（队列满时上游阻塞，形成背压）
+    pipeline_download_workers: int = 16  # 下载阶段线程数
+    pipeline_decode_workers: int = 4  # 解码/预处理阶段线程数，启用解码子进程时不少于子进程数
+    pipeline_db_workers: int = 2  # 写库阶段线程数
+    pipeline_db_batch_size: int = 1000  # 写库阶段每批行数（按行数自动选择写入方式）
+    pipeline_batch_wait_ms: int = 50  # 推理/写库阶段凑批的最长等待时间（毫秒）
+    pipeline_report_interval: float = 10.0  # 输出阶段吞吐和队列深度日志的间隔（秒）
+    pipeline_max_concurrent_runs: int = 2  # 进程内同时运行的流水线数量上限（接口和回填任务共用），超出的排队等待，避免耗尽数据库连接池
+    
+    # 后台回填任务配置
+    backfill_checkpoint_dir: str = "backfill_jobs"  # 断点文件目录（每个任务一个JSON文件）
+    backfill_page_size: int = 5000  # 每页处理的图片数量，每页完成后写一次断点
+    backfill_auto_resume: bool = False  # 服务启动时是否自动恢复上次被中断的任务
+    backfill_max_failed_ids: int = 1000  # 断点中保留的失败图片ID数量上限（保留最近的）
+    
+    # 大批量回填（scripts/bulk_backfill.py：删除HNSW索引 -> 写入 -> 重建索引）
+    bulk_load_maintenance_work_mem: str = "2GB"  # 重建HNSW索引时的 maintenance_work_mem
+    bulk_load_parallel_workers: int = 4  # 重建HNSW索引时的 max_parallel_maintenance_workers
+    bulk_load_idle_check_seconds: float = 10.0  # 删除索引前观察索引是否仍被在线检索扫描的时长（秒）
     
     class Config:
         env_file = ".env"
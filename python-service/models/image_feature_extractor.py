@@ -7,15 +7,36 @@ import logging
 import numpy as np
 import tensorflow as tf
 from PIL import Image
-import requests
-from io import BytesIO
-from typing import List, Optional, Union, Tuple
+from typing import Callable, Dict, List, Optional, Union, Tuple
 from pathlib import Path
-from concurrent.futures import ThreadPoolExecutor, as_completed
 from config import settings
+from utils.downloader import get_image_downloader
+from utils.image_decode import open_image, resize_to_array, decode_image
+from utils.decode_pool import get_decode_pool
 
 logger = logging.getLogger(__name__)
 
+# 预处理模式 -> 写入 tb_hsx_img_value.model_version 的版本号
+# legacy: 像素缩放到[0, 1]（历史数据使用的方式）
+# mobilenet_v2: 像素缩放到[-1, 1]，与 tf.keras.applications.mobilenet_v2.preprocess_input 一致
+MODEL_VERSIONS = {
+    'legacy': 'MobileNetV2-GPU',
+    'mobilenet_v2': 'MobileNetV2-GPU-v2'
+}
+
+# 预处理模式 -> (缩放系数, 偏移)，像素值 x 变换为 x * scale + offset
+PIXEL_SCALING = {
+    'legacy': (1.0 / 255.0, 0.0),
+    'mobilenet_v2': (1.0 / 127.5, -1.0)
+}
+
+
+def _available_cpus() -> int:
+    """当前进程可用的CPU核数（容器中按CPU亲和性计算）"""
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
 
 class ImageFeatureExtractor:
     """图片特征提取器"""
@@ -24,9 +45,44 @@ class ImageFeatureExtractor:
         self.model: Optional[tf.keras.Model] = None
         self.use_gpu: bool = False
         self.gpu_device: str = '/GPU:0'
+        # function推理模式下：批次大小桶 -> 固定输入签名的concrete function
+        self._inference_buckets: List[int] = []
+        self._inference_functions: Dict[int, Callable] = {}
+        # 融合预处理：模型输入为uint8，缩放和L2归一化在图内完成
+        self.fused_preprocessing: bool = settings.fused_preprocessing
+        self._input_dtype = np.uint8 if self.fused_preprocessing else np.float32
+        self.preprocess_mode: str = settings.preprocess_mode
+        if self.preprocess_mode not in MODEL_VERSIONS:
+            raise ValueError(f"不支持的预处理模式: {self.preprocess_mode}，可选: {list(MODEL_VERSIONS)}")
+        self._setup_threads()
         self._setup_gpu()
         self._load_model()
     
+    def _setup_threads(self):
+        """配置TensorFlow线程数（必须在TensorFlow运行时初始化前设置）
+        
+        多进程部署或启用解码子进程时，默认把解码子进程之外的CPU核数按进程数平分，
+        避免进程之间、推理与解码之间争抢CPU
+        """
+        intra_op = settings.tf_intra_op_threads
+        inter_op = settings.tf_inter_op_threads
+        if settings.api_workers > 1 or settings.decode_processes > 0:
+            # decode_processes 是整台机器的解码子进程总数
+            inference_cpus = max(1, _available_cpus() - max(0, settings.decode_processes))
+            per_worker = max(1, inference_cpus // max(1, settings.api_workers))
+            intra_op = intra_op or per_worker
+            inter_op = inter_op or per_worker
+        try:
+            if intra_op:
+                tf.config.threading.set_intra_op_parallelism_threads(intra_op)
+            if inter_op:
+                tf.config.threading.set_inter_op_parallelism_threads(inter_op)
+            if intra_op or inter_op:
+                logger.info(f"TensorFlow线程数: intra_op={intra_op or '自动'}，inter_op={inter_op or '自动'}")
+        except RuntimeError as e:
+            # TensorFlow运行时已初始化后无法再修改
+            logger.warning(f"无法设置TensorFlow线程数（运行时已初始化）: {e}")
+    
     def _setup_gpu(self):
         """配置GPU设置"""
         try:
@@ -93,12 +149,19 @@ class ImageFeatureExtractor:
                 # 构建特征提取模型
                 # 输入：图片张量
                 # 输出：特征向量（1280维，对于alpha=1.0）
-                self.model = base_model
+                if self.fused_preprocessing:
+                    self.model = self._build_fused_model(base_model)
+                else:
+                    self.model = base_model
                 
-                # 预热模型（首次推理通常较慢）
-                logger.info(f"预热模型（使用{device_info}）...")
-                dummy_input = np.random.random((1, settings.model_input_size, settings.model_input_size, 3))
-                _ = self.model.predict(dummy_input, verbose=0)
+                if settings.inference_mode == "function":
+                    # 为每个批次大小桶trace并预热，生产环境中不再发生retrace
+                    self._build_inference_functions()
+                else:
+                    # 预热模型（首次推理通常较慢）
+                    logger.info(f"预热模型（使用{device_info}）...")
+                    dummy_input = np.zeros((1, settings.model_input_size, settings.model_input_size, 3), dtype=self._input_dtype)
+                    _ = self.model.predict(dummy_input, verbose=0)
             
             logger.info(f"MobileNetV2模型加载完成（使用{device_info}）")
             
@@ -110,22 +173,74 @@ class ImageFeatureExtractor:
             logger.error(f"模型加载失败: {e}")
             raise
     
+    def _build_fused_model(self, base_model: tf.keras.Model) -> tf.keras.Model:
+        """构建融合预处理的导出模型
+        
+        输入uint8 (N, H, W, 3)，图内完成类型转换、像素缩放、特征提取和L2归一化，
+        输出可以直接写库的归一化特征向量
+        """
+        size = settings.model_input_size
+        scale, offset = PIXEL_SCALING[self.preprocess_mode]
+        inputs = tf.keras.Input(shape=(size, size, 3), dtype=tf.uint8, name='image_uint8')
+        # Rescaling层会先把输入转换为float32
+        x = tf.keras.layers.Rescaling(scale, offset=offset, name='scale_pixels')(inputs)
+        features = base_model(x, training=False)
+        outputs = tf.keras.layers.Lambda(
+            lambda f: f / (tf.norm(f, axis=1, keepdims=True) + 1e-8),
+            name='l2_normalize'
+        )(features)
+        return tf.keras.Model(inputs=inputs, outputs=outputs, name='mobilenet_v2_fused')
+    
+    def _build_inference_functions(self):
+        """为每个批次大小桶trace一个固定输入签名的tf.function并预热"""
+        size = settings.model_input_size
+        model = self.model
+        
+        @tf.function
+        def serve(images):
+            return model(images, training=False)
+        
+        self._inference_buckets = sorted({bucket for bucket in settings.inference_batch_buckets if bucket > 0})
+        if not self._inference_buckets:
+            raise ValueError("inference_batch_buckets 不能为空")
+        
+        for bucket in self._inference_buckets:
+            spec = tf.TensorSpec(shape=(bucket, size, size, 3), dtype=tf.as_dtype(self._input_dtype))
+            concrete_function = serve.get_concrete_function(spec)
+            # 预热：首次执行会完成图优化和显存分配
+            concrete_function(tf.zeros((bucket, size, size, 3), dtype=tf.as_dtype(self._input_dtype)))
+            self._inference_functions[bucket] = concrete_function
+        
+        logger.info(f"已预先trace推理函数，批次大小桶: {self._inference_buckets}")
+    
+    def _run_model(self, img_batch: np.ndarray) -> np.ndarray:
+        """执行模型前向计算，返回特征 (N, D)；融合预处理模式下已完成L2归一化"""
+        if not self._inference_functions:
+            return self.model.predict(img_batch, verbose=0, batch_size=len(img_batch))
+        
+        # 超过最大桶的批次拆分执行，不足桶大小的补零，保证输入形状始终命中已trace的签名
+        max_bucket = self._inference_buckets[-1]
+        outputs = []
+        for start in range(0, len(img_batch), max_bucket):
+            chunk = np.asarray(img_batch[start:start + max_bucket], dtype=self._input_dtype)
+            count = len(chunk)
+            bucket = next(b for b in self._inference_buckets if b >= count)
+            if bucket > count:
+                padding = np.zeros((bucket - count,) + chunk.shape[1:], dtype=self._input_dtype)
+                chunk = np.concatenate([chunk, padding], axis=0)
+            features = self._inference_functions[bucket](tf.constant(chunk))
+            outputs.append(features.numpy()[:count])
+        return np.concatenate(outputs, axis=0)
+    
+    def _fetch_image_bytes(self, url: str) -> bytes:
+        """下载图片原始字节（共享下载器，按主机复用连接），失败抛出异常"""
+        return get_image_downloader().download(url)
+    
     def _load_image_from_url(self, url: str) -> Image.Image:
         """从URL加载图片"""
         try:
             logger.info(f"从URL加载图片: {url}")
-            # 禁用代理，避免代理连接问题
-            response = requests.get(
-                url, 
-                timeout=30,
-                proxies={
-                    'http': None,
-                    'https': None
-                },
-                verify=True  # 验证SSL证书
-            )
-            response.raise_for_status()
-            image = Image.open(BytesIO(response.content))
+            image = open_image(self._fetch_image_bytes(url))
             return image
         except Exception as e:
             logger.error(f"从URL加载图片失败: {e}")
@@ -135,68 +250,86 @@ class ImageFeatureExtractor:
         """从本地路径加载图片"""
         try:
             logger.info(f"从本地路径加载图片: {path}")
-            image = Image.open(path)
+            image = open_image(path)
             return image
         except Exception as e:
             logger.error(f"从本地路径加载图片失败: {e}")
             raise
     
-    def _preprocess_image(self, image: Image.Image) -> np.ndarray:
-        """预处理图片"""
-        # 转换为RGB（处理RGBA等格式）
-        if image.mode != 'RGB':
-            image = image.convert('RGB')
+    def resize_image(self, image: Image.Image) -> np.ndarray:
+        """转换为RGB并缩放到模型输入尺寸，返回uint8数组 (H, W, 3)，与预处理模式无关"""
+        return resize_to_array(image)
+    
+    def scale_pixels(self, pixels: np.ndarray) -> np.ndarray:
+        """把 resize_image 输出的uint8数组转换为模型输入（支持单张或批次）"""
+        if self.fused_preprocessing:
+            # 像素缩放在计算图内完成，这里直接输出uint8，避免float32中间拷贝
+            return pixels
         
-        # 调整大小到模型输入尺寸
-        image = image.resize((settings.model_input_size, settings.model_input_size))
+        if self.preprocess_mode == 'mobilenet_v2':
+            # 转换为numpy数组并缩放到[-1, 1]
+            return pixels.astype(np.float32) / 127.5 - 1.0
         
         # 转换为numpy数组并归一化到[0, 1]
-        img_array = np.array(image, dtype=np.float32) / 255.0
+        return pixels.astype(np.float32) / 255.0
+    
+    def preprocess_image(self, image: Image.Image) -> np.ndarray:
+        """预处理单张图片，返回不带batch维度的数组 (H, W, 3)"""
+        return self.scale_pixels(self.resize_image(image))
+    
+    def decode_image_bytes(self, image_bytes: bytes) -> np.ndarray:
+        """解码图片字节并缩放到模型输入尺寸，返回uint8数组 (H, W, 3)
         
+        配置了 decode_processes 时在解码子进程中执行，调用线程只等待结果
+        """
+        decode_pool = get_decode_pool()
+        if decode_pool is not None:
+            return decode_pool.decode(image_bytes)
+        return decode_image(image_bytes)
+    
+    def preprocess_image_bytes(self, image_bytes: bytes) -> np.ndarray:
+        """解码图片字节并预处理，返回不带batch维度的数组 (H, W, 3)"""
+        return self.scale_pixels(self.decode_image_bytes(image_bytes))
+    
+    def _preprocess_image(self, image: Image.Image) -> np.ndarray:
+        """预处理图片"""
         # 添加batch维度
-        img_array = np.expand_dims(img_array, axis=0)
-        
-        return img_array
+        return np.expand_dims(self.preprocess_image(image), axis=0)
     
-    def extract_features_from_url(self, url: str) -> List[float]:
+    def extract_features_from_url(self, url: str) -> np.ndarray:
         """从URL提取特征向量"""
         image = self._load_image_from_url(url)
         return self.extract_features_from_image(image)
     
-    def extract_features_from_path(self, path: Union[str, Path]) -> List[float]:
+    def extract_features_from_path(self, path: Union[str, Path]) -> np.ndarray:
         """从本地路径提取特征向量"""
         image = self._load_image_from_path(path)
         return self.extract_features_from_image(image)
     
-    def extract_features_from_bytes(self, image_bytes: bytes) -> List[float]:
+    def extract_features_from_bytes(self, image_bytes: bytes) -> np.ndarray:
         """从字节数据提取特征向量"""
-        image = Image.open(BytesIO(image_bytes))
+        image = open_image(image_bytes)
         return self.extract_features_from_image(image)
     
-    def extract_features_from_image(self, image: Image.Image) -> List[float]:
-        """从PIL Image对象提取特征向量"""
+    def extract_features_from_image(self, image: Image.Image) -> np.ndarray:
+        """从PIL Image对象提取特征向量，返回float32一维数组 (D,)"""
         if self.model is None:
             raise RuntimeError("模型未加载")
         
         try:
             # 预处理图片
             img_array = self._preprocess_image(image)
-            
-            # 在指定设备上提取特征（明确使用GPU）
-            with tf.device(self.gpu_device):
-                # 提取特征
-                features = self.model.predict(img_array, verbose=0)
-            
-            # 转换为列表并归一化（L2归一化，用于余弦相似度计算）
-            feature_vector = features[0]
-            feature_vector = feature_vector / (np.linalg.norm(feature_vector) + 1e-8)
-            
-            return feature_vector.tolist()
+            return self.extract_features_from_arrays(img_array)[0]
             
         except Exception as e:
             logger.error(f"特征提取失败: {e}")
             raise
     
+    @property
+    def model_version(self) -> str:
+        """当前预处理模式对应的模型版本号，写入 tb_hsx_img_value.model_version"""
+        return MODEL_VERSIONS[self.preprocess_mode]
+    
     def get_feature_dimension(self) -> int:
         """获取特征向量维度"""
         if self.model is None:
@@ -205,83 +338,82 @@ class ImageFeatureExtractor:
     
     def _preprocess_images_batch(self, images: List[Image.Image]) -> np.ndarray:
         """批量预处理图片"""
-        img_arrays = []
-        for image in images:
-            # 转换为RGB（处理RGBA等格式）
-            if image.mode != 'RGB':
-                image = image.convert('RGB')
-            
-            # 调整大小到模型输入尺寸
-            image = image.resize((settings.model_input_size, settings.model_input_size))
-            
-            # 转换为numpy数组并归一化到[0, 1]
-            img_array = np.array(image, dtype=np.float32) / 255.0
-            img_arrays.append(img_array)
+        img_arrays = [self.preprocess_image(image) for image in images]
         
         # 堆叠成批次
         return np.stack(img_arrays, axis=0)
     
-    def extract_features_batch(self, images: List[Image.Image]) -> List[List[float]]:
+    def extract_features_batch(self, images: List[Image.Image]) -> np.ndarray:
         """批量提取特征向量
         
         Args:
             images: PIL Image对象列表
             
         Returns:
-            特征向量列表，每个元素是一个特征向量
+            float32特征矩阵 (N, D)，每行是一个L2归一化后的特征向量
         """
         if self.model is None:
             raise RuntimeError("模型未加载")
         
         if not images:
-            return []
+            return self._empty_features()
         
-        try:
-            # 批量预处理图片
-            img_batch = self._preprocess_images_batch(images)
+        # 批量预处理图片
+        img_batch = self._preprocess_images_batch(images)
+        return self.extract_features_from_arrays(img_batch)
+    
+    def extract_features_from_arrays(self, img_batch: np.ndarray) -> np.ndarray:
+        """对已预处理的图片批次 (N, H, W, 3) 提取特征向量
+        
+        Args:
+            img_batch: preprocess_image 输出堆叠而成的数组
             
+        Returns:
+            float32特征矩阵 (N, D)，顺序与输入一致
+        """
+        if self.model is None:
+            raise RuntimeError("模型未加载")
+        
+        if len(img_batch) == 0:
+            return self._empty_features()
+        
+        try:
             # 在指定设备上批量提取特征
             with tf.device(self.gpu_device):
                 # 批量推理
-                features = self.model.predict(img_batch, verbose=0, batch_size=len(images))
+                features = self._run_model(img_batch)
             
-            # 转换为列表并归一化（L2归一化，用于余弦相似度计算）
-            feature_vectors = []
-            for feature_vector in features:
-                normalized = feature_vector / (np.linalg.norm(feature_vector) + 1e-8)
-                feature_vectors.append(normalized.tolist())
-            
-            return feature_vectors
+            return self._finalize_features(features)
             
         except Exception as e:
             logger.error(f"批量特征提取失败: {e}")
             raise
     
-    def _download_image_safe(self, url: str) -> Optional[Image.Image]:
-        """安全下载图片，失败返回None"""
+    def _finalize_features(self, features) -> np.ndarray:
+        """转换为连续的float32矩阵 (N, D)；非融合模式下一次性完成整批L2归一化"""
+        features = np.ascontiguousarray(features, dtype=np.float32)
+        if not self.fused_preprocessing:
+            # 向量化L2归一化（用于余弦相似度计算）
+            features /= np.linalg.norm(features, axis=1, keepdims=True) + 1e-8
+        return features
+    
+    def _empty_features(self) -> np.ndarray:
+        return np.empty((0, self.get_feature_dimension()), dtype=np.float32)
+    
+    def download_image_bytes(self, url: str) -> Optional[bytes]:
+        """安全下载图片原始字节，失败返回None"""
         try:
-            response = requests.get(
-                url, 
-                timeout=30,
-                proxies={
-                    'http': None,
-                    'https': None
-                },
-                verify=True
-            )
-            response.raise_for_status()
-            image = Image.open(BytesIO(response.content))
-            return image
+            return self._fetch_image_bytes(url)
         except Exception as e:
             logger.warning(f"从URL加载图片失败 {url}: {e}")
             return None
     
     def download_images_parallel(self, urls: List[str], max_workers: Optional[int] = None) -> List[Optional[Image.Image]]:
-        """并行下载多张图片
+        """并行下载多张图片（使用共享异步下载器，复用连接）
         
         Args:
             urls: 图片URL列表
-            max_workers: 最大并发数，None表示使用配置值
+            max_workers: 本次调用的最大并发数，None表示使用配置值
             
         Returns:
             图片列表，失败的位置为None
@@ -289,27 +421,21 @@ class ImageFeatureExtractor:
         if max_workers is None:
             max_workers = settings.download_workers
         
-        images = [None] * len(urls)
+        contents = get_image_downloader().download_many(urls, concurrency=max_workers)
         
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            # 提交所有下载任务
-            future_to_index = {
-                executor.submit(self._download_image_safe, url): idx 
-                for idx, url in enumerate(urls)
-            }
-            
-            # 收集结果
-            for future in as_completed(future_to_index):
-                idx = future_to_index[future]
+        images = []
+        for url, image_bytes in zip(urls, contents):
+            image = None
+            if image_bytes is not None:
                 try:
-                    images[idx] = future.result()
+                    image = open_image(image_bytes)
                 except Exception as e:
-                    logger.warning(f"下载图片失败 (索引 {idx}): {e}")
-                    images[idx] = None
+                    logger.warning(f"解码图片失败 {url}: {e}")
+            images.append(image)
         
         return images
     
-    def extract_features_from_urls_batch(self, urls: List[str], batch_size: Optional[int] = None) -> List[Optional[List[float]]]:
+    def extract_features_from_urls_batch(self, urls: List[str], batch_size: Optional[int] = None) -> List[Optional[np.ndarray]]:
         """批量从URL提取特征向量（带并行下载和批量推理）
         
         Args:
@@ -317,7 +443,7 @@ class ImageFeatureExtractor:
             batch_size: GPU批量推理的批次大小，None表示使用配置值
             
         Returns:
-            特征向量列表，失败的位置为None
+            特征向量列表（float32一维数组，共享同一块连续内存），失败的位置为None
         """
         if batch_size is None:
             batch_size = settings.batch_size
@@ -340,14 +466,14 @@ class ImageFeatureExtractor:
         
         # 批量提取特征
         valid_indices, valid_images = zip(*valid_data)
-        all_features = []
+        batch_features_list = []
         
         # 分批处理
         for i in range(0, len(valid_images), batch_size):
             batch_images = valid_images[i:i+batch_size]
-            batch_features = self.extract_features_batch(list(batch_images))
-            all_features.extend(batch_features)
+            batch_features_list.append(self.extract_features_batch(list(batch_images)))
             logger.debug(f"已处理 {min(i+batch_size, len(valid_images))}/{len(valid_images)} 张图片")
+        all_features = np.concatenate(batch_features_list, axis=0)
         
         # 构建完整的结果列表（包含失败的位置）
         result = [None] * len(urls)
@@ -0,0 +1,182 @@
+"""
+共享推理批处理器
+所有线程提交已预处理的图片数组，由单个推理线程动态凑批后统一调用模型
+"""
+import time
+import queue
+import logging
+import threading
+from threading import Lock
+from concurrent.futures import Future
+from typing import List, Optional
+
+import numpy as np
+
+from config import settings
+from models.image_feature_extractor import ImageFeatureExtractor, get_feature_extractor
+
+logger = logging.getLogger(__name__)
+
+
+class _ReadyBatch:
+    """调用方已凑好的批次，推理线程取到后立即执行，不再等待凑批"""
+    
+    __slots__ = ('items',)
+    
+    def __init__(self, items: list):
+        self.items = items
+
+
+class InferenceBatcher:
+    """动态批处理推理引擎
+    
+    调用方通过 submit 提交单张图片的预处理数组 (H, W, 3)，立即获得一个 Future；
+    推理线程在凑满 max_batch_size 或等待超过 max_wait_ms 时执行一次批量推理，
+    并把每个向量设置到对应的 Future 上。模型只被这一个线程调用，避免多线程争用。
+    已经按自己的延迟预算凑好批次的调用方（在线请求合并器）使用 submit_ready，批次不再等待 max_wait_ms。
+    """
+    
+    def __init__(
+        self,
+        extractor: ImageFeatureExtractor,
+        max_batch_size: Optional[int] = None,
+        max_wait_ms: Optional[int] = None
+    ):
+        self.extractor = extractor
+        self.max_batch_size = max_batch_size or settings.batch_size
+        self.max_wait = (max_wait_ms if max_wait_ms is not None else settings.inference_max_wait_ms) / 1000.0
+        
+        self._queue: queue.Queue = queue.Queue()
+        # 凑批过程中取到的已凑好批次，下一轮优先执行
+        self._carry: Optional[_ReadyBatch] = None
+        self._stopped = False
+        
+        # 统计信息
+        self._stats_lock = Lock()
+        self._batches = 0
+        self._items = 0
+        self._full_batches = 0
+        self._inference_seconds = 0.0
+        
+        self._thread = threading.Thread(target=self._run, name="inference-batcher", daemon=True)
+        self._thread.start()
+    
+    def submit(self, img_array: np.ndarray) -> Future:
+        """提交单张图片的预处理数组，返回该图片特征向量的Future"""
+        if self._stopped:
+            raise RuntimeError("推理批处理器已关闭")
+        future: Future = Future()
+        self._queue.put((img_array, future))
+        return future
+    
+    def submit_many(self, img_batch) -> List[Future]:
+        """提交多张图片（可迭代的 (H, W, 3) 数组），返回与输入顺序一致的Future列表"""
+        return [self.submit(img_array) for img_array in img_batch]
+    
+    def submit_ready(self, img_batch) -> List[Future]:
+        """提交调用方已凑好的批次：推理线程空闲时立即作为一个批次执行，不与其他请求合并、不再等待
+        
+        Returns:
+            与输入顺序一致的Future列表
+        """
+        if self._stopped:
+            raise RuntimeError("推理批处理器已关闭")
+        items = [(img_array, Future()) for img_array in img_batch]
+        if items:
+            self._queue.put(_ReadyBatch(items))
+        return [item[1] for item in items]
+    
+    def _collect(self) -> list:
+        """阻塞等待第一条请求，然后在截止时间前尽量凑满一个批次；已凑好的批次直接返回"""
+        if self._carry is not None:
+            batch, self._carry = self._carry, None
+            return batch.items
+        first = self._queue.get()
+        if isinstance(first, _ReadyBatch):
+            return first.items
+        items = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(items) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if isinstance(item, _ReadyBatch):
+                # 已凑好的批次不拆开，先执行当前批次，下一轮再执行它
+                self._carry = item
+                break
+            items.append(item)
+        return items
+    
+    def _run(self):
+        """推理线程主循环"""
+        while True:
+            items = self._collect()
+            # 过滤掉关闭标记和已被调用方取消的请求
+            items = [item for item in items if item is not None and item[1].set_running_or_notify_cancel()]
+            if items:
+                self._infer(items)
+            if self._stopped and self._queue.empty() and self._carry is None:
+                return
+    
+    def _infer(self, items: list):
+        """对一个批次执行推理并设置各请求的结果"""
+        futures = [item[1] for item in items]
+        start = time.perf_counter()
+        try:
+            img_batch = np.stack([item[0] for item in items], axis=0)
+            feature_vectors = self.extractor.extract_features_from_arrays(img_batch)
+        except Exception as e:
+            logger.error(f"共享批量推理失败（{len(items)} 张）: {e}")
+            for future in futures:
+                future.set_exception(e)
+            return
+        
+        elapsed = time.perf_counter() - start
+        for future, feature_vector in zip(futures, feature_vectors):
+            future.set_result(feature_vector)
+        
+        with self._stats_lock:
+            self._batches += 1
+            self._items += len(items)
+            self._inference_seconds += elapsed
+            if len(items) >= self.max_batch_size:
+                self._full_batches += 1
+    
+    def stats(self) -> dict:
+        """获取批处理统计：批次数、平均批大小、满批比例、排队请求数"""
+        with self._stats_lock:
+            batches = self._batches
+            return {
+                'batches': batches,
+                'items': self._items,
+                'avg_batch_size': round(self._items / batches, 2) if batches else 0.0,
+                'full_batch_ratio': round(self._full_batches / batches, 3) if batches else 0.0,
+                'inference_seconds': round(self._inference_seconds, 2),
+                'pending': self._queue.qsize(),
+                'max_batch_size': self.max_batch_size
+            }
+    
+    def close(self, timeout: Optional[float] = None):
+        """停止接收新请求，处理完已排队的请求后退出推理线程"""
+        self._stopped = True
+        self._queue.put(None)
+        self._thread.join(timeout=timeout)
+
+
+# 全局推理批处理器实例
+_inference_batcher: Optional[InferenceBatcher] = None
+_inference_batcher_lock = Lock()
+
+
+def get_inference_batcher() -> InferenceBatcher:
+    """获取共享推理批处理器单例"""
+    global _inference_batcher
+    if _inference_batcher is None:
+        with _inference_batcher_lock:
+            if _inference_batcher is None:
+                _inference_batcher = InferenceBatcher(get_feature_extractor())
+    return _inference_batcher
@@ -0,0 +1,147 @@
+"""
+在线请求合并器
+在asyncio事件循环中把并发的特征提取请求合并成批次，下载、解码和推理都不在事件循环线程中执行
+"""
+import asyncio
+import logging
+from typing import Optional
+
+import numpy as np
+
+from config import settings
+from models.image_feature_extractor import ImageFeatureExtractor, get_feature_extractor
+from models.inference_batcher import InferenceBatcher, get_inference_batcher
+from utils.downloader import AsyncImageDownloader, get_image_downloader
+from utils.executors import get_decode_executor
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncRequestCoalescer:
+    """asyncio原生的请求合并器
+    
+    每个请求由共享下载器下载、在共享解码线程池中预处理后进入合并队列；合并任务在凑满
+    max_batch_size 或超过 max_latency_ms 延迟预算时，把整批作为已凑好的批次交给共享推理批处理器
+    （submit_ready，不再叠加批处理器的 inference_max_wait_ms），推理在批处理器线程中执行。
+    合并任务提交后立即开始凑下一批，结果由单独的任务等待并分发。
+    """
+    
+    def __init__(
+        self,
+        extractor: ImageFeatureExtractor,
+        batcher: InferenceBatcher,
+        max_batch_size: Optional[int] = None,
+        max_latency_ms: Optional[int] = None,
+        downloader: Optional[AsyncImageDownloader] = None
+    ):
+        self.extractor = extractor
+        self.batcher = batcher
+        self.downloader = downloader or get_image_downloader()
+        self.max_batch_size = max_batch_size or settings.online_batch_size
+        self.max_latency = (max_latency_ms if max_latency_ms is not None else settings.online_max_latency_ms) / 1000.0
+        
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        # 等待推理结果的分发任务（保持引用，避免任务被回收）
+        self._deliveries: set = set()
+    
+    async def start(self):
+        """在当前事件循环中启动合并任务"""
+        if self._task is None:
+            self._queue = asyncio.Queue()
+            self._task = asyncio.create_task(self._run())
+            logger.info(f"在线请求合并器已启动（批次上限 {self.max_batch_size}，延迟预算 {self.max_latency * 1000:.0f}ms）")
+    
+    async def stop(self):
+        """停止合并任务"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for delivery in list(self._deliveries):
+            delivery.cancel()
+    
+    async def extract_from_bytes(self, image_bytes: bytes) -> np.ndarray:
+        """从图片字节提取特征向量"""
+        if self._task is None:
+            await self.start()
+        loop = asyncio.get_running_loop()
+        # 解码和预处理是CPU密集操作，放到共享解码线程池执行
+        img_array = await loop.run_in_executor(get_decode_executor(), self.extractor.preprocess_image_bytes, image_bytes)
+        future = loop.create_future()
+        await self._queue.put((img_array, future))
+        return await future
+    
+    async def extract_from_url(self, url: str) -> np.ndarray:
+        """从图片URL提取特征向量（下载在共享下载器的事件循环中执行，不占用线程）"""
+        image_bytes = await self.downloader.download_async(url)
+        return await self.extract_from_bytes(image_bytes)
+    
+    async def _collect(self) -> list:
+        """等待第一条请求，然后在延迟预算内尽量凑满一个批次"""
+        loop = asyncio.get_running_loop()
+        items = [await self._queue.get()]
+        deadline = loop.time() + self.max_latency
+        while len(items) < self.max_batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                items.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return items
+    
+    async def _run(self):
+        """合并任务主循环"""
+        while True:
+            items = await self._collect()
+            # 跳过客户端已断开（Future已取消）的请求
+            items = [item for item in items if not item[1].done()]
+            if not items:
+                continue
+            
+            futures = [item[1] for item in items]
+            try:
+                batch_futures = self.batcher.submit_ready([item[0] for item in items])
+            except Exception as e:
+                logger.error(f"在线批量推理提交失败（{len(items)} 张）: {e}")
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            
+            # 不等待本批推理完成，继续凑下一批
+            delivery = asyncio.create_task(self._deliver(futures, batch_futures))
+            self._deliveries.add(delivery)
+            delivery.add_done_callback(self._deliveries.discard)
+    
+    async def _deliver(self, futures: list, batch_futures: list):
+        """等待一个批次的推理结果并分发给各请求"""
+        try:
+            feature_vectors = await asyncio.gather(*(asyncio.wrap_future(f) for f in batch_futures))
+        except Exception as e:
+            logger.error(f"在线批量推理失败（{len(futures)} 张）: {e}")
+            for future in futures:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        
+        for future, feature_vector in zip(futures, feature_vectors):
+            if not future.done():
+                future.set_result(feature_vector)
+
+
+# 全局请求合并器实例
+_request_coalescer: Optional[AsyncRequestCoalescer] = None
+
+
+def get_request_coalescer() -> AsyncRequestCoalescer:
+    """获取在线请求合并器单例"""
+    global _request_coalescer
+    if _request_coalescer is None:
+        _request_coalescer = AsyncRequestCoalescer(get_feature_extractor(), get_inference_batcher())
+    return _request_coalescer
@@ -1,15 +1,36 @@
 #!/usr/bin/env python
 """
 启动脚本
+
+开发模式（单进程，自动重载）:
+    python run.py
+
+生产模式（多进程，每个进程加载自己的模型，TensorFlow线程数按 CPU核数/进程数 分配）:
+    python run.py --workers 4
 """
+import os
+import argparse
+
 import uvicorn
 from config import settings
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="启动图片特征向量提取服务")
+    parser.add_argument('--host', default=settings.api_host, help="监听地址")
+    parser.add_argument('--port', type=int, default=settings.api_port, help="监听端口")
+    parser.add_argument('--workers', type=int, default=settings.api_workers, help="工作进程数，大于1时为生产模式（不自动重载）")
+    parser.add_argument('--no-reload', action='store_true', help="单进程启动时也不自动重载代码")
+    args = parser.parse_args()
+    
+    # 工作进程重新读取配置，通过环境变量告知进程数，用于分配TensorFlow线程
+    os.environ['API_WORKERS'] = str(args.workers)
+    reload = args.workers == 1 and settings.api_reload and not args.no_reload
+    
     uvicorn.run(
         "app:app",
-        host=settings.api_host,
-        port=settings.api_port,
-        reload=True,
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        reload=reload,
         log_level="info"
     )
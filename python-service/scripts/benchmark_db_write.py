@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+"""
+对比特征向量批量写入方式的吞吐（逐行 executemany、多行 VALUES upsert 与 COPY 批量写入）
+
+在与 tb_hsx_img_value 结构相同的临时基准表上写入随机向量，统计不同批次大小下
+每种写入方式的行/秒，测试结束后删除基准表，不影响正式数据。
+
+用法:
+    python scripts/benchmark_db_write.py
+    python scripts/benchmark_db_write.py --rows 20000 --batch-sizes 10 100 500 1000 5000
+"""
+import sys
+import os
+import time
+import argparse
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from config import settings
+from utils.db import Database, FEATURE_TABLE, save_feature_vectors_batch, save_feature_vectors_copy
+
+BENCH_TABLE = "tb_hsx_img_value_bench"
+
+
+def print_section(title):
+    """打印分节标题"""
+    print("\n" + "=" * 70)
+    print(f"  {title}")
+    print("=" * 70)
+
+
+def execute(sql: str):
+    """执行一条DDL/DML语句"""
+    conn = Database.get_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(sql)
+        conn.commit()
+        cursor.close()
+    finally:
+        Database.return_connection(conn)
+
+
+def make_rows(count: int, dimension: int, start_id: int) -> list:
+    """生成随机的已归一化特征向量行"""
+    vectors = np.random.rand(count, dimension).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return [(str(start_id + i), vectors[i], dimension, 'benchmark') for i in range(count)]
+
+
+def write_executemany(rows: list, table: str) -> int:
+    return save_feature_vectors_batch(rows, table=table, strategy="executemany")
+
+
+def write_values(rows: list, table: str) -> int:
+    return save_feature_vectors_batch(rows, table=table, strategy="values")
+
+
+def write_auto(rows: list, table: str) -> int:
+    return save_feature_vectors_batch(rows, table=table, strategy="auto")
+
+
+def write_copy_binary(rows: list, table: str) -> int:
+    return save_feature_vectors_copy(rows, table=table, binary=True)
+
+
+def write_copy_text(rows: list, table: str) -> int:
+    return save_feature_vectors_copy(rows, table=table, binary=False)
+
+
+STRATEGIES = {
+    'executemany': write_executemany,
+    'values': write_values,
+    'copy_binary': write_copy_binary,
+    'copy_text': write_copy_text,
+    'auto': write_auto,
+}
+
+
+def run_strategy(name: str, rows: list, batch_size: int) -> float:
+    """使用指定方式按批次写入全部行，返回行/秒"""
+    execute(f"TRUNCATE {BENCH_TABLE}")
+    writer = STRATEGIES[name]
+    start = time.perf_counter()
+    for i in range(0, len(rows), batch_size):
+        writer(rows[i:i + batch_size], BENCH_TABLE)
+    return len(rows) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="对比特征向量批量写入方式的吞吐")
+    parser.add_argument('--rows', type=int, default=5000, help="每种写入方式写入的总行数")
+    parser.add_argument('--dimension', type=int, default=1280, help="向量维度")
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[10, 100, 500, 1000, 5000], help="每批写入的行数")
+    parser.add_argument('--with-vector-index', action='store_true', help="基准表带HNSW向量索引（默认不带，只测写入路径本身）")
+    parser.add_argument('--strategies', nargs='+', default=list(STRATEGIES), choices=list(STRATEGIES), help="要对比的写入方式")
+    args = parser.parse_args()
+    
+    print_section("准备基准表")
+    execute(f"DROP TABLE IF EXISTS {BENCH_TABLE}")
+    execute(f"CREATE TABLE {BENCH_TABLE} (LIKE {FEATURE_TABLE} INCLUDING DEFAULTS)")
+    execute(f"ALTER TABLE {BENCH_TABLE} ADD UNIQUE (image_id)")
+    if args.with_vector_index:
+        # HNSW索引的维护开销通常远大于写入本身，会掩盖不同写入方式的差异
+        execute(f"CREATE INDEX ON {BENCH_TABLE} USING hnsw (feature_vector vector_cosine_ops)")
+    rows = make_rows(args.rows, args.dimension, start_id=1)
+    print(f"auto方式: 行数 >= {settings.db_copy_min_rows} 使用copy，否则使用values（每页 {settings.db_values_page_size} 行）")
+    print(f"基准表: {BENCH_TABLE}，每种方式写入 {args.rows} 行，维度 {args.dimension}，"
+          f"HNSW索引: {'是' if args.with_vector_index else '否'}")
+    
+    results = {}
+    try:
+        for batch_size in args.batch_sizes:
+            print_section(f"批次大小: {batch_size}")
+            for name in args.strategies:
+                rows_per_second = run_strategy(name, rows, batch_size)
+                results[(name, batch_size)] = rows_per_second
+                print(f"{name:<14}{rows_per_second:>12.0f} 行/秒")
+    finally:
+        execute(f"DROP TABLE IF EXISTS {BENCH_TABLE}")
+    
+    print_section("结果汇总（行/秒）")
+    print(f"{'写入方式':<14}" + "".join(f"{'batch=' + str(b):>14}" for b in args.batch_sizes))
+    for name in args.strategies:
+        print(f"{name:<14}" + "".join(f"{results[(name, b)]:>14.0f}" for b in args.batch_sizes))
+    
+    Database.close_all()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+"""
+对比JPEG完整解码与缩小解码（PIL draft，DCT域按 1/2、1/4、1/8 缩放）的耗时和特征向量偏差
+
+对每张图片分别做 完整解码+缩放 与 缩小解码+缩放，统计每张耗时；再用当前模型提取两种方式的特征向量，
+计算余弦相似度，评估开启 JPEG_DRAFT_DECODE 后与历史数据（完整解码）的偏差。
+指定 --processes 时另外对比多线程解码与解码子进程池（DECODE_PROCESSES）的吞吐，
+子进程池按服务中的用法由解码线程逐张调用 DecodePool.decode()。
+不指定图库目录时生成多百万像素的合成JPEG（合成图的偏差只作参考，应以真实商品图为准）。
+
+用法:
+    python scripts/benchmark_decode.py --fixtures ./fixtures/images
+    python scripts/benchmark_decode.py --synthetic 50 --width 4000 --height 3000
+    python scripts/benchmark_decode.py --fixtures ./fixtures/images --no-embed
+    python scripts/benchmark_decode.py --no-embed --processes 4
+"""
+import sys
+import os
+import time
+import argparse
+from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFilter
+
+from config import settings
+from utils.image_decode import decode_image
+from utils.decode_pool import DecodePool
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.gif', '.webp')
+
+
+def print_section(title):
+    """打印分节标题"""
+    print("\n" + "=" * 70)
+    print(f"  {title}")
+    print("=" * 70)
+
+
+def load_fixtures(fixtures_dir: str) -> list:
+    """读取图库图片的原始字节"""
+    paths = []
+    for root, _, files in os.walk(fixtures_dir):
+        for name in sorted(files):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                paths.append(os.path.join(root, name))
+    images = []
+    for path in sorted(paths):
+        with open(path, 'rb') as f:
+            images.append(f.read())
+    return images
+
+
+def make_synthetic(count: int, width: int, height: int, seed: int) -> list:
+    """生成合成JPEG：渐变背景 + 随机色块和线条 + 轻微模糊，模拟商品照片的低频内容和边缘"""
+    rng = np.random.default_rng(seed)
+    images = []
+    for _ in range(count):
+        x = np.linspace(0, 1, width, dtype=np.float32)[None, :, None]
+        y = np.linspace(0, 1, height, dtype=np.float32)[:, None, None]
+        colors = rng.uniform(0, 255, size=(3, 3)).astype(np.float32)
+        background = colors[0] * (1 - x) * (1 - y) + colors[1] * x + colors[2] * y * (1 - x)
+        image = Image.fromarray(np.clip(background, 0, 255).astype(np.uint8), 'RGB')
+        draw = ImageDraw.Draw(image)
+        for _ in range(int(rng.integers(5, 20))):
+            x0, x1 = sorted(rng.integers(0, width, size=2))
+            y0, y1 = sorted(rng.integers(0, height, size=2))
+            fill = tuple(int(c) for c in rng.integers(0, 256, size=3))
+            if rng.random() < 0.5:
+                draw.ellipse((x0, y0, x1, y1), fill=fill)
+            else:
+                draw.rectangle((x0, y0, x1, y1), fill=fill)
+            draw.line((x0, y1, x1, y0), fill=(0, 0, 0), width=int(rng.integers(2, 12)))
+        image = image.filter(ImageFilter.GaussianBlur(1))
+        output = BytesIO()
+        image.save(output, format='JPEG', quality=90)
+        images.append(output.getvalue())
+    return images
+
+
+def time_decode(images: list, draft: bool, repeat: int) -> tuple:
+    """解码+缩放所有图片，返回 (uint8数组列表, 每张耗时毫秒列表)，每张取 repeat 次中的最小值"""
+    arrays, timings = [], []
+    for image_bytes in images:
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            pixels = decode_image(image_bytes, draft=draft)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        arrays.append(pixels)
+        timings.append(best * 1000)
+    return arrays, timings
+
+
+def embed(extractor, arrays: list, batch_size: int) -> np.ndarray:
+    """用当前模型批量提取特征向量"""
+    vectors = []
+    for i in range(0, len(arrays), batch_size):
+        batch = extractor.scale_pixels(np.stack(arrays[i:i + batch_size], axis=0))
+        vectors.extend(extractor.extract_features_from_arrays(batch))
+    return np.asarray(vectors, dtype=np.float32)
+
+
+def compare_parallel(images: list, workers: int, draft: bool):
+    """对比同样并发数下线程池解码（受GIL限制）与解码子进程池的吞吐
+    
+    子进程池与服务中相同：解码线程（数量同 decode_thread_count，不少于子进程数）各自逐张调用 decode()
+    """
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        start = time.perf_counter()
+        list(executor.map(lambda b: decode_image(b, draft=draft), images))
+        thread_seconds = time.perf_counter() - start
+    
+    pool = DecodePool(processes=workers, draft=draft)
+    
+    def decode_one(image_bytes: bytes) -> bool:
+        try:
+            pool.decode(image_bytes)
+            return True
+        except Exception:
+            return False
+    
+    try:
+        with ThreadPoolExecutor(max_workers=max(settings.pipeline_decode_workers, workers)) as executor:
+            # 预热：启动子进程
+            list(executor.map(decode_one, images[:workers]))
+            start = time.perf_counter()
+            results = list(executor.map(decode_one, images))
+            process_seconds = time.perf_counter() - start
+    finally:
+        pool.close()
+    
+    failed = results.count(False)
+    print(f"{'缩小解码' if draft else '完整解码'}，{workers} 并发:")
+    print(f"  线程池:     {len(images) / thread_seconds:.1f} 张/秒")
+    print(f"  子进程池:   {len(images) / process_seconds:.1f} 张/秒（失败 {failed} 张）")
+
+
+def describe(timings: list) -> str:
+    values = np.asarray(timings)
+    return f"平均 {values.mean():.2f} ms，中位数 {np.median(values):.2f} ms，P95 {np.percentile(values, 95):.2f} ms"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="对比JPEG完整解码与缩小解码的耗时和特征向量偏差")
+    parser.add_argument('--fixtures', help="本地图片目录，不指定时使用合成图片")
+    parser.add_argument('--synthetic', type=int, default=30, help="合成图片数量")
+    parser.add_argument('--width', type=int, default=3000, help="合成图片宽度")
+    parser.add_argument('--height', type=int, default=2000, help="合成图片高度")
+    parser.add_argument('--repeat', type=int, default=3, help="每张图片重复解码次数（取最小值）")
+    parser.add_argument('--batch-size', type=int, default=settings.batch_size, help="推理批次大小")
+    parser.add_argument('--no-embed', action='store_true', help="只测解码耗时，不加载模型")
+    parser.add_argument('--processes', type=int, default=0, help="对比多线程与解码子进程池吞吐时的并发数，0表示不对比")
+    parser.add_argument('--seed', type=int, default=42, help="合成图片的随机种子")
+    args = parser.parse_args()
+    
+    print_section("加载图片")
+    if args.fixtures:
+        images = load_fixtures(args.fixtures)
+        source = args.fixtures
+    else:
+        images = make_synthetic(args.synthetic, args.width, args.height, args.seed)
+        source = f"合成 {args.width}x{args.height}"
+    if not images:
+        print("[FAIL] 没有可用的图片")
+        return
+    sizes = [Image.open(BytesIO(b)).size for b in images]
+    megapixels = np.mean([w * h for w, h in sizes]) / 1e6
+    jpeg_count = sum(Image.open(BytesIO(b)).format == 'JPEG' for b in images)
+    print(f"来源: {source}，{len(images)} 张（JPEG {jpeg_count} 张），平均 {megapixels:.1f} 百万像素，目标尺寸 {settings.model_input_size}")
+    
+    print_section("解码+缩放耗时（每张）")
+    full_arrays, full_timings = time_decode(images, draft=False, repeat=args.repeat)
+    draft_arrays, draft_timings = time_decode(images, draft=True, repeat=args.repeat)
+    print(f"完整解码: {describe(full_timings)}")
+    print(f"缩小解码: {describe(draft_timings)}")
+    print(f"加速比:   {np.sum(full_timings) / np.sum(draft_timings):.2f}x")
+    pixel_diff = [np.abs(a.astype(np.int16) - b.astype(np.int16)) for a, b in zip(full_arrays, draft_arrays)]
+    print(f"像素差异: 平均 {np.mean([d.mean() for d in pixel_diff]):.2f}，最大 {max(int(d.max()) for d in pixel_diff)}（0-255）")
+    
+    if args.processes > 0:
+        print_section("并发解码吞吐（线程池 vs 解码子进程池）")
+        print(f"CPU核数: {os.cpu_count()}")
+        compare_parallel(images, args.processes, draft=False)
+        compare_parallel(images, args.processes, draft=True)
+    
+    if args.no_embed:
+        return
+    
+    print_section("特征向量偏差")
+    from models.image_feature_extractor import ImageFeatureExtractor
+    extractor = ImageFeatureExtractor()
+    full_vectors = embed(extractor, full_arrays, args.batch_size)
+    draft_vectors = embed(extractor, draft_arrays, args.batch_size)
+    cosine = np.sum(full_vectors * draft_vectors, axis=1)
+    print(f"模型版本: {extractor.model_version}")
+    print(f"余弦相似度: 平均 {cosine.mean():.5f}，最小 {cosine.min():.5f}，P5 {np.percentile(cosine, 5):.5f}")
+    
+    # 缩小解码后的向量与完整解码的向量在图库中是否仍然互为最近邻
+    similarity = draft_vectors @ full_vectors.T
+    top1 = float(np.mean(np.argmax(similarity, axis=1) == np.arange(len(images))))
+    print(f"Top-1 一致率（缩小解码向量在完整解码图库中检索到自身）: {top1:.4f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+"""
+对比预处理模式（legacy [0,1] 与 mobilenet_v2 [-1,1]）的检索召回率和吞吐
+
+使用本地图片目录作为图库，对每张图片做随机裁剪、缩放、亮度调整和JPEG重压缩生成查询图，
+统计查询图在图库中检索到原图的 recall@k，以及预处理+推理的吞吐（张/秒）。
+
+用法:
+    python scripts/benchmark_preprocess_modes.py --fixtures ./fixtures/images
+    python scripts/benchmark_preprocess_modes.py --fixtures ./fixtures/images --k 1 5 10 --queries-per-image 2
+"""
+import sys
+import os
+import time
+import random
+import argparse
+from io import BytesIO
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from PIL import Image, ImageEnhance
+
+from config import settings
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.gif', '.webp')
+
+
+def print_section(title):
+    """打印分节标题"""
+    print("\n" + "=" * 70)
+    print(f"  {title}")
+    print("=" * 70)
+
+
+def load_fixtures(fixtures_dir: str) -> list:
+    """读取图库图片的原始字节"""
+    paths = []
+    for root, _, files in os.walk(fixtures_dir):
+        for name in sorted(files):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                paths.append(os.path.join(root, name))
+    images = []
+    for path in sorted(paths):
+        with open(path, 'rb') as f:
+            images.append(f.read())
+    return images
+
+
+def make_query(image_bytes: bytes, rng: random.Random) -> bytes:
+    """生成查询图：随机裁剪70%-95%、亮度调整、缩放后JPEG重压缩"""
+    image = Image.open(BytesIO(image_bytes)).convert('RGB')
+    width, height = image.size
+    ratio = rng.uniform(0.7, 0.95)
+    crop_w, crop_h = int(width * ratio), int(height * ratio)
+    left = rng.randint(0, width - crop_w)
+    top = rng.randint(0, height - crop_h)
+    image = image.crop((left, top, left + crop_w, top + crop_h))
+    image = ImageEnhance.Brightness(image).enhance(rng.uniform(0.8, 1.2))
+    scale = rng.uniform(0.5, 1.0)
+    image = image.resize((max(1, int(crop_w * scale)), max(1, int(crop_h * scale))))
+    output = BytesIO()
+    image.save(output, format='JPEG', quality=rng.randint(60, 85))
+    return output.getvalue()
+
+
+def embed(extractor, images: list, batch_size: int) -> tuple:
+    """批量提取特征，返回 (向量矩阵, 耗时秒数)"""
+    start = time.perf_counter()
+    vectors = []
+    for i in range(0, len(images), batch_size):
+        batch = np.stack([extractor.preprocess_image_bytes(b) for b in images[i:i + batch_size]], axis=0)
+        vectors.extend(extractor.extract_features_from_arrays(batch))
+    return np.asarray(vectors, dtype=np.float32), time.perf_counter() - start
+
+
+def recall_at_k(gallery: np.ndarray, queries: np.ndarray, query_targets: list, ks: list) -> dict:
+    """计算recall@k：查询图的原图出现在余弦相似度前k名中的比例"""
+    similarity = queries @ gallery.T
+    order = np.argsort(-similarity, axis=1)
+    targets = np.asarray(query_targets)[:, None]
+    ranks = np.argmax(order == targets, axis=1)
+    return {k: float(np.mean(ranks < k)) for k in ks}
+
+
+def run_mode(mode: str, gallery_images: list, query_images: list, query_targets: list, ks: list, batch_size: int) -> dict:
+    """在指定预处理模式下运行基准测试"""
+    # 延迟导入，确保模型按当前模式构建
+    settings.preprocess_mode = mode
+    from models.image_feature_extractor import ImageFeatureExtractor
+    extractor = ImageFeatureExtractor()
+    
+    # 预热，排除首次推理开销
+    embed(extractor, gallery_images[:batch_size], batch_size)
+    
+    gallery, gallery_seconds = embed(extractor, gallery_images, batch_size)
+    queries, query_seconds = embed(extractor, query_images, batch_size)
+    total_images = len(gallery_images) + len(query_images)
+    
+    return {
+        'mode': mode,
+        'model_version': extractor.model_version,
+        'recall': recall_at_k(gallery, queries, query_targets, ks),
+        'throughput': total_images / (gallery_seconds + query_seconds)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="对比预处理模式的检索召回率和吞吐")
+    parser.add_argument('--fixtures', required=True, help="本地图库图片目录")
+    parser.add_argument('--k', type=int, nargs='+', default=[1, 5, 10], help="recall@k 的k值")
+    parser.add_argument('--queries-per-image', type=int, default=1, help="每张图库图片生成的查询图数量")
+    parser.add_argument('--batch-size', type=int, default=settings.batch_size, help="推理批次大小")
+    parser.add_argument('--modes', nargs='+', default=['legacy', 'mobilenet_v2'], help="要对比的预处理模式")
+    parser.add_argument('--seed', type=int, default=42, help="生成查询图的随机种子")
+    args = parser.parse_args()
+    
+    print_section("加载图库")
+    gallery_images = load_fixtures(args.fixtures)
+    if len(gallery_images) < 2:
+        print(f"[FAIL] 图库图片不足（{len(gallery_images)} 张），请提供至少2张图片")
+        return
+    rng = random.Random(args.seed)
+    query_images, query_targets = [], []
+    for idx, image_bytes in enumerate(gallery_images):
+        for _ in range(args.queries_per_image):
+            query_images.append(make_query(image_bytes, rng))
+            query_targets.append(idx)
+    print(f"图库: {len(gallery_images)} 张，查询: {len(query_images)} 张")
+    
+    results = []
+    for mode in args.modes:
+        print_section(f"预处理模式: {mode}")
+        result = run_mode(mode, gallery_images, query_images, query_targets, args.k, args.batch_size)
+        results.append(result)
+        recall_info = ", ".join(f"recall@{k}={v:.4f}" for k, v in result['recall'].items())
+        print(f"{recall_info} | 吞吐 {result['throughput']:.2f} 张/秒")
+    
+    print_section("结果汇总")
+    header = f"{'模式':<14}{'model_version':<22}" + "".join(f"{'R@' + str(k):>10}" for k in args.k) + f"{'张/秒':>10}"
+    print(header)
+    for result in results:
+        row = f"{result['mode']:<14}{result['model_version']:<22}"
+        row += "".join(f"{result['recall'][k]:>10.4f}" for k in args.k)
+        row += f"{result['throughput']:>10.2f}"
+        print(row)
+
+
+if __name__ == "__main__":
+    main()
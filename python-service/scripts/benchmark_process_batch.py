@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+"""
+压测 /process/batch：按集合查询、并发下载、按批推理、一次批量写库
+
+从 ecai.tb_image 中选取尚未处理的图片ID，对每个批次大小（默认 10/100/1000）：
+    - 逐张处理：依次调用 /process/image（每张图片各自查询、下载、推理、写库，相当于改造前的 /process/batch）
+    - 批量处理：一次调用 /process/batch
+统计耗时和张/秒。每轮结束后删除本轮写入的特征向量，保证下一轮处理的是同样的未处理图片；
+所选图片原本就没有特征向量，删除后数据库恢复原状。
+
+需要先启动服务（python run.py），服务和本脚本连接同一个数据库。
+
+用法:
+    python scripts/benchmark_process_batch.py
+    python scripts/benchmark_process_batch.py --sizes 10 100 1000 --base-url http://localhost:8000
+    python scripts/benchmark_process_batch.py --no-baseline
+"""
+import sys
+import os
+import time
+import argparse
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import requests
+
+from utils.db import Database, FEATURE_TABLE, iter_images_keyset
+
+
+def print_section(title):
+    """打印分节标题"""
+    print("\n" + "=" * 70)
+    print(f"  {title}")
+    print("=" * 70)
+
+
+def delete_features(image_ids: list):
+    """删除本轮写入的特征向量"""
+    conn = Database.get_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(
+            f"DELETE FROM {FEATURE_TABLE} WHERE image_id = ANY(%s::bigint[])",
+            ([int(image_id) for image_id in image_ids],)
+        )
+        conn.commit()
+        cursor.close()
+    finally:
+        Database.return_connection(conn)
+
+
+def run_per_image(base_url: str, image_ids: list) -> tuple:
+    """逐张调用 /process/image，返回 (耗时秒数, 成功数)"""
+    session = requests.Session()
+    session.trust_env = False
+    success = 0
+    start = time.perf_counter()
+    for image_id in image_ids:
+        response = session.post(f"{base_url}/process/image", json={"image_id": image_id}, timeout=300)
+        if response.status_code == 200 and response.json().get('success'):
+            success += 1
+    return time.perf_counter() - start, success
+
+
+def run_batch(base_url: str, image_ids: list) -> tuple:
+    """一次调用 /process/batch，返回 (耗时秒数, 成功数)"""
+    session = requests.Session()
+    session.trust_env = False
+    start = time.perf_counter()
+    response = session.post(f"{base_url}/process/batch", json=image_ids, timeout=3600)
+    elapsed = time.perf_counter() - start
+    response.raise_for_status()
+    return elapsed, response.json()['success']
+
+
+def main():
+    parser = argparse.ArgumentParser(description="压测 /process/batch")
+    parser.add_argument('--base-url', default="http://localhost:8000", help="服务地址")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000], help="每批图片ID数量")
+    parser.add_argument('--no-baseline', action='store_true', help="不运行逐张处理的对照组")
+    args = parser.parse_args()
+    
+    print_section("选取未处理的图片")
+    max_size = max(args.sizes)
+    image_ids = [image_id for image_id, _ in iter_images_keyset(skip_processed=True, limit=max_size)]
+    if len(image_ids) < max_size:
+        print(f"[FAIL] 未处理的图片只有 {len(image_ids)} 张，少于 {max_size} 张")
+        return
+    print(f"选取 {len(image_ids)} 张未处理的图片（ID {image_ids[0]} - {image_ids[-1]}）")
+    
+    results = []
+    try:
+        for size in args.sizes:
+            ids = image_ids[:size]
+            print_section(f"批次大小: {size}")
+            row = {'size': size, 'per_image': None}
+            if not args.no_baseline:
+                seconds, success = run_per_image(args.base_url, ids)
+                delete_features(ids)
+                row['per_image'] = seconds
+                print(f"逐张处理: {seconds:.2f}s（{size / seconds:.1f} 张/秒），成功 {success}")
+            seconds, success = run_batch(args.base_url, ids)
+            delete_features(ids)
+            row['batch'] = seconds
+            print(f"批量处理: {seconds:.2f}s（{size / seconds:.1f} 张/秒），成功 {success}")
+            results.append(row)
+    finally:
+        delete_features(image_ids)
+    
+    print_section("结果汇总")
+    print(f"{'ID数量':<10}{'逐张(s)':>12}{'批量(s)':>12}{'逐张 张/秒':>14}{'批量 张/秒':>14}{'加速比':>10}")
+    for row in results:
+        per_image = row['per_image']
+        print(
+            f"{row['size']:<10}"
+            f"{per_image if per_image is not None else float('nan'):>12.2f}"
+            f"{row['batch']:>12.2f}"
+            f"{row['size'] / per_image if per_image else float('nan'):>14.1f}"
+            f"{row['size'] / row['batch']:>14.1f}"
+            f"{per_image / row['batch'] if per_image else float('nan'):>10.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
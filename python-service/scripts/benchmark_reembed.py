@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+"""
+对比重新提取特征（force_reprocess / 更换模型）时的写库方式：耗时、表和索引大小、死元组数
+
+在与 tb_hsx_img_value 结构相同、带HNSW向量索引的临时基准表上，先写入 --rows 行初始向量，
+再用新的随机向量重写 --rounds 轮（中间不VACUUM），对比：
+    delete_insert: 先 DELETE 已存在的行再插入（改造前的 force_reprocess）
+    upsert:        直接 INSERT ... ON CONFLICT DO UPDATE 覆盖
+    upsert_same:   用相同的向量重写（向量和模型版本未变化的行不更新）
+    swap:          写入影子表，建索引后改名切换（utils.feature_rebuild）
+测试结束后删除基准表，不影响正式数据。
+
+用法:
+    python scripts/benchmark_reembed.py
+    python scripts/benchmark_reembed.py --rows 20000 --rounds 3 --batch-size 1000
+"""
+import sys
+import os
+import time
+import argparse
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from utils.db import Database, FEATURE_TABLE, save_feature_vectors_batch
+from utils.feature_rebuild import FeatureRebuild, rebuild_table_name
+
+BENCH_TABLE = "tb_hsx_img_value_reembed_bench"
+MODES = ('delete_insert', 'upsert', 'upsert_same', 'swap')
+
+
+def print_section(title):
+    """打印分节标题"""
+    print("\n" + "=" * 70)
+    print(f"  {title}")
+    print("=" * 70)
+
+
+def execute(sql: str, params=None):
+    """执行一条SQL语句，返回第一行结果（没有结果时返回None）"""
+    conn = Database.get_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(sql, params)
+        row = cursor.fetchone() if cursor.description else None
+        conn.commit()
+        cursor.close()
+        return row
+    finally:
+        Database.return_connection(conn)
+
+
+def make_rows(count: int, dimension: int, seed: int, model_version: str) -> list:
+    """生成随机的已归一化特征向量行"""
+    rng = np.random.default_rng(seed)
+    vectors = rng.random((count, dimension), dtype=np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return [(str(i + 1), vectors[i], dimension, model_version) for i in range(count)]
+
+
+def prepare_table(rows: list, batch_size: int):
+    """重新创建基准表（唯一约束 + HNSW索引）并写入初始向量"""
+    execute(f"DROP TABLE IF EXISTS {BENCH_TABLE}")
+    execute(f"DROP TABLE IF EXISTS {rebuild_table_name(BENCH_TABLE)}")
+    execute(f"CREATE TABLE {BENCH_TABLE} (LIKE {FEATURE_TABLE} INCLUDING DEFAULTS)")
+    execute(f"ALTER TABLE {BENCH_TABLE} ADD UNIQUE (image_id)")
+    execute(f"CREATE INDEX {BENCH_TABLE}_hnsw ON {BENCH_TABLE} USING hnsw (feature_vector vector_cosine_ops)")
+    write_batches(rows, BENCH_TABLE, batch_size)
+
+
+def write_batches(rows: list, table: str, batch_size: int):
+    for i in range(0, len(rows), batch_size):
+        save_feature_vectors_batch(rows[i:i + batch_size], table=table)
+
+
+def delete_batch(rows: list):
+    """删除一批已存在的行（改造前 force_reprocess 的做法）"""
+    conn = Database.get_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(
+            f"DELETE FROM {BENCH_TABLE} WHERE image_id = ANY(%s::bigint[])",
+            ([int(row[0]) for row in rows],)
+        )
+        conn.commit()
+        cursor.close()
+    finally:
+        Database.return_connection(conn)
+
+
+def reembed(mode: str, rows: list, batch_size: int):
+    """按指定方式重写一轮向量"""
+    if mode == 'swap':
+        with FeatureRebuild(BENCH_TABLE) as rebuild:
+            write_batches(rows, rebuild.rebuild_table, batch_size)
+            rebuild.swap()
+        return
+    for i in range(0, len(rows), batch_size):
+        batch = rows[i:i + batch_size]
+        if mode == 'delete_insert':
+            delete_batch(batch)
+        save_feature_vectors_batch(batch, table=BENCH_TABLE)
+
+
+def table_sizes() -> dict:
+    """表、索引大小（MB）和死元组数"""
+    # 统计信息由各连接空闲时异步上报，稍等再读取
+    time.sleep(1.5)
+    table_bytes, index_bytes = execute(
+        "SELECT pg_table_size(%s::regclass), pg_indexes_size(%s::regclass)",
+        (BENCH_TABLE, BENCH_TABLE)
+    )
+    dead = execute("SELECT n_dead_tup FROM pg_stat_user_tables WHERE relname = %s", (BENCH_TABLE,))
+    return {
+        'table_mb': table_bytes / 1024 / 1024,
+        'index_mb': index_bytes / 1024 / 1024,
+        'dead_tuples': dead[0] if dead else 0
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="对比重新提取特征时的写库方式")
+    parser.add_argument('--rows', type=int, default=5000, help="基准表行数")
+    parser.add_argument('--dimension', type=int, default=1280, help="向量维度")
+    parser.add_argument('--rounds', type=int, default=2, help="重写轮数（中间不VACUUM）")
+    parser.add_argument('--batch-size', type=int, default=500, help="每批写入的行数")
+    parser.add_argument('--modes', nargs='+', default=list(MODES), choices=MODES, help="要对比的写库方式")
+    args = parser.parse_args()
+    
+    initial_rows = make_rows(args.rows, args.dimension, seed=0, model_version='benchmark-v1')
+    print(f"基准表: {BENCH_TABLE}，{args.rows} 行，维度 {args.dimension}，重写 {args.rounds} 轮，每批 {args.batch_size} 行")
+    
+    results = {}
+    try:
+        for mode in args.modes:
+            print_section(f"写库方式: {mode}")
+            prepare_table(initial_rows, args.batch_size)
+            before = table_sizes()
+            print(f"初始: 表 {before['table_mb']:.1f} MB，索引 {before['index_mb']:.1f} MB")
+            seconds = 0.0
+            for round_index in range(args.rounds):
+                rows = initial_rows if mode == 'upsert_same' else make_rows(
+                    args.rows, args.dimension, seed=round_index + 1, model_version='benchmark-v2'
+                )
+                start = time.perf_counter()
+                reembed(mode, rows, args.batch_size)
+                elapsed = time.perf_counter() - start
+                seconds += elapsed
+                print(f"第 {round_index + 1} 轮: {elapsed:.2f}s（{args.rows / elapsed:.0f} 行/秒）")
+            after = table_sizes()
+            count = execute(f"SELECT count(*) FROM {BENCH_TABLE}")[0]
+            if count != args.rows:
+                print(f"[FAIL] 重写后行数 {count}，应为 {args.rows}")
+            results[mode] = {'seconds': seconds, **after}
+            print(f"重写后: 表 {after['table_mb']:.1f} MB，索引 {after['index_mb']:.1f} MB，死元组 {after['dead_tuples']}")
+    finally:
+        execute(f"DROP TABLE IF EXISTS {BENCH_TABLE}")
+        execute(f"DROP TABLE IF EXISTS {rebuild_table_name(BENCH_TABLE)}")
+    
+    print_section("结果汇总")
+    print(f"{'写库方式':<16}{'总耗时(s)':>12}{'行/秒':>10}{'表(MB)':>10}{'索引(MB)':>10}{'死元组':>10}")
+    for mode, result in results.items():
+        rows_per_second = args.rows * args.rounds / result['seconds'] if result['seconds'] else 0.0
+        print(
+            f"{mode:<16}{result['seconds']:>12.2f}{rows_per_second:>10.0f}"
+            f"{result['table_mb']:>10.1f}{result['index_mb']:>10.1f}{result['dead_tuples']:>10}"
+        )
+    
+    Database.close_all()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+"""
+多进程部署压测：不同工作进程数下 /extract/upload 的吞吐（请求/秒）和延迟
+
+对每个工作进程数依次用 run.py --workers N 启动服务，等待所有进程加载模型后，
+以固定并发持续上传同一批图片，统计请求/秒和P50/P95延迟，测试结束后关闭服务。
+上传接口不访问CDN，测得的是解码+推理的服务能力。
+
+用法:
+    python scripts/benchmark_serving.py --workers 1 2 4
+    python scripts/benchmark_serving.py --workers 1 2 4 8 --concurrency 64 --duration 30 --fixtures ./fixtures/images
+"""
+import sys
+import os
+import time
+import signal
+import asyncio
+import argparse
+import subprocess
+from io import BytesIO
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+import numpy as np
+from PIL import Image
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.gif', '.webp')
+
+
+def print_section(title):
+    """打印分节标题"""
+    print("\n" + "=" * 70)
+    print(f"  {title}")
+    print("=" * 70)
+
+
+def load_images(fixtures_dir: str, count: int) -> list:
+    """读取图片字节，未指定目录时生成 count 张随机内容的JPEG"""
+    if fixtures_dir:
+        images = []
+        for root, _, files in os.walk(fixtures_dir):
+            for name in sorted(files):
+                if name.lower().endswith(IMAGE_EXTENSIONS):
+                    with open(os.path.join(root, name), 'rb') as f:
+                        images.append(f.read())
+        return images
+    rng = np.random.default_rng(42)
+    images = []
+    for _ in range(count):
+        pixels = rng.integers(0, 256, size=(480, 640, 3), dtype=np.uint8)
+        output = BytesIO()
+        Image.fromarray(pixels, 'RGB').save(output, format='JPEG', quality=85)
+        images.append(output.getvalue())
+    return images
+
+
+def start_server(workers: int, port: int) -> subprocess.Popen:
+    """以生产模式启动服务"""
+    return subprocess.Popen(
+        [sys.executable, 'run.py', '--workers', str(workers), '--port', str(port), '--no-reload'],
+        cwd=PROJECT_ROOT,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True  # 单独的进程组，结束时连同工作进程一起关闭
+    )
+
+
+def stop_server(process: subprocess.Popen):
+    """关闭服务及其工作进程"""
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+        process.wait(timeout=30)
+    except (ProcessLookupError, subprocess.TimeoutExpired):
+        os.killpg(process.pid, signal.SIGKILL)
+        process.wait()
+
+
+async def wait_ready(base_url: str, workers: int, image_bytes: bytes, timeout: float) -> bool:
+    """等待服务可用，并发送足够多的预热请求，让每个工作进程都完成模型加载和首次推理"""
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(base_url=base_url, timeout=60, trust_env=False) as client:
+        while time.monotonic() < deadline:
+            try:
+                if (await client.get('/health')).status_code == 200:
+                    break
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(1)
+        else:
+            return False
+        # 请求在工作进程之间随机分配，多发一些确保每个进程都被预热
+        await asyncio.gather(*(
+            client.post('/extract/upload', files={'file': ('warmup.jpg', image_bytes, 'image/jpeg')})
+            for _ in range(workers * 8)
+        ))
+    return True
+
+
+async def run_load(base_url: str, images: list, concurrency: int, duration: float) -> dict:
+    """以固定并发持续发送请求 duration 秒"""
+    latencies = []
+    errors = 0
+    deadline = time.monotonic() + duration
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    
+    async with httpx.AsyncClient(base_url=base_url, timeout=120, limits=limits, trust_env=False) as client:
+        async def user(index: int):
+            nonlocal errors
+            i = index
+            while time.monotonic() < deadline:
+                image_bytes = images[i % len(images)]
+                i += concurrency
+                start = time.perf_counter()
+                try:
+                    response = await client.post('/extract/upload', files={'file': ('image.jpg', image_bytes, 'image/jpeg')})
+                    if response.status_code != 200:
+                        errors += 1
+                        continue
+                except httpx.HTTPError:
+                    errors += 1
+                    continue
+                latencies.append(time.perf_counter() - start)
+        
+        start = time.perf_counter()
+        await asyncio.gather(*(user(i) for i in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    
+    latencies_ms = np.asarray(latencies) * 1000 if latencies else np.zeros(1)
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'rps': len(latencies) / elapsed,
+        'p50_ms': float(np.percentile(latencies_ms, 50)),
+        'p95_ms': float(np.percentile(latencies_ms, 95))
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="不同工作进程数下的服务吞吐压测")
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4], help="要测试的工作进程数")
+    parser.add_argument('--concurrency', type=int, default=32, help="并发请求数")
+    parser.add_argument('--duration', type=float, default=20.0, help="每轮压测时长（秒）")
+    parser.add_argument('--port', type=int, default=18000, help="压测服务端口")
+    parser.add_argument('--fixtures', help="上传的图片目录，不指定时使用随机内容的640x480 JPEG")
+    parser.add_argument('--images', type=int, default=32, help="未指定图片目录时生成的图片数量")
+    parser.add_argument('--startup-timeout', type=float, default=300.0, help="等待服务启动的超时（秒）")
+    args = parser.parse_args()
+    
+    images = load_images(args.fixtures, args.images)
+    if not images:
+        print("[FAIL] 没有可用的图片")
+        return
+    print(f"CPU核数: {os.cpu_count()}，图片 {len(images)} 张，并发 {args.concurrency}，每轮 {args.duration}s")
+    
+    base_url = f"http://127.0.0.1:{args.port}"
+    results = []
+    for workers in args.workers:
+        print_section(f"工作进程数: {workers}")
+        process = start_server(workers, args.port)
+        try:
+            if not asyncio.run(wait_ready(base_url, workers, images[0], args.startup_timeout)):
+                print("[FAIL] 服务启动超时")
+                continue
+            result = asyncio.run(run_load(base_url, images, args.concurrency, args.duration))
+            result['workers'] = workers
+            results.append(result)
+            print(f"{result['rps']:.2f} 请求/秒，P50 {result['p50_ms']:.1f} ms，P95 {result['p95_ms']:.1f} ms，失败 {result['errors']}")
+        finally:
+            stop_server(process)
+    
+    if not results:
+        return
+    print_section("结果汇总")
+    baseline = results[0]['rps']
+    print(f"{'进程数':<8}{'请求/秒':>12}{'加速比':>10}{'P50(ms)':>12}{'P95(ms)':>12}{'失败':>8}")
+    for result in results:
+        speedup = result['rps'] / baseline if baseline else 0.0
+        print(
+            f"{result['workers']:<8}{result['rps']:>12.2f}{speedup:>10.2f}"
+            f"{result['p50_ms']:>12.1f}{result['p95_ms']:>12.1f}{result['errors']:>8}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+"""
+大批量回填：删除HNSW向量索引 -> 流水线写入 -> 重建索引 -> ANALYZE，输出各阶段耗时
+
+带HNSW索引逐行写入时每行都要维护索引图，回填数百万行时先删除索引、写完后用较大的
+maintenance_work_mem 和并行维护进程一次性构建要快得多。索引删除期间向量检索会退化为全表扫描，
+因此删除前会检查在线检索流量（见 utils.vector_index.check_search_traffic），发现流量时拒绝执行；
+写入失败或被中断时同样会重建索引。
+
+需要在服务停止对外检索时运行（例如维护窗口），表结构见 scripts/create_table.py。
+
+用法:
+    python scripts/bulk_backfill.py
+    python scripts/bulk_backfill.py --limit 1000000 --maintenance-work-mem 8GB --parallel-workers 8
+    python scripts/bulk_backfill.py --keep-index          # 不删除索引，作为对照
+    python scripts/bulk_backfill.py --rebuild-only        # 只重建索引（上次运行未完成时）
+"""
+import sys
+import os
+import time
+import argparse
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import settings
+from utils.db import Database, iter_images_keyset
+from utils.vector_index import (
+    DEFAULT_VECTOR_INDEX_SQL,
+    get_vector_index_definition,
+    check_search_traffic,
+    drop_vector_index,
+    build_vector_index,
+    analyze_table
+)
+
+
+def print_section(title):
+    """打印分节标题"""
+    print("\n" + "=" * 70)
+    print(f"  {title}")
+    print("=" * 70)
+
+
+def load(limit, force_reprocess: bool) -> dict:
+    """用流水线写入特征向量"""
+    from models.image_feature_extractor import get_feature_extractor
+    from utils.pipeline import IngestionPipeline
+
+    extractor = get_feature_extractor()
+    images = iter_images_keyset(skip_processed=not force_reprocess, limit=limit, model_version=extractor.model_version)
+    pipeline = IngestionPipeline(extractor, force_reprocess=force_reprocess)
+    return pipeline.run(images)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="删除向量索引后大批量回填，再重建索引")
+    parser.add_argument('--limit', type=int, help="最多处理的图片数量，不指定时处理全部未处理图片")
+    parser.add_argument('--force-reprocess', action='store_true', help="重新处理已有特征向量的图片")
+    parser.add_argument('--maintenance-work-mem', default=settings.bulk_load_maintenance_work_mem, help="重建索引时的 maintenance_work_mem")
+    parser.add_argument('--parallel-workers', type=int, default=settings.bulk_load_parallel_workers, help="重建索引时的 max_parallel_maintenance_workers")
+    parser.add_argument('--idle-check-seconds', type=float, default=settings.bulk_load_idle_check_seconds, help="删除索引前观察在线检索流量的时长（秒）")
+    parser.add_argument('--force', action='store_true', help="忽略在线检索流量检查")
+    parser.add_argument('--keep-index', action='store_true', help="不删除索引，直接写入（对照组）")
+    parser.add_argument('--rebuild-only', action='store_true', help="只在索引不存在时重建索引")
+    args = parser.parse_args()
+
+    timings = {}
+    existing = get_vector_index_definition()
+    index_name, definition = existing if existing else (None, DEFAULT_VECTOR_INDEX_SQL)
+
+    if args.rebuild_only:
+        print_section("重建向量索引")
+        if existing:
+            print(f"[INFO] 向量索引 {index_name} 已存在，无需重建")
+        else:
+            timings['build_index'] = build_vector_index(definition, args.maintenance_work_mem, args.parallel_workers)
+            print(f"[PASS] 向量索引重建完成，耗时 {timings['build_index']:.1f}s")
+        Database.close_all()
+        return
+
+    drop_index = not args.keep_index and existing is not None
+    if drop_index:
+        print_section("检查在线检索流量")
+        print(f"向量索引: {index_name}")
+        print(f"观察 {args.idle_check_seconds:.0f}s 内的索引扫描...")
+        start = time.perf_counter()
+        problems = check_search_traffic(index_name, args.idle_check_seconds)
+        timings['check'] = time.perf_counter() - start
+        for problem in problems:
+            print(f"  - {problem}")
+        if problems and not args.force:
+            print("[FAIL] 仍有在线检索依赖向量索引，请在停止检索流量后再运行（或使用 --force）")
+            Database.close_all()
+            sys.exit(1)
+        print("[PASS] 没有发现在线检索流量" if not problems else "[INFO] 已使用 --force 忽略检查结果")
+
+        print_section("删除向量索引")
+        print(definition)
+        timings['drop_index'] = drop_vector_index(index_name)
+        print(f"[PASS] 已删除，耗时 {timings['drop_index']:.2f}s")
+    elif existing is None:
+        print("[INFO] 向量索引不存在，写入完成后将按默认定义构建")
+
+    result = None
+    try:
+        print_section("写入特征向量")
+        start = time.perf_counter()
+        result = load(args.limit, args.force_reprocess)
+        timings['load'] = time.perf_counter() - start
+        print(f"[PASS] 处理 {result['total']} 张：成功 {result['success']}，失败 {result['failed']}，跳过 {result['skipped']}，"
+              f"耗时 {timings['load']:.1f}s")
+    finally:
+        # 写入失败或被中断时也要恢复索引
+        if drop_index or existing is None:
+            print_section("重建向量索引")
+            print(f"maintenance_work_mem={args.maintenance_work_mem}，max_parallel_maintenance_workers={args.parallel_workers}")
+            timings['build_index'] = build_vector_index(definition, args.maintenance_work_mem, args.parallel_workers)
+            print(f"[PASS] 向量索引重建完成，耗时 {timings['build_index']:.1f}s")
+        timings['analyze'] = analyze_table()
+
+    print_section("阶段耗时")
+    for phase, seconds in timings.items():
+        print(f"{phase:<14}{seconds:>12.2f}s")
+    total = sum(timings.values())
+    print(f"{'total':<14}{total:>12.2f}s")
+    if result and result['success'] and total > 0:
+        print(f"写入 {result['success']} 行，含索引构建 {result['success'] / total:.1f} 行/秒")
+
+    Database.close_all()
+
+
+if __name__ == "__main__":
+    main()
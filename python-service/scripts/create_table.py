@@ -9,6 +9,7 @@ import os
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from utils.db import Database
+from utils.vector_index import DEFAULT_VECTOR_INDEX_SQL
 from config import settings
 
 
@@ -33,12 +34,11 @@ def create_table():
         """
         
         # 创建索引
-        create_index_sql = """
+        create_index_sql = f"""
         CREATE INDEX IF NOT EXISTS idx_tb_hsx_img_value_image_id 
         ON tb_hsx_img_value(image_id);
         
-        CREATE INDEX IF NOT EXISTS idx_tb_hsx_img_value_feature_vector 
-        ON tb_hsx_img_value USING hnsw (feature_vector vector_cosine_ops);
+        {DEFAULT_VECTOR_INDEX_SQL};
         """
         
         print("正在创建表 tb_hsx_img_value...")
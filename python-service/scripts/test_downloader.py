@@ -0,0 +1,281 @@
+#!/usr/bin/env python
+"""
+测试共享异步图片下载器
+在本地启动一个HTTP/1.1 keep-alive测试服务器代替CDN，验证下载结果、连接复用、
+按主机并发上限、失败处理和磁盘缓存（ETag确认、LRU淘汰），并与逐个 requests.get 的方式对比耗时
+"""
+import sys
+import os
+import time
+import asyncio
+import shutil
+import tempfile
+import threading
+from io import BytesIO
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import requests
+from PIL import Image
+
+from utils.downloader import AsyncImageDownloader
+from utils.image_cache import ImageCache
+
+
+def print_section(title):
+    """打印分隔线"""
+    print("\n" + "=" * 60)
+    print(f"  {title}")
+    print("=" * 60)
+
+
+def make_image_bytes() -> bytes:
+    """生成测试用JPEG图片"""
+    output = BytesIO()
+    Image.new('RGB', (320, 240), (200, 120, 40)).save(output, format='JPEG')
+    return output.getvalue()
+
+
+class ServerStats:
+    """测试服务器统计：连接数、请求数、304响应数、当前并发和最大并发"""
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+    
+    def reset(self):
+        with self.lock:
+            self.connections = 0
+            self.requests = 0
+            self.not_modified = 0
+            self.active = 0
+            self.max_active = 0
+
+
+IMAGE_BYTES = make_image_bytes()
+SERVER_STATS = ServerStats()
+
+
+class ImageHandler(BaseHTTPRequestHandler):
+    """/img/<n>.jpg 返回图片（带ETag），/slow/<n>.jpg 延迟100ms返回，其余返回404"""
+    
+    protocol_version = "HTTP/1.1"  # 支持keep-alive
+    disable_nagle_algorithm = True  # 响应头和正文分两次写出，避免keep-alive连接上的Nagle延迟
+    
+    def setup(self):
+        super().setup()
+        with SERVER_STATS.lock:
+            SERVER_STATS.connections += 1
+    
+    def do_GET(self):
+        with SERVER_STATS.lock:
+            SERVER_STATS.requests += 1
+            SERVER_STATS.active += 1
+            SERVER_STATS.max_active = max(SERVER_STATS.max_active, SERVER_STATS.active)
+        try:
+            if self.path.startswith('/slow/'):
+                time.sleep(0.1)
+            etag = f'"{self.path}"'
+            if self.path.startswith('/img/') and self.headers.get('If-None-Match') == etag:
+                with SERVER_STATS.lock:
+                    SERVER_STATS.not_modified += 1
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+            elif self.path.startswith(('/img/', '/slow/')):
+                self.send_response(200)
+                self.send_header('ETag', etag)
+                self.send_header('Content-Type', 'image/jpeg')
+                self.send_header('Content-Length', str(len(IMAGE_BYTES)))
+                self.end_headers()
+                self.wfile.write(IMAGE_BYTES)
+            else:
+                self.send_response(404)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+        finally:
+            with SERVER_STATS.lock:
+                SERVER_STATS.active -= 1
+    
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server() -> ThreadingHTTPServer:
+    """在随机端口启动测试服务器"""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), ImageHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def test_single_download(downloader, base_url):
+    """测试单张下载"""
+    print_section("测试单张下载")
+    content = downloader.download(f"{base_url}/img/1.jpg")
+    if content == IMAGE_BYTES:
+        print(f"[PASS] 下载内容正确（{len(content)} 字节）")
+        return True
+    print("[FAIL] 下载内容不一致")
+    return False
+
+
+def test_connection_reuse(downloader, base_url, count=200):
+    """测试批量下载复用连接（keep-alive）"""
+    print_section("测试连接复用")
+    SERVER_STATS.reset()
+    urls = [f"{base_url}/img/{i}.jpg" for i in range(count)]
+    start = time.perf_counter()
+    contents = downloader.download_many(urls)
+    elapsed = time.perf_counter() - start
+    ok = all(content == IMAGE_BYTES for content in contents)
+    print(f"下载 {count} 张，耗时 {elapsed:.2f}s，新建连接 {SERVER_STATS.connections} 个")
+    # 连接池已预热，新连接数不应超过按主机并发上限
+    if ok and SERVER_STATS.connections <= downloader.max_per_host:
+        print("[PASS] 连接被复用")
+        return True
+    print("[FAIL] 下载失败或连接未复用")
+    return False
+
+
+def test_per_host_limit(downloader, base_url, count=40):
+    """测试按主机并发上限"""
+    print_section("测试按主机并发上限")
+    SERVER_STATS.reset()
+    urls = [f"{base_url}/slow/{i}.jpg" for i in range(count)]
+    downloader.download_many(urls)
+    print(f"服务器观察到的最大并发: {SERVER_STATS.max_active}（上限 {downloader.max_per_host}）")
+    if SERVER_STATS.max_active <= downloader.max_per_host:
+        print("[PASS] 并发未超过上限")
+        return True
+    print("[FAIL] 并发超过上限")
+    return False
+
+
+def test_failures(downloader, base_url):
+    """测试失败处理：404和连接失败返回None，download抛出异常"""
+    print_section("测试失败处理")
+    urls = [f"{base_url}/img/ok.jpg", f"{base_url}/missing.jpg", "http://127.0.0.1:1/refused.jpg"]
+    contents = downloader.download_many(urls)
+    ok = contents[0] == IMAGE_BYTES and contents[1] is None and contents[2] is None
+    try:
+        downloader.download(f"{base_url}/missing.jpg")
+        ok = False
+    except Exception as e:
+        print(f"download 抛出异常: {type(e).__name__}")
+    print(f"[{'PASS' if ok else 'FAIL'}] 失败位置返回None")
+    return ok
+
+
+def test_async_download(downloader, base_url, count=50):
+    """测试在其他事件循环中使用 download_async"""
+    print_section("测试异步接口")
+    
+    async def run():
+        return await asyncio.gather(*(downloader.download_async(f"{base_url}/img/{i}.jpg") for i in range(count)))
+    
+    contents = asyncio.run(run())
+    ok = all(content == IMAGE_BYTES for content in contents)
+    print(f"[{'PASS' if ok else 'FAIL'}] 异步下载 {count} 张")
+    return ok
+
+
+def test_disk_cache(base_url, count=20):
+    """测试磁盘缓存：新鲜缓存不访问源站，过期缓存用ETag确认（304），超过上限按LRU淘汰"""
+    print_section("测试磁盘缓存")
+    cache_dir = tempfile.mkdtemp(prefix="image_cache_")
+    urls = [f"{base_url}/img/{i}.jpg" for i in range(count)]
+    ok = True
+    try:
+        # 新鲜缓存：第二轮不访问源站
+        cache = ImageCache(cache_dir, max_bytes=10 * 1024 ** 2, fresh_seconds=3600)
+        downloader = AsyncImageDownloader(max_connections=8, max_per_host=8, cache=cache)
+        SERVER_STATS.reset()
+        first = downloader.download_many(urls)
+        first_requests = SERVER_STATS.requests
+        second = downloader.download_many(urls)
+        cached_requests = SERVER_STATS.requests - first_requests
+        downloader.close(timeout=5)
+        print(f"首次下载请求 {first_requests} 次，缓存命中后请求 {cached_requests} 次，缓存统计: {cache.stats()}")
+        # 所有URL内容相同，磁盘上只存一份
+        ok = ok and first == second and cached_requests == 0 and cache.stats()['bytes'] == len(IMAGE_BYTES)
+        cache.close()
+        
+        # 过期缓存：带 If-None-Match 确认，源站返回304
+        cache = ImageCache(cache_dir, max_bytes=10 * 1024 ** 2, fresh_seconds=0)
+        downloader = AsyncImageDownloader(max_connections=8, max_per_host=8, cache=cache)
+        SERVER_STATS.reset()
+        third = downloader.download_many(urls)
+        downloader.close(timeout=5)
+        print(f"过期缓存确认: 请求 {SERVER_STATS.requests} 次，304 {SERVER_STATS.not_modified} 次")
+        ok = ok and third == first and SERVER_STATS.not_modified == count
+        cache.close()
+        
+        # LRU淘汰：上限只能容纳一份内容，新内容写入后旧内容被淘汰
+        cache = ImageCache(cache_dir, max_bytes=len(IMAGE_BYTES) + 100, fresh_seconds=3600)
+        cache.put(f"{base_url}/other.jpg", IMAGE_BYTES + b'x')
+        stats = cache.stats()
+        print(f"LRU淘汰: {stats}")
+        ok = ok and stats['evictions'] == count and stats['bytes'] == len(IMAGE_BYTES) + 1
+        cache.close()
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+    print(f"[{'PASS' if ok else 'FAIL'}] 磁盘缓存")
+    return ok
+
+
+def compare_with_requests(downloader, base_url, count=200):
+    """与逐个 requests.get（每次新建连接）对比耗时"""
+    print_section("对比 requests.get")
+    urls = [f"{base_url}/img/{i}.jpg" for i in range(count)]
+    
+    SERVER_STATS.reset()
+    start = time.perf_counter()
+    for url in urls:
+        requests.get(url, timeout=30, proxies={'http': None, 'https': None}).content
+    requests_seconds = time.perf_counter() - start
+    requests_connections = SERVER_STATS.connections
+    
+    SERVER_STATS.reset()
+    start = time.perf_counter()
+    downloader.download_many(urls)
+    downloader_seconds = time.perf_counter() - start
+    
+    print(f"requests.get: {requests_seconds:.2f}s，新建连接 {requests_connections} 个")
+    print(f"共享下载器:   {downloader_seconds:.2f}s，新建连接 {SERVER_STATS.connections} 个")
+    return True
+
+
+def main():
+    """主测试函数"""
+    server = start_server()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    downloader = AsyncImageDownloader(max_connections=32, max_per_host=8, cache=None)
+    print(f"测试服务器: {base_url}")
+    print(f"下载器配置: {downloader.stats()}")
+    
+    results = []
+    try:
+        results.append(("单张下载", test_single_download(downloader, base_url)))
+        results.append(("连接复用", test_connection_reuse(downloader, base_url)))
+        results.append(("按主机并发上限", test_per_host_limit(downloader, base_url)))
+        results.append(("失败处理", test_failures(downloader, base_url)))
+        results.append(("异步接口", test_async_download(downloader, base_url)))
+        results.append(("磁盘缓存", test_disk_cache(base_url)))
+        compare_with_requests(downloader, base_url)
+    finally:
+        print(f"\n下载器统计: {downloader.stats()}")
+        downloader.close(timeout=5)
+        server.shutdown()
+    
+    print_section("测试总结")
+    for name, ok in results:
+        print(f"{name}: {'[PASS]' if ok else '[FAIL]'}")
+    return all(ok for _, ok in results)
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
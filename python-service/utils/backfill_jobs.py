@@ -0,0 +1,296 @@
+"""
+可恢复的后台回填任务
+任务在后台线程中按主键分页处理 ecai.tb_image，每处理完一页就把断点（最后处理的图片ID、计数、失败ID）
+写入本地JSON文件；服务重启或暂停后从断点继续，已完成的ID范围不会重新扫描
+"""
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+from threading import Lock
+from typing import Dict, List, Optional
+
+from config import settings
+from models.image_feature_extractor import get_feature_extractor
+from utils.db import iter_images_keyset
+from utils.pipeline import IngestionPipeline
+
+logger = logging.getLogger(__name__)
+
+# 任务状态
+STATUS_PENDING = "pending"
+STATUS_RUNNING = "running"
+STATUS_PAUSING = "pausing"
+STATUS_PAUSED = "paused"
+STATUS_COMPLETED = "completed"
+STATUS_FAILED = "failed"
+STATUS_INTERRUPTED = "interrupted"  # 运行中服务重启，等待恢复
+
+
+class BackfillJob:
+    """单个回填任务：状态、断点和运行线程"""
+    
+    def __init__(self, state: dict, checkpoint_dir: str):
+        self.state = state
+        self.checkpoint_path = os.path.join(checkpoint_dir, f"{state['job_id']}.json")
+        self._lock = Lock()
+        self._pause_requested = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+    
+    @classmethod
+    def create(
+        cls,
+        checkpoint_dir: str,
+        limit: Optional[int] = None,
+        skip_processed: bool = True,
+        force_reprocess: bool = False,
+        page_size: Optional[int] = None
+    ) -> "BackfillJob":
+        now = time.time()
+        state = {
+            'job_id': uuid.uuid4().hex[:12],
+            'status': STATUS_PENDING,
+            'params': {
+                'limit': limit,
+                'skip_processed': skip_processed,
+                'force_reprocess': force_reprocess,
+                'page_size': page_size or settings.backfill_page_size
+            },
+            'last_id': None,  # 已处理完的最大 tb_image.id，恢复时从它之后开始
+            'processed': 0,
+            'success': 0,
+            'failed': 0,
+            'skipped': 0,
+            'failed_ids': [],
+            'pages': 0,
+            'error': None,
+            'created_at': now,
+            'updated_at': now,
+            'finished_at': None
+        }
+        return cls(state, checkpoint_dir)
+    
+    @classmethod
+    def load(cls, checkpoint_path: str) -> "BackfillJob":
+        with open(checkpoint_path, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+        return cls(state, os.path.dirname(checkpoint_path))
+    
+    @property
+    def job_id(self) -> str:
+        return self.state['job_id']
+    
+    @property
+    def is_alive(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+    
+    def snapshot(self) -> dict:
+        """获取任务状态的副本"""
+        with self._lock:
+            return json.loads(json.dumps(self.state))
+    
+    def save(self):
+        """原子写入断点文件：先写临时文件再替换，进程中途退出也不会留下半个文件"""
+        with self._lock:
+            self.state['updated_at'] = time.time()
+            data = json.dumps(self.state, ensure_ascii=False, indent=2)
+        tmp_path = f"{self.checkpoint_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.checkpoint_path)
+    
+    def _set_status(self, status: str, error: Optional[str] = None):
+        with self._lock:
+            self.state['status'] = status
+            if error is not None:
+                self.state['error'] = error
+            if status in (STATUS_COMPLETED, STATUS_FAILED):
+                self.state['finished_at'] = time.time()
+        self.save()
+    
+    def start(self):
+        """启动（或从断点恢复）后台线程"""
+        if self.is_alive:
+            # 暂停请求尚未生效（当前页还在处理），撤销暂停即可
+            with self._lock:
+                if self.state['status'] == STATUS_PAUSING:
+                    self._pause_requested.clear()
+                    self.state['status'] = STATUS_RUNNING
+            self.save()
+            return
+        self._pause_requested.clear()
+        with self._lock:
+            self.state['error'] = None
+        self._set_status(STATUS_RUNNING)
+        self._thread = threading.Thread(target=self._run, name=f"backfill-{self.job_id}", daemon=True)
+        self._thread.start()
+    
+    def pause(self):
+        """请求暂停：当前页处理完并写入断点后停止"""
+        with self._lock:
+            if not self.is_alive or self.state['status'] != STATUS_RUNNING:
+                return
+            self.state['status'] = STATUS_PAUSING
+            self._pause_requested.set()
+        self.save()
+    
+    def _next_page(self) -> list:
+        """从断点之后取下一页待处理图片"""
+        params = self.state['params']
+        page_size = params['page_size']
+        if params['limit'] is not None:
+            page_size = min(page_size, params['limit'] - self.state['processed'])
+            if page_size <= 0:
+                return []
+        return list(iter_images_keyset(
+            skip_processed=params['skip_processed'],
+            limit=page_size,
+            page_size=page_size,
+            start_after=self.state['last_id'],
+            model_version=get_feature_extractor().model_version
+        ))
+    
+    def _run(self):
+        """后台线程主循环：取一页 -> 流水线处理 -> 写断点"""
+        params = self.state['params']
+        extractor = get_feature_extractor()
+        logger.info(f"[回填任务 {self.job_id}] 开始，断点: {self.state['last_id']}")
+        try:
+            while not self._pause_requested.is_set():
+                page = self._next_page()
+                if not page:
+                    self._set_status(STATUS_COMPLETED)
+                    logger.info(f"[回填任务 {self.job_id}] 完成：{self._progress_text()}")
+                    return
+                
+                pipeline = IngestionPipeline(extractor, force_reprocess=params['force_reprocess'])
+                result = pipeline.run(page)
+                
+                with self._lock:
+                    # 页内按ID升序，最后一个即为本页最大ID
+                    self.state['last_id'] = int(page[-1][0])
+                    self.state['processed'] += result['total']
+                    self.state['success'] += result['success']
+                    self.state['failed'] += result['failed']
+                    self.state['skipped'] += result['skipped']
+                    self.state['pages'] += 1
+                    failed_ids = self.state['failed_ids'] + result['failed_ids']
+                    self.state['failed_ids'] = failed_ids[-settings.backfill_max_failed_ids:]
+                self.save()
+                logger.info(f"[回填任务 {self.job_id}] 第 {self.state['pages']} 页完成，断点 {self.state['last_id']}：{self._progress_text()}")
+            
+            self._set_status(STATUS_PAUSED)
+            logger.info(f"[回填任务 {self.job_id}] 已暂停，断点: {self.state['last_id']}")
+        except Exception as e:
+            logger.error(f"[回填任务 {self.job_id}] 失败: {e}")
+            self._set_status(STATUS_FAILED, error=str(e))
+    
+    def _progress_text(self) -> str:
+        state = self.state
+        return f"已处理 {state['processed']}，成功 {state['success']}，失败 {state['failed']}，跳过 {state['skipped']}"
+
+
+class BackfillJobManager:
+    """回填任务管理：创建、暂停、恢复和查询，断点保存在 checkpoint_dir 下"""
+    
+    def __init__(self, checkpoint_dir: Optional[str] = None):
+        self.checkpoint_dir = checkpoint_dir or settings.backfill_checkpoint_dir
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+        self._jobs: Dict[str, BackfillJob] = {}
+        self._lock = Lock()
+    
+    def recover(self, auto_resume: Optional[bool] = None):
+        """加载断点文件；上次运行中被打断的任务标记为 interrupted
+        
+        auto_resume 为True时自动恢复最早创建的一个中断任务（同一时间只运行一个任务）
+        """
+        if auto_resume is None:
+            auto_resume = settings.backfill_auto_resume
+        for name in sorted(os.listdir(self.checkpoint_dir)):
+            if not name.endswith('.json'):
+                continue
+            try:
+                job = BackfillJob.load(os.path.join(self.checkpoint_dir, name))
+            except Exception as e:
+                logger.warning(f"读取回填任务断点失败 {name}: {e}")
+                continue
+            with self._lock:
+                self._jobs[job.job_id] = job
+            if job.state['status'] in (STATUS_RUNNING, STATUS_PAUSING):
+                job._set_status(STATUS_INTERRUPTED)
+                logger.info(f"[回填任务 {job.job_id}] 上次运行被中断，断点: {job.state['last_id']}")
+        
+        if auto_resume:
+            with self._lock:
+                interrupted = [job for job in self._jobs.values() if job.state['status'] == STATUS_INTERRUPTED]
+            if interrupted:
+                job = min(interrupted, key=lambda job: job.state['created_at'])
+                logger.info(f"[回填任务 {job.job_id}] 自动从断点恢复")
+                job.start()
+    
+    def _ensure_no_running(self, job_id: str):
+        """同一时间只运行一个回填任务，避免争用推理批处理器和数据库"""
+        with self._lock:
+            for job in self._jobs.values():
+                if job.job_id != job_id and job.is_alive:
+                    raise RuntimeError(f"回填任务 {job.job_id} 正在运行，请先暂停")
+    
+    def start(
+        self,
+        limit: Optional[int] = None,
+        skip_processed: bool = True,
+        force_reprocess: bool = False,
+        page_size: Optional[int] = None
+    ) -> dict:
+        """创建并启动新任务"""
+        job = BackfillJob.create(self.checkpoint_dir, limit, skip_processed, force_reprocess, page_size)
+        self._ensure_no_running(job.job_id)
+        with self._lock:
+            self._jobs[job.job_id] = job
+        job.start()
+        return job.snapshot()
+    
+    def pause(self, job_id: str) -> dict:
+        job = self._get_job(job_id)
+        job.pause()
+        return job.snapshot()
+    
+    def resume(self, job_id: str) -> dict:
+        """从断点恢复暂停、中断或失败的任务"""
+        job = self._get_job(job_id)
+        if job.state['status'] == STATUS_COMPLETED:
+            raise RuntimeError(f"回填任务 {job_id} 已完成")
+        self._ensure_no_running(job_id)
+        job.start()
+        return job.snapshot()
+    
+    def status(self, job_id: str) -> dict:
+        return self._get_job(job_id).snapshot()
+    
+    def list_jobs(self) -> List[dict]:
+        with self._lock:
+            jobs = list(self._jobs.values())
+        return sorted((job.snapshot() for job in jobs), key=lambda state: state['created_at'], reverse=True)
+    
+    def _get_job(self, job_id: str) -> BackfillJob:
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None:
+            raise KeyError(job_id)
+        return job
+
+
+# 全局回填任务管理器实例
+_backfill_manager: Optional[BackfillJobManager] = None
+
+
+def get_backfill_manager() -> BackfillJobManager:
+    """获取回填任务管理器单例"""
+    global _backfill_manager
+    if _backfill_manager is None:
+        _backfill_manager = BackfillJobManager()
+    return _backfill_manager
@@ -1,11 +1,31 @@
 """
 数据库连接工具
 """
+import uuid
+import struct
+import logging
+from collections import OrderedDict
+from threading import Lock
+from io import BytesIO
+import numpy as np
 import psycopg2
 from psycopg2 import pool
-from typing import Optional, List
+from psycopg2.extras import execute_values
+from typing import Callable, Dict, Iterator, Optional, List, Tuple, Union
 from config import settings
 
+logger = logging.getLogger(__name__)
+
+# 特征向量表
+FEATURE_TABLE = "tb_hsx_img_value"
+
+# COPY批量写入使用的会话级临时表，事务提交时自动清空
+STAGING_TABLE = "tmp_hsx_img_value_stage"
+
+# PostgreSQL二进制COPY格式的文件头：签名 + flags + 头扩展长度
+_PGCOPY_HEADER = b'PGCOPY\n\xff\r\n\x00' + struct.pack('!ii', 0, 0)
+_PGCOPY_TRAILER = struct.pack('!h', -1)
+
 
 class Database:
     """数据库连接管理类"""
@@ -52,7 +72,74 @@ def get_db_connection():
     return Database.get_connection()
 
 
-def save_feature_vector(image_id: str, feature_vector: list, vector_dimension: int, model_version: str = "MobileNetV2-GPU"):
+# 特征向量写入监听器：写入 tb_hsx_img_value 的事务提交后，按模型版本分组，以 (image_id列表, 模型版本) 调用
+_write_listeners: List[Callable[[List[int], str], None]] = []
+
+# 已处理图片ID的内存索引（utils.processed_index），就绪后存在性检查不再访问数据库
+_processed_index = None
+
+
+def register_write_listener(listener: Callable[[List[int], str], None]):
+    """注册特征向量写入监听器"""
+    if listener not in _write_listeners:
+        _write_listeners.append(listener)
+
+
+def unregister_write_listener(listener: Callable[[List[int], str], None]):
+    """取消注册特征向量写入监听器"""
+    if listener in _write_listeners:
+        _write_listeners.remove(listener)
+
+
+def _notify_written(table: str, written: List[Tuple[int, str]]):
+    """通知监听器特征向量已写入（只通知正式表的写入，监听器异常不影响写入结果）
+    
+    Args:
+        table: 写入的表
+        written: (image_id, model_version) 列表
+    """
+    if table != FEATURE_TABLE or not _write_listeners:
+        return
+    by_version: Dict[str, List[int]] = {}
+    for image_id, model_version in written:
+        by_version.setdefault(model_version, []).append(int(image_id))
+    for listener in list(_write_listeners):
+        for model_version, image_ids in by_version.items():
+            try:
+                listener(image_ids, model_version)
+            except Exception as e:
+                logger.warning(f"特征向量写入监听器执行失败: {e}")
+
+
+def set_processed_index(index):
+    """设置已处理图片ID索引，None表示存在性检查总是查询数据库"""
+    global _processed_index
+    _processed_index = index
+
+
+def _ready_processed_index(model_version: Optional[str]):
+    """已就绪且与查询的模型版本一致的已处理ID索引（不限版本的查询总是访问数据库）"""
+    index = _processed_index
+    if index is None or not index.ready or model_version is None or index.model_version != model_version:
+        return None
+    return index
+
+
+def vector_to_text(feature_vector: Union[np.ndarray, list]) -> str:
+    """将特征向量转换为PostgreSQL vector类型的文本格式 '[0.1,0.2,...]'
+    
+    按float32的最短表示格式化（pgvector本身以float4存储），比float64文本更短、解析更快
+    """
+    vector = np.asarray(feature_vector, dtype=np.float32)
+    return '[' + ','.join(vector.astype(str)) + ']'
+
+
+def text_to_vector(vector_text: str) -> np.ndarray:
+    """将PostgreSQL vector类型的文本格式 '[0.1,0.2,...]' 解析为float32数组"""
+    return np.array(vector_text.strip('[]').split(','), dtype=np.float32)
+
+
+def save_feature_vector(image_id: str, feature_vector: Union[np.ndarray, list], vector_dimension: int, model_version: str = "MobileNetV2-GPU"):
     """保存特征向量到数据库"""
     conn = None
     try:
@@ -63,7 +150,7 @@ def save_feature_vector(image_id: str, feature_vector: list, vector_dimension: i
         image_id_int = int(image_id)
         
         # 将特征向量转换为PostgreSQL vector类型格式
-        vector_string = f"[{','.join(map(str, feature_vector))}]"
+        vector_string = vector_to_text(feature_vector)
         
         # 插入或更新特征向量
         cursor.execute(
@@ -76,12 +163,15 @@ def save_feature_vector(image_id: str, feature_vector: list, vector_dimension: i
                 vector_dimension = EXCLUDED.vector_dimension,
                 model_version = EXCLUDED.model_version,
                 update_time = CURRENT_TIMESTAMP
+            WHERE (tb_hsx_img_value.feature_vector, tb_hsx_img_value.model_version)
+                IS DISTINCT FROM (EXCLUDED.feature_vector, EXCLUDED.model_version)
             """,
             (image_id_int, vector_string, vector_dimension, model_version)
         )
         
         conn.commit()
         cursor.close()
+        _notify_written(FEATURE_TABLE, [(image_id_int, model_version)])
         return True
     except Exception as e:
         if conn:
@@ -92,11 +182,31 @@ def save_feature_vector(image_id: str, feature_vector: list, vector_dimension: i
             Database.return_connection(conn)
 
 
-def save_feature_vectors_batch(data: List[tuple]) -> int:
+def _dedupe_rows(data: List[tuple]) -> List[tuple]:
+    """同一批次中重复的image_id只保留最后一条，避免多行upsert重复更新同一行"""
+    rows = {}
+    for row in data:
+        rows[int(row[0])] = row
+    return list(rows.values()) if len(rows) < len(data) else data
+
+
+def save_feature_vectors_batch(data: List[tuple], table: str = FEATURE_TABLE, strategy: Optional[str] = None) -> int:
     """批量保存特征向量到数据库
     
+    所有写入方式都是 INSERT ... ON CONFLICT DO UPDATE：force_reprocess 重新提取时直接覆盖旧向量，
+    不需要先DELETE；向量和模型版本都未变化的行不更新，不产生死元组，也不向HNSW索引插入新条目
+    
+    写入方式：
+        executemany: 逐行执行INSERT，每行一次往返，仅用于对比
+        values: 多行 VALUES 的 INSERT ... ON CONFLICT，每 db_values_page_size 行一条语句
+        copy: COPY 到临时表后一次合并，见 save_feature_vectors_copy
+        auto: 行数不少于 db_copy_min_rows 时使用 copy，否则使用 values
+    
     Args:
-        data: 元组列表，每个元组包含 (image_id, feature_vector, vector_dimension, model_version)
+        data: 元组列表，每个元组包含 (image_id, feature_vector, vector_dimension, model_version)，
+              feature_vector 可以是float32数组（特征矩阵的一行）或列表
+        table: 目标表，默认 tb_hsx_img_value
+        strategy: 写入方式，None表示使用配置值 db_write_strategy
     
     Returns:
         成功保存的数量
@@ -104,6 +214,14 @@ def save_feature_vectors_batch(data: List[tuple]) -> int:
     if not data:
         return 0
     
+    strategy = strategy or settings.db_write_strategy
+    if strategy == "auto":
+        strategy = "copy" if len(data) >= settings.db_copy_min_rows else "values"
+    if strategy == "copy":
+        return save_feature_vectors_copy(data, table=table)
+    if strategy not in ("values", "executemany"):
+        raise ValueError(f"不支持的写入方式: {strategy}")
+    
     conn = None
     success_count = 0
     try:
@@ -111,30 +229,43 @@ def save_feature_vectors_batch(data: List[tuple]) -> int:
         cursor = conn.cursor()
         
         # 准备批量插入数据
+        if strategy == "values":
+            data = _dedupe_rows(data)
         insert_data = []
         for image_id, feature_vector, vector_dimension, model_version in data:
             image_id_int = int(image_id)
-            vector_string = f"[{','.join(map(str, feature_vector))}]"
+            vector_string = vector_to_text(feature_vector)
             insert_data.append((image_id_int, vector_string, vector_dimension, model_version))
         
-        # 批量插入或更新
-        cursor.executemany(
-            """
-            INSERT INTO tb_hsx_img_value 
+        upsert_sql = f"""
+            INSERT INTO {table} 
             (image_id, feature_vector, vector_dimension, model_version) 
-            VALUES (%s, %s::vector, %s, %s)
+            VALUES {{values}}
             ON CONFLICT (image_id) DO UPDATE 
             SET feature_vector = EXCLUDED.feature_vector,
                 vector_dimension = EXCLUDED.vector_dimension,
                 model_version = EXCLUDED.model_version,
                 update_time = CURRENT_TIMESTAMP
-            """,
-            insert_data
-        )
+            WHERE ({table}.feature_vector, {table}.model_version)
+                IS DISTINCT FROM (EXCLUDED.feature_vector, EXCLUDED.model_version)
+            """
+        
+        # 批量插入或更新
+        if strategy == "values":
+            execute_values(
+                cursor,
+                upsert_sql.format(values="%s"),
+                insert_data,
+                template="(%s, %s::vector, %s, %s)",
+                page_size=settings.db_values_page_size
+            )
+        else:
+            cursor.executemany(upsert_sql.format(values="(%s, %s::vector, %s, %s)"), insert_data)
         
         conn.commit()
         success_count = len(insert_data)
         cursor.close()
+        _notify_written(table, [(row[0], row[3]) for row in insert_data])
         return success_count
     except Exception as e:
         if conn:
@@ -145,8 +276,124 @@ def save_feature_vectors_batch(data: List[tuple]) -> int:
             Database.return_connection(conn)
 
 
-def check_feature_exists(image_id: str) -> bool:
-    """检查图片特征向量是否已存在"""
+def _build_copy_binary(data: List[tuple]) -> BytesIO:
+    """把待写入数据编码为PostgreSQL二进制COPY流
+    
+    vector列使用pgvector的二进制格式：int16维度 + int16保留位 + 大端float32数组，
+    直接从float32数组拷贝字节，不经过文本格式化
+    """
+    buffer = BytesIO()
+    buffer.write(_PGCOPY_HEADER)
+    for image_id, feature_vector, vector_dimension, model_version in data:
+        vector = np.asarray(feature_vector, dtype='>f4')
+        version = model_version.encode('utf-8')
+        # 字段数、image_id(BIGINT)、feature_vector头部
+        buffer.write(struct.pack('!hiqihh', 4, 8, int(image_id), 4 + vector.nbytes, len(vector), 0))
+        buffer.write(vector.tobytes())
+        # vector_dimension(INTEGER)、model_version(VARCHAR)
+        buffer.write(struct.pack('!iii', 4, int(vector_dimension), len(version)))
+        buffer.write(version)
+    buffer.write(_PGCOPY_TRAILER)
+    buffer.seek(0)
+    return buffer
+
+
+def _build_copy_text(data: List[tuple]) -> BytesIO:
+    """把待写入数据编码为COPY文本流（不支持二进制vector时使用）"""
+    lines = []
+    for image_id, feature_vector, vector_dimension, model_version in data:
+        version = model_version.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n')
+        lines.append(f"{int(image_id)}\t{vector_to_text(feature_vector)}\t{int(vector_dimension)}\t{version}\n")
+    return BytesIO(''.join(lines).encode('utf-8'))
+
+
+def save_feature_vectors_copy(data: List[tuple], table: str = FEATURE_TABLE, binary: Optional[bool] = None) -> int:
+    """通过 COPY FROM STDIN 批量写入特征向量（适合全量回填等大批量写入）
+    
+    数据先COPY到会话级临时表，再用一条 INSERT ... SELECT ... ON CONFLICT 合并到目标表，
+    整批只有一次COPY和一次合并，没有逐行往返
+    
+    Args:
+        data: 元组列表，每个元组包含 (image_id, feature_vector, vector_dimension, model_version)
+        table: 目标表，默认 tb_hsx_img_value
+        binary: 是否使用二进制COPY，None表示使用配置值
+    
+    Returns:
+        保存的图片数量（重复的image_id只计一次）
+    """
+    if not data:
+        return 0
+    
+    if binary is None:
+        binary = settings.db_copy_binary
+    
+    conn = None
+    try:
+        conn = Database.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute(f"""
+            CREATE TEMP TABLE IF NOT EXISTS {STAGING_TABLE} (
+                image_id BIGINT,
+                feature_vector vector,
+                vector_dimension INTEGER,
+                model_version VARCHAR(50)
+            ) ON COMMIT DELETE ROWS
+        """)
+        
+        if binary:
+            cursor.copy_expert(
+                f"COPY {STAGING_TABLE} (image_id, feature_vector, vector_dimension, model_version) FROM STDIN WITH (FORMAT binary)",
+                _build_copy_binary(data)
+            )
+        else:
+            cursor.copy_expert(
+                f"COPY {STAGING_TABLE} (image_id, feature_vector, vector_dimension, model_version) FROM STDIN",
+                _build_copy_text(data)
+            )
+        
+        # 同一批次中重复的image_id只保留一条，避免 ON CONFLICT 重复更新同一行
+        cursor.execute(f"""
+            INSERT INTO {table} 
+            (image_id, feature_vector, vector_dimension, model_version) 
+            SELECT DISTINCT ON (image_id) image_id, feature_vector, vector_dimension, model_version
+            FROM {STAGING_TABLE}
+            ORDER BY image_id
+            ON CONFLICT (image_id) DO UPDATE 
+            SET feature_vector = EXCLUDED.feature_vector,
+                vector_dimension = EXCLUDED.vector_dimension,
+                model_version = EXCLUDED.model_version,
+                update_time = CURRENT_TIMESTAMP
+            WHERE ({table}.feature_vector, {table}.model_version)
+                IS DISTINCT FROM (EXCLUDED.feature_vector, EXCLUDED.model_version)
+        """)
+        
+        conn.commit()
+        cursor.close()
+        image_ids = [int(row[0]) for row in data]
+        _notify_written(table, [(image_id, row[3]) for image_id, row in zip(image_ids, data)])
+        # 向量和模型版本都未变化的行不会被更新（rowcount不计入），但同样视为已保存
+        return len(set(image_ids))
+    except Exception as e:
+        if conn:
+            conn.rollback()
+        raise e
+    finally:
+        if conn:
+            Database.return_connection(conn)
+
+
+def check_feature_exists(image_id: str, model_version: Optional[str] = None) -> bool:
+    """检查图片特征向量是否已存在（已处理ID索引就绪时直接查内存）
+    
+    Args:
+        image_id: 图片ID
+        model_version: 只把该模型版本生成的向量视为已存在（更换预处理模式后旧版本的向量需要重新提取），None表示不限
+    """
+    index = _ready_processed_index(model_version)
+    if index is not None:
+        return index.contains(image_id)
+    
     conn = None
     try:
         conn = Database.get_connection()
@@ -155,8 +402,8 @@ def check_feature_exists(image_id: str) -> bool:
         # 将image_id转换为整数进行查询
         image_id_int = int(image_id)
         cursor.execute(
-            "SELECT id FROM tb_hsx_img_value WHERE image_id = %s",
-            (image_id_int,)
+            "SELECT id FROM tb_hsx_img_value WHERE image_id = %s AND (%s::text IS NULL OR model_version = %s)",
+            (image_id_int, model_version, model_version)
         )
         
         exists = cursor.fetchone() is not None
@@ -169,11 +416,12 @@ def check_feature_exists(image_id: str) -> bool:
             Database.return_connection(conn)
 
 
-def check_features_exist_batch(image_ids: List[str]) -> set:
+def check_features_exist_batch(image_ids: List[str], model_version: Optional[str] = None) -> set:
     """批量检查图片特征向量是否已存在
     
     Args:
         image_ids: 图片ID列表
+        model_version: 只把该模型版本生成的向量视为已存在，None表示不限
         
     Returns:
         已存在的图片ID集合
@@ -181,6 +429,11 @@ def check_features_exist_batch(image_ids: List[str]) -> set:
     if not image_ids:
         return set()
     
+    # 已处理ID索引就绪时直接查内存
+    index = _ready_processed_index(model_version)
+    if index is not None:
+        return index.filter_existing(image_ids)
+    
     conn = None
     try:
         conn = Database.get_connection()
@@ -191,8 +444,8 @@ def check_features_exist_batch(image_ids: List[str]) -> set:
         
         # 批量查询
         cursor.execute(
-            "SELECT image_id FROM tb_hsx_img_value WHERE image_id = ANY(%s)",
-            (image_id_ints,)
+            "SELECT image_id FROM tb_hsx_img_value WHERE image_id = ANY(%s) AND (%s::text IS NULL OR model_version = %s)",
+            (image_id_ints, model_version, model_version)
         )
         
         existing_ids = {str(row[0]) for row in cursor.fetchall()}
@@ -205,77 +458,145 @@ def check_features_exist_batch(image_ids: List[str]) -> set:
             Database.return_connection(conn)
 
 
+class ImageUrlCache:
+    """图片ID -> URL 的进程内LRU缓存（线程安全）
+    
+    ecai.tb_image 中图片的URL写入后不再修改，缓存不设过期时间；不存在的ID不缓存
+    """
+    
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = Lock()
+        self._hits = 0
+        self._misses = 0
+    
+    def get_many(self, image_ids: List[str]) -> Dict[str, str]:
+        """返回已缓存的 {image_id: url}"""
+        found = {}
+        with self._lock:
+            for image_id in image_ids:
+                url = self._entries.get(image_id)
+                if url is not None:
+                    self._entries.move_to_end(image_id)
+                    found[image_id] = url
+            self._hits += len(found)
+            self._misses += len(image_ids) - len(found)
+        return found
+    
+    def put_many(self, urls: Dict[str, str]):
+        with self._lock:
+            self._entries.update(urls)
+            for image_id in urls:
+                self._entries.move_to_end(image_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+    
+    def stats(self) -> dict:
+        """获取缓存统计"""
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_ratio': round(self._hits / lookups, 3) if lookups else 0.0
+            }
+
+
+# 图片URL缓存，image_url_cache_size 为0时不缓存
+_image_url_cache: Optional[ImageUrlCache] = ImageUrlCache(settings.image_url_cache_size) if settings.image_url_cache_size > 0 else None
+
+
+def image_url_cache_stats() -> Optional[dict]:
+    """获取图片URL缓存统计，未启用时返回None"""
+    return _image_url_cache.stats() if _image_url_cache is not None else None
+
+
 def get_image_url(image_id: str) -> Optional[str]:
-    """从数据库获取图片URL"""
+    """从数据库获取图片URL（与批量查询共用按主键的查询和缓存），ID无效或不存在时返回None"""
+    try:
+        image_id = str(int(image_id))
+    except (TypeError, ValueError):
+        return None
+    return get_image_urls([image_id]).get(image_id)
+
+
+def get_image_urls(image_ids: List[str]) -> Dict[str, str]:
+    """批量获取图片URL（一次查询，绑定bigint数组走 ecai.tb_image 主键索引）
+    
+    先查进程内缓存，只有未命中的ID才访问数据库
+    
+    Args:
+        image_ids: 图片ID列表
+        
+    Returns:
+        {image_id: url}，不存在或没有URL的图片不在结果中
+    """
+    if not image_ids:
+        return {}
+    
+    image_ids = [str(int(img_id)) for img_id in image_ids]
+    urls = _image_url_cache.get_many(image_ids) if _image_url_cache is not None else {}
+    missing_ids = [img_id for img_id in image_ids if img_id not in urls]
+    if not missing_ids:
+        return urls
+    
     conn = None
     try:
         conn = Database.get_connection()
         cursor = conn.cursor()
         
+        image_id_ints = [int(img_id) for img_id in missing_ids]
         cursor.execute(
-            "SELECT url FROM ecai.tb_image WHERE id::text = %s",
-            (image_id,)
+            "SELECT id, url FROM ecai.tb_image WHERE id = ANY(%s::bigint[]) AND url IS NOT NULL AND url <> ''",
+            (image_id_ints,)
         )
         
-        result = cursor.fetchone()
+        fetched = {str(row[0]): row[1] for row in cursor.fetchall()}
         cursor.close()
-        return result[0] if result else None
     except Exception as e:
         raise e
     finally:
         if conn:
             Database.return_connection(conn)
+    
+    if _image_url_cache is not None:
+        _image_url_cache.put_many(fetched)
+    urls.update(fetched)
+    return urls
 
 
-def get_all_images(limit: Optional[int] = None, skip_processed: bool = True):
-    """获取所有图片信息
+def get_feature_vector_by_url(image_url: str, model_version: Optional[str] = None) -> Optional[np.ndarray]:
+    """按URL查找 ecai.tb_image 中对应图片已保存的特征向量
     
     Args:
-        limit: 限制返回数量，None表示返回所有
-        skip_processed: 是否跳过已处理的图片
-    
+        image_url: 图片URL
+        model_version: 只返回该模型版本生成的向量，None表示不限
+        
     Returns:
-        图片列表，每个元素包含 (image_id, url)
+        float32特征向量，URL不在图片表中或尚未处理时返回None
     """
     conn = None
     try:
         conn = Database.get_connection()
         cursor = conn.cursor()
         
-        if skip_processed:
-            # 只查询未处理的图片
-            if limit:
-                cursor.execute("""
-                    SELECT i.id::text as id, i.url 
-                    FROM ecai.tb_image i
-                    LEFT JOIN tb_hsx_img_value f ON i.id = f.image_id
-                    WHERE f.id IS NULL
-                    LIMIT %s
-                """, (limit,))
-            else:
-                cursor.execute("""
-                    SELECT i.id::text as id, i.url 
-                    FROM ecai.tb_image i
-                    LEFT JOIN tb_hsx_img_value f ON i.id = f.image_id
-                    WHERE f.id IS NULL
-                """)
-        else:
-            # 查询所有图片
-            if limit:
-                cursor.execute("""
-                    SELECT id::text as id, url 
-                    FROM ecai.tb_image
-                    LIMIT %s
-                """, (limit,))
-            else:
-                cursor.execute("""
-                    SELECT id::text as id, url 
-                    FROM ecai.tb_image
-                """)
+        cursor.execute(
+            f"""
+            SELECT v.feature_vector::text
+            FROM ecai.tb_image i
+            JOIN {FEATURE_TABLE} v ON v.image_id = i.id
+            WHERE i.url = %s AND (%s::text IS NULL OR v.model_version = %s)
+            LIMIT 1
+            """,
+            (image_url, model_version, model_version)
+        )
         
-        results = cursor.fetchall()
+        result = cursor.fetchone()
         cursor.close()
-        return [(row[0], row[1]) for row in results]
+        return text_to_vector(result[0]) if result else None
     except Exception as e:
         raise e
     finally:
@@ -283,11 +604,114 @@ def get_all_images(limit: Optional[int] = None, skip_processed: bool = True):
             Database.return_connection(conn)
 
 
-def get_total_image_count(skip_processed: bool = True) -> int:
+def iter_processed_image_ids(chunk_size: int = 100000, model_version: Optional[str] = None) -> Iterator[np.ndarray]:
+    """流式读取所有已处理的image_id（服务端命名游标），每次产出一个int64数组
+    
+    Args:
+        chunk_size: 每次从服务端取回的行数
+        model_version: 只读取该模型版本生成的向量，None表示不限
+    """
+    conn = None
+    try:
+        conn = Database.get_connection()
+        cursor = conn.cursor(name=f"iter_processed_image_ids_{uuid.uuid4().hex}")
+        cursor.execute(
+            f"SELECT image_id FROM {FEATURE_TABLE} WHERE %s::text IS NULL OR model_version = %s",
+            (model_version, model_version)
+        )
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+        cursor.close()
+    finally:
+        if conn:
+            conn.rollback()
+            Database.return_connection(conn)
+
+
+def iter_images_keyset(
+    skip_processed: bool = True,
+    limit: Optional[int] = None,
+    page_size: Optional[int] = None,
+    start_after: Optional[int] = None,
+    model_version: Optional[str] = None
+) -> Iterator[Tuple[str, str]]:
+    """按主键分页（keyset）查找待处理图片
+    
+    每页执行一次 WHERE i.id > last_id ... ORDER BY i.id LIMIT n，沿主键索引向后扫描，
+    用 NOT EXISTS 逐行探测 tb_hsx_img_value 的 image_id 唯一索引，不需要两表全量关联；
+    每页查询完立即归还连接，处理期间不占用连接和事务。
+    处理过程中写入的新特征不会影响后续页（只会被 NOT EXISTS 过滤掉），不会重复或遗漏。
+    
+    Args:
+        skip_processed: 是否跳过已处理的图片
+        limit: 限制返回数量，None表示返回所有
+        page_size: 每页行数，None表示使用配置值
+        start_after: 从大于该ID的图片开始，None表示从头开始（用于断点续跑）
+        model_version: 跳过已处理图片时只把该模型版本生成的向量视为已处理，None表示不限
+    
+    Yields:
+        (image_id, url)，按 image_id 升序
+    """
+    page_size = page_size or settings.discover_page_size
+    last_id = start_after if start_after is not None else -1
+    returned = 0
+    
+    if skip_processed:
+        sql = """
+            SELECT i.id, i.url 
+            FROM ecai.tb_image i
+            WHERE i.id > %s
+              AND NOT EXISTS (
+                  SELECT 1 FROM tb_hsx_img_value f
+                  WHERE f.image_id = i.id AND (%s::text IS NULL OR f.model_version = %s)
+              )
+            ORDER BY i.id
+            LIMIT %s
+        """
+        version_params = (model_version, model_version)
+    else:
+        sql = """
+            SELECT i.id, i.url 
+            FROM ecai.tb_image i
+            WHERE i.id > %s
+            ORDER BY i.id
+            LIMIT %s
+        """
+        version_params = ()
+    
+    while limit is None or returned < limit:
+        fetch_size = page_size if limit is None else min(page_size, limit - returned)
+        conn = None
+        try:
+            conn = Database.get_connection()
+            cursor = conn.cursor()
+            cursor.execute(sql, (last_id,) + version_params + (fetch_size,))
+            rows = cursor.fetchall()
+            cursor.close()
+            conn.commit()
+        finally:
+            if conn:
+                Database.return_connection(conn)
+        
+        for image_id, url in rows:
+            yield str(image_id), url
+        returned += len(rows)
+        if len(rows) < fetch_size:
+            return
+        last_id = rows[-1][0]
+
+
+def get_total_image_count(skip_processed: bool = True, approximate: bool = False, model_version: Optional[str] = None) -> int:
     """获取图片总数
     
     Args:
         skip_processed: 是否只统计未处理的图片
+        approximate: 是否使用统计信息（pg_class.reltuples）估算，不扫描表，
+                     结果取决于最近一次 ANALYZE/VACUUM，可能与实际数量有偏差（不区分模型版本）
+        model_version: 只统计未处理时，只把该模型版本生成的向量视为已处理，None表示不限
     
     Returns:
         图片数量
@@ -297,13 +721,25 @@ def get_total_image_count(skip_processed: bool = True) -> int:
         conn = Database.get_connection()
         cursor = conn.cursor()
         
+        if approximate:
+            # reltuples 为 -1 表示表从未被分析过，按0处理
+            cursor.execute("""
+                SELECT
+                    (SELECT GREATEST(reltuples, 0)::bigint FROM pg_class WHERE oid = 'ecai.tb_image'::regclass),
+                    (SELECT GREATEST(reltuples, 0)::bigint FROM pg_class WHERE oid = 'tb_hsx_img_value'::regclass)
+            """)
+            image_count, feature_count = cursor.fetchone()
+            cursor.close()
+            return max(image_count - feature_count, 0) if skip_processed else image_count
+        
         if skip_processed:
             cursor.execute("""
                 SELECT COUNT(*) 
                 FROM ecai.tb_image i
-                LEFT JOIN tb_hsx_img_value f ON i.id = f.image_id
+                LEFT JOIN tb_hsx_img_value f
+                  ON i.id = f.image_id AND (%s::text IS NULL OR f.model_version = %s)
                 WHERE f.id IS NULL
-            """)
+            """, (model_version, model_version))
         else:
             cursor.execute("SELECT COUNT(*) FROM ecai.tb_image")
         
@@ -0,0 +1,151 @@
+"""
+多进程图片解码池
+图片解码、RGB转换和缩放在独立的子进程中执行，不受推理进程GIL限制。
+子进程把 uint8 结果直接写入共享内存（multiprocessing.shared_memory）中的槽位，
+推理进程从槽位拷贝出数组，结果不经过pickle；只有压缩后的图片字节会发送给子进程。
+
+本模块和子进程只依赖 utils.image_decode（PIL + NumPy），不导入TensorFlow。
+子进程以spawn方式启动并会重新导入主模块，服务应通过 run.py 或 uvicorn 启动。
+"""
+import queue
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from threading import Lock
+from typing import Optional
+
+import numpy as np
+
+from config import settings
+from utils.image_decode import decode_image
+
+logger = logging.getLogger(__name__)
+
+# 每个子进程对应的共享内存槽位数，槽位用完时调用方阻塞等待（背压）
+_SLOTS_PER_PROCESS = 4
+
+# 子进程中挂载的共享内存
+_worker_shm: Optional[shared_memory.SharedMemory] = None
+_worker_slots: Optional[np.ndarray] = None
+
+
+def _init_worker(shm_name: str, slots: int, size: int):
+    """子进程初始化：挂载共享内存，槽位数组视图在进程内复用"""
+    global _worker_shm, _worker_slots
+    _worker_shm = shared_memory.SharedMemory(name=shm_name)
+    _worker_slots = np.ndarray((slots, size, size, 3), dtype=np.uint8, buffer=_worker_shm.buf)
+
+
+def _decode_into_slot(image_bytes: bytes, slot: int, draft: bool):
+    """子进程中解码图片并写入指定槽位"""
+    size = _worker_slots.shape[1]
+    _worker_slots[slot] = decode_image(image_bytes, size, draft)
+
+
+class DecodePool:
+    """进程池解码器，线程安全；decode 会阻塞调用线程直到结果写回"""
+    
+    def __init__(self, processes: Optional[int] = None, size: Optional[int] = None, draft: Optional[bool] = None):
+        self.processes = processes or decode_processes_per_worker()
+        self.size = size or settings.model_input_size
+        self.slots = self.processes * _SLOTS_PER_PROCESS
+        self.draft = settings.jpeg_draft_decode if draft is None else draft
+        
+        self._shm = shared_memory.SharedMemory(create=True, size=self.slots * self.size * self.size * 3)
+        self._buffer = np.ndarray((self.slots, self.size, self.size, 3), dtype=np.uint8, buffer=self._shm.buf)
+        self._free_slots: "queue.Queue[int]" = queue.Queue()
+        for slot in range(self.slots):
+            self._free_slots.put(slot)
+        
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.processes,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker,
+            initargs=(self._shm.name, self.slots, self.size)
+        )
+        self._closed = False
+        
+        # 统计信息
+        self._stats_lock = Lock()
+        self._decoded = 0
+        self._failed = 0
+    
+    def decode(self, image_bytes: bytes) -> np.ndarray:
+        """在子进程中解码图片，返回uint8数组 (H, W, 3)，解码失败抛出子进程中的异常"""
+        if self._closed:
+            raise RuntimeError("解码进程池已关闭")
+        slot = self._free_slots.get()
+        try:
+            self._executor.submit(_decode_into_slot, image_bytes, slot, self.draft).result()
+            # 槽位归还后会被复用，拷贝出结果
+            pixels = self._buffer[slot].copy()
+        except Exception:
+            with self._stats_lock:
+                self._failed += 1
+            raise
+        finally:
+            self._free_slots.put(slot)
+        with self._stats_lock:
+            self._decoded += 1
+        return pixels
+    
+    def stats(self) -> dict:
+        """获取解码统计"""
+        with self._stats_lock:
+            return {
+                'processes': self.processes,
+                'slots': self.slots,
+                'free_slots': self._free_slots.qsize(),
+                'decoded': self._decoded,
+                'failed': self._failed
+            }
+    
+    def close(self, wait: bool = True):
+        """关闭子进程并释放共享内存"""
+        if self._closed:
+            return
+        self._closed = True
+        self._executor.shutdown(wait=wait, cancel_futures=True)
+        self._buffer = None
+        self._shm.close()
+        self._shm.unlink()
+
+
+def decode_processes_per_worker() -> int:
+    """本服务工作进程的解码子进程数：decode_processes 是整台机器的总数，多进程部署时平均分给各工作进程"""
+    if settings.decode_processes <= 0:
+        return 0
+    return max(1, settings.decode_processes // max(1, settings.api_workers))
+
+
+def decode_thread_count(configured: int) -> int:
+    """向解码进程池提交任务的线程数：每个线程同一时刻只等待一张图片，线程数少于子进程数时多出的子进程闲置"""
+    return max(configured, decode_processes_per_worker())
+
+
+# 全局解码进程池实例
+_decode_pool: Optional[DecodePool] = None
+_decode_pool_lock = Lock()
+
+
+def get_decode_pool() -> Optional[DecodePool]:
+    """获取解码进程池单例，decode_processes 为0时返回None（在线程中解码）"""
+    global _decode_pool
+    if settings.decode_processes <= 0:
+        return None
+    if _decode_pool is None:
+        with _decode_pool_lock:
+            if _decode_pool is None:
+                _decode_pool = DecodePool()
+                logger.info(f"解码进程池已启动: {_decode_pool.processes} 个进程，{_decode_pool.slots} 个共享内存槽位")
+    return _decode_pool
+
+
+def close_decode_pool():
+    """关闭解码进程池（服务关闭时调用）"""
+    global _decode_pool
+    with _decode_pool_lock:
+        if _decode_pool is not None:
+            _decode_pool.close(wait=False)
+            _decode_pool = None
@@ -0,0 +1,246 @@
+"""
+异步图片下载引擎
+基于 httpx.AsyncClient，在独立的事件循环线程中运行：连接池按主机复用连接（keep-alive），
+可选HTTP/2，并用全局和按主机的并发上限保护下游CDN；可选本地磁盘缓存（utils.image_cache）。
+提取器、流水线和在线接口共用同一个实例。
+"""
+import time
+import asyncio
+import logging
+import threading
+from threading import Lock
+from typing import Dict, List, Optional
+from urllib.parse import urlsplit
+
+import httpx
+
+from config import settings
+from utils.image_cache import ImageCache, get_image_cache
+
+logger = logging.getLogger(__name__)
+
+
+def _http2_available() -> bool:
+    """HTTP/2 依赖 h2 包（pip install httpx[http2]）"""
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+class AsyncImageDownloader:
+    """共享的异步图片下载器
+    
+    同步调用方（线程池、流水线线程）使用 download / download_many，
+    事件循环中的调用方使用 download_async，都在下载器自己的事件循环中执行。
+    """
+    
+    def __init__(
+        self,
+        max_connections: Optional[int] = None,
+        max_per_host: Optional[int] = None,
+        timeout: Optional[float] = None,
+        http2: Optional[bool] = None,
+        cache: Optional[ImageCache] = None
+    ):
+        self.max_connections = max_connections or settings.download_max_connections
+        self.max_per_host = max_per_host or settings.download_max_per_host
+        self.timeout = timeout or settings.download_timeout
+        self.cache = cache if cache is not None else get_image_cache()
+        self.http2 = settings.download_http2 if http2 is None else http2
+        if self.http2 and not _http2_available():
+            logger.warning("未安装h2，HTTP/2不可用，使用HTTP/1.1")
+            self.http2 = False
+        
+        self._closed = False
+        self._loop = asyncio.new_event_loop()
+        self._client: Optional[httpx.AsyncClient] = None
+        self._global_semaphore: Optional[asyncio.Semaphore] = None
+        self._host_semaphores: Dict[str, asyncio.Semaphore] = {}
+        
+        # 统计信息
+        self._stats_lock = Lock()
+        self._requests = 0
+        self._failures = 0
+        self._bytes = 0
+        self._in_flight = 0
+        self._download_seconds = 0.0
+        
+        ready = threading.Event()
+        self._thread = threading.Thread(target=self._run_loop, args=(ready,), name="image-downloader", daemon=True)
+        self._thread.start()
+        ready.wait()
+    
+    def _run_loop(self, ready: threading.Event):
+        """下载器事件循环线程"""
+        asyncio.set_event_loop(self._loop)
+        self._global_semaphore = asyncio.Semaphore(self.max_connections)
+        self._client = httpx.AsyncClient(
+            http2=self.http2,
+            timeout=self.timeout,
+            limits=httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_connections,
+                keepalive_expiry=settings.download_keepalive_expiry
+            ),
+            follow_redirects=True,
+            trust_env=False,  # 不使用环境变量中的代理，避免代理连接问题
+            verify=True  # 验证SSL证书
+        )
+        ready.set()
+        self._loop.run_forever()
+    
+    def _host_semaphore(self, url: str) -> asyncio.Semaphore:
+        """按主机限制并发，避免单个CDN主机被打满（只在下载器事件循环中调用）"""
+        host = urlsplit(url).netloc
+        semaphore = self._host_semaphores.get(host)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.max_per_host)
+            self._host_semaphores[host] = semaphore
+        return semaphore
+    
+    async def _fetch(self, url: str) -> bytes:
+        """下载单张图片（在下载器事件循环中执行），失败抛出异常
+        
+        启用磁盘缓存时：新鲜的缓存直接从磁盘读取，不占用并发名额；过期的缓存带
+        If-None-Match/If-Modified-Since 向源站确认，304时使用缓存内容
+        """
+        entry = None
+        if self.cache is not None:
+            entry = await asyncio.to_thread(self.cache.lookup, url)
+            if entry is not None and self.cache.is_fresh(entry):
+                content = await asyncio.to_thread(self.cache.read, entry)
+                if content is not None:
+                    return content
+        
+        headers = {}
+        if entry is not None:
+            if entry.etag:
+                headers['If-None-Match'] = entry.etag
+            if entry.last_modified:
+                headers['If-Modified-Since'] = entry.last_modified
+        
+        async with self._global_semaphore, self._host_semaphore(url):
+            with self._stats_lock:
+                self._in_flight += 1
+            start = time.perf_counter()
+            try:
+                response = await self._client.get(url, headers=headers)
+                if response.status_code != 304 or entry is None:
+                    response.raise_for_status()
+                content = response.content
+            except Exception:
+                with self._stats_lock:
+                    self._failures += 1
+                raise
+            finally:
+                with self._stats_lock:
+                    self._in_flight -= 1
+                    self._requests += 1
+                    self._download_seconds += time.perf_counter() - start
+        
+        if response.status_code == 304:
+            content = await asyncio.to_thread(self.cache.read, entry, True)
+            if content is not None:
+                return content
+            # 缓存文件已丢失，不带条件头重新下载
+            return await self._fetch(url)
+        
+        with self._stats_lock:
+            self._bytes += len(content)
+        if self.cache is not None:
+            await asyncio.to_thread(
+                self.cache.put,
+                url,
+                content,
+                response.headers.get('etag'),
+                response.headers.get('last-modified')
+            )
+        return content
+    
+    async def _fetch_many(self, urls: List[str], concurrency: Optional[int]) -> list:
+        if concurrency:
+            limiter = asyncio.Semaphore(concurrency)
+            
+            async def fetch(url):
+                async with limiter:
+                    return await self._fetch(url)
+        else:
+            fetch = self._fetch
+        return await asyncio.gather(*(fetch(url) for url in urls), return_exceptions=True)
+    
+    def _submit(self, coro):
+        """把协程提交到下载器事件循环"""
+        if self._closed:
+            coro.close()
+            raise RuntimeError("图片下载器已关闭")
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+    
+    def download(self, url: str) -> bytes:
+        """同步下载单张图片，失败抛出异常"""
+        return self._submit(self._fetch(url)).result()
+    
+    def download_many(self, urls: List[str], concurrency: Optional[int] = None) -> List[Optional[bytes]]:
+        """同步并发下载多张图片，返回与输入顺序一致的字节列表，失败的位置为None
+        
+        Args:
+            urls: 图片URL列表
+            concurrency: 本次调用的并发上限，None表示只受全局和按主机上限约束
+        """
+        if not urls:
+            return []
+        results = self._submit(self._fetch_many(urls, concurrency)).result()
+        contents = []
+        for url, result in zip(urls, results):
+            if isinstance(result, BaseException):
+                logger.warning(f"从URL加载图片失败 {url}: {result}")
+                contents.append(None)
+            else:
+                contents.append(result)
+        return contents
+    
+    async def download_async(self, url: str) -> bytes:
+        """在调用方的事件循环中等待下载结果，下载本身在下载器事件循环中执行"""
+        return await asyncio.wrap_future(self._submit(self._fetch(url)))
+    
+    def stats(self) -> dict:
+        """获取下载统计：请求数、失败数、字节数、在途请求数"""
+        with self._stats_lock:
+            requests = self._requests
+            return {
+                'requests': requests,
+                'failures': self._failures,
+                'bytes': self._bytes,
+                'in_flight': self._in_flight,
+                'avg_seconds': round(self._download_seconds / requests, 4) if requests else 0.0,
+                'hosts': len(self._host_semaphores),
+                'http2': self.http2,
+                'max_connections': self.max_connections,
+                'max_per_host': self.max_per_host,
+                'cache': self.cache.stats() if self.cache is not None else None
+            }
+    
+    def close(self, timeout: Optional[float] = None):
+        """关闭连接池并停止事件循环线程"""
+        if self._closed:
+            return
+        self._closed = True
+        asyncio.run_coroutine_threadsafe(self._client.aclose(), self._loop).result(timeout)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=timeout)
+
+
+# 全局下载器实例
+_image_downloader: Optional[AsyncImageDownloader] = None
+_image_downloader_lock = Lock()
+
+
+def get_image_downloader() -> AsyncImageDownloader:
+    """获取共享图片下载器单例"""
+    global _image_downloader
+    if _image_downloader is None:
+        with _image_downloader_lock:
+            if _image_downloader is None:
+                _image_downloader = AsyncImageDownloader()
+    return _image_downloader
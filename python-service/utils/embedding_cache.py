@@ -0,0 +1,122 @@
+"""
+进程内特征向量缓存
+按URL缓存已归一化的特征向量，最近最少使用淘汰，超过TTL的条目视为未命中。
+热门URL被重复请求时不再重新下载和推理；向量可以按float16存储以减半内存占用。
+"""
+import time
+import logging
+from collections import OrderedDict
+from threading import Lock
+from typing import Optional
+
+import numpy as np
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingCache:
+    """URL -> 特征向量 的LRU/TTL缓存，线程安全"""
+    
+    def __init__(
+        self,
+        max_entries: Optional[int] = None,
+        ttl_seconds: Optional[float] = None,
+        dtype: Optional[str] = None
+    ):
+        self.max_entries = max_entries or settings.embedding_cache_max_entries
+        self.ttl_seconds = settings.embedding_cache_ttl_seconds if ttl_seconds is None else ttl_seconds
+        self.dtype = np.dtype(dtype or settings.embedding_cache_dtype)
+        if self.dtype not in (np.float16, np.float32):
+            raise ValueError(f"不支持的缓存精度: {self.dtype}，可选 float16/float32")
+        
+        self._lock = Lock()
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()  # url -> (向量, 写入时间)
+        
+        # 统计信息
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
+        self._db_hits = 0
+    
+    def get(self, url: str) -> Optional[np.ndarray]:
+        """查询缓存，命中时返回float32向量，未命中或已过期返回None"""
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry is None:
+                self._misses += 1
+                return None
+            vector, stored_at = entry
+            if self.ttl_seconds and time.monotonic() - stored_at > self.ttl_seconds:
+                del self._entries[url]
+                self._expirations += 1
+                self._misses += 1
+                return None
+            self._entries.move_to_end(url)
+            self._hits += 1
+        # astype 总是返回新数组，调用方修改结果不影响缓存
+        return vector.astype(np.float32)
+    
+    def put(self, url: str, feature_vector: np.ndarray, from_db: bool = False):
+        """写入缓存，超出容量时淘汰最久未使用的条目
+        
+        Args:
+            url: 图片URL
+            feature_vector: 归一化后的特征向量
+            from_db: 向量来自数据库中已保存的结果（只用于统计）
+        """
+        vector = np.asarray(feature_vector).astype(self.dtype)
+        with self._lock:
+            self._entries[url] = (vector, time.monotonic())
+            self._entries.move_to_end(url)
+            if from_db:
+                self._db_hits += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+    
+    def stats(self) -> dict:
+        """获取缓存统计：条目数、命中/未命中/淘汰/过期次数和占用内存"""
+        with self._lock:
+            lookups = self._hits + self._misses
+            entries = len(self._entries)
+            vector_bytes = next(iter(self._entries.values()))[0].nbytes if entries else 0
+            return {
+                'entries': entries,
+                'max_entries': self.max_entries,
+                'hits': self._hits,
+                'misses': self._misses,
+                'evictions': self._evictions,
+                'expirations': self._expirations,
+                'db_hits': self._db_hits,
+                'hit_ratio': round(self._hits / lookups, 3) if lookups else 0.0,
+                'dtype': self.dtype.name,
+                'bytes': entries * vector_bytes
+            }
+
+
+# 全局缓存实例
+_embedding_cache: Optional[EmbeddingCache] = None
+_embedding_cache_lock = Lock()
+
+
+def get_embedding_cache() -> Optional[EmbeddingCache]:
+    """获取特征向量缓存单例，未启用时返回None"""
+    global _embedding_cache
+    if not settings.embedding_cache_enabled:
+        return None
+    if _embedding_cache is None:
+        with _embedding_cache_lock:
+            if _embedding_cache is None:
+                _embedding_cache = EmbeddingCache()
+                logger.info(
+                    f"特征向量缓存已启用: 最多 {_embedding_cache.max_entries} 条，"
+                    f"TTL {_embedding_cache.ttl_seconds}s，{_embedding_cache.dtype.name}"
+                )
+    return _embedding_cache
@@ -0,0 +1,116 @@
+"""
+进程级共享线程池
+I/O（下载、逐张处理）、解码/预处理、数据库三类工作各使用一个长期存在的线程池，
+线程数由配置决定，请求之间复用，避免每次调用新建线程池、嵌套线程池使线程数成倍增长
+"""
+import time
+import logging
+from threading import Lock
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict
+
+from config import settings
+from utils.decode_pool import decode_thread_count
+
+logger = logging.getLogger(__name__)
+
+
+class InstrumentedExecutor(ThreadPoolExecutor):
+    """带统计信息的线程池：排队任务数、活跃线程数、累计完成数和平均排队等待时间"""
+    
+    def __init__(self, name: str, max_workers: int):
+        super().__init__(max_workers=max_workers, thread_name_prefix=f"{name}-pool")
+        self.name = name
+        self._stats_lock = Lock()
+        self._active = 0
+        self._max_active = 0
+        self._submitted = 0
+        self._completed = 0
+        self._failed = 0
+        self._wait_seconds = 0.0
+    
+    def submit(self, fn, *args, **kwargs) -> Future:
+        submitted_at = time.perf_counter()
+        
+        def run():
+            with self._stats_lock:
+                self._active += 1
+                self._max_active = max(self._max_active, self._active)
+                self._wait_seconds += time.perf_counter() - submitted_at
+            try:
+                return fn(*args, **kwargs)
+            except BaseException:
+                with self._stats_lock:
+                    self._failed += 1
+                raise
+            finally:
+                with self._stats_lock:
+                    self._active -= 1
+                    self._completed += 1
+        
+        with self._stats_lock:
+            self._submitted += 1
+        return super().submit(run)
+    
+    def stats(self) -> dict:
+        """获取线程池统计"""
+        with self._stats_lock:
+            completed = self._completed
+            return {
+                'max_workers': self._max_workers,
+                'active': self._active,
+                'max_active': self._max_active,
+                'queued': self._work_queue.qsize(),
+                'submitted': self._submitted,
+                'completed': completed,
+                'failed': self._failed,
+                'avg_wait_ms': round(self._wait_seconds / completed * 1000, 2) if completed else 0.0
+            }
+
+
+# 全局线程池实例
+_executors: Dict[str, InstrumentedExecutor] = {}
+_executors_lock = Lock()
+
+
+def _get_executor(name: str, max_workers: int) -> InstrumentedExecutor:
+    executor = _executors.get(name)
+    if executor is None:
+        with _executors_lock:
+            executor = _executors.get(name)
+            if executor is None:
+                executor = InstrumentedExecutor(name, max_workers)
+                _executors[name] = executor
+                logger.info(f"共享线程池 {name} 已创建（{max_workers} 个线程）")
+    return executor
+
+
+def get_io_executor() -> InstrumentedExecutor:
+    """获取I/O线程池（等待下载、逐张处理图片等以等待为主的工作）"""
+    return _get_executor("io", settings.io_executor_workers)
+
+
+def get_decode_executor() -> InstrumentedExecutor:
+    """获取解码线程池（图片解码和预处理等CPU密集工作）"""
+    return _get_executor("decode", decode_thread_count(settings.decode_executor_workers))
+
+
+def get_db_executor() -> InstrumentedExecutor:
+    """获取数据库线程池（线程数不应超过连接池大小）"""
+    return _get_executor("db", settings.db_executor_workers)
+
+
+def executor_stats() -> dict:
+    """获取所有已创建线程池的统计"""
+    with _executors_lock:
+        executors = list(_executors.values())
+    return {executor.name: executor.stats() for executor in executors}
+
+
+def shutdown_executors(wait: bool = True):
+    """关闭所有共享线程池"""
+    with _executors_lock:
+        executors = list(_executors.values())
+        _executors.clear()
+    for executor in executors:
+        executor.shutdown(wait=wait)
@@ -0,0 +1,426 @@
+"""
+特征表全量重建（影子表切换）
+全量重新提取特征（更换模型等）时不在正式表上逐行覆盖：每次更新都会留下一个死元组，
+并向HNSW索引插入一个新条目（旧条目要等VACUUM才能清理），重建一遍后表和索引都接近翻倍。
+
+影子表方式：
+    create_rebuild_table()   创建与正式表结构相同的影子表，带上正式表的主键、唯一、外键约束、触发器、
+                             注释和授权（ON CONFLICT、ON DELETE CASCADE 和 update_time 维护在重建期间和切换后照常工作）
+    写入影子表                 save_feature_vectors_batch(rows, table=影子表)，或 IngestionPipeline(table=影子表)
+    swap_rebuild_table()     按正式表的定义在影子表上创建其余索引（含HNSW，一次性构建），
+                             补入影子表中没有的旧行（如下载失败的图片）和重建期间正式表上更新过的行，
+                             在一个短事务内改名切换，删除旧表
+
+以上步骤通过 FeatureRebuild 上下文执行：从创建影子表到切换完成全程持有同一张表的advisory lock，
+其他请求、其他工作进程或脚本同时发起重建时直接失败，不会删除正在写入的影子表；未切换就退出时删除影子表。
+
+正式表在重建期间照常读写（/process/image、回填任务、TS服务等），这些写入在切换时按 update_time 补入影子表；
+正式表只在切换事务内被锁定，锁等待中的写入在切换后按表名重新解析，写入新表。行级安全策略、其他表引用正式表的外键和依赖正式表的视图
+无法随切换转移，存在时拒绝重建。
+"""
+import re
+import time
+import logging
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from utils.db import Database, FEATURE_TABLE
+
+logger = logging.getLogger(__name__)
+
+REBUILD_SUFFIX = "_rebuild"
+RETIRED_SUFFIX = "_old"
+
+# pg_get_indexdef 输出的开头部分：CREATE [UNIQUE] INDEX 名称 ON [ONLY] 表名
+_INDEX_HEAD = re.compile(r'^CREATE (UNIQUE )?INDEX \S+ ON (?:ONLY )?\S+')
+
+# pg_get_triggerdef 输出中触发器所在的表：CREATE [CONSTRAINT] TRIGGER 名称 时机 事件 ON 表名
+_TRIGGER_TABLE = re.compile(r'^(CREATE (?:CONSTRAINT )?TRIGGER \S+ .*? ON )\S+')
+
+
+def rebuild_table_name(table: str = FEATURE_TABLE) -> str:
+    """影子表名"""
+    return f"{table}{REBUILD_SUFFIX}"
+
+
+def _constraints(cursor, table: str) -> List[Tuple[str, str]]:
+    """主键、唯一和外键约束 (名称, 定义)，主键和唯一约束在前"""
+    cursor.execute(
+        """
+        SELECT conname, pg_get_constraintdef(oid)
+        FROM pg_constraint
+        WHERE conrelid = %s::regclass AND contype IN ('p', 'u', 'f')
+        ORDER BY contype = 'f', conname
+        """,
+        (table,)
+    )
+    return cursor.fetchall()
+
+
+def _triggers(cursor, table: str) -> List[Tuple[str, str]]:
+    """用户定义的触发器 (名称, 定义)，如维护 update_time 的 BEFORE UPDATE 触发器"""
+    cursor.execute(
+        """
+        SELECT tgname, pg_get_triggerdef(oid)
+        FROM pg_trigger
+        WHERE tgrelid = %s::regclass AND NOT tgisinternal
+        ORDER BY tgname
+        """,
+        (table,)
+    )
+    return cursor.fetchall()
+
+
+def _grants(cursor, table: str) -> List[str]:
+    """表所有者以外角色的授权语句（{table} 处替换为目标表）"""
+    cursor.execute(
+        """
+        SELECT a.privilege_type,
+               CASE WHEN a.grantee = 0 THEN 'PUBLIC' ELSE quote_ident(r.rolname) END,
+               a.is_grantable
+        FROM pg_class c
+        CROSS JOIN LATERAL aclexplode(c.relacl) a
+        LEFT JOIN pg_roles r ON r.oid = a.grantee
+        WHERE c.oid = %s::regclass AND a.grantee <> c.relowner
+        """,
+        (table,)
+    )
+    return [
+        f"GRANT {privilege} ON {{table}} TO {grantee}{' WITH GRANT OPTION' if grantable else ''}"
+        for privilege, grantee, grantable in cursor.fetchall()
+    ]
+
+
+class RebuildInProgressError(RuntimeError):
+    """同一张表已有全量重建在运行"""
+
+
+def _check_swappable(cursor, table: str):
+    """切换时无法转移到影子表的对象：存在时拒绝重建，避免切换后静默丢失"""
+    problems = []
+    retired_table = f"{table}{RETIRED_SUFFIX}"
+    if _table_exists(cursor, retired_table):
+        problems.append(f"上次切换保留的旧表 {retired_table} 仍存在（请先删除）")
+    cursor.execute(
+        """
+        SELECT c.relrowsecurity OR EXISTS (SELECT 1 FROM pg_policy p WHERE p.polrelid = c.oid)
+        FROM pg_class c WHERE c.oid = %s::regclass
+        """,
+        (table,)
+    )
+    if cursor.fetchone()[0]:
+        problems.append("启用了行级安全策略")
+    cursor.execute(
+        "SELECT conname, conrelid::regclass::text FROM pg_constraint WHERE confrelid = %s::regclass AND contype = 'f'",
+        (table,)
+    )
+    problems.extend(f"被 {referencing} 的外键 {name} 引用" for name, referencing in cursor.fetchall())
+    cursor.execute(
+        """
+        SELECT DISTINCT r.ev_class::regclass::text
+        FROM pg_depend d
+        JOIN pg_rewrite r ON r.oid = d.objid
+        WHERE d.classid = 'pg_rewrite'::regclass AND d.refobjid = %s::regclass AND r.ev_class <> d.refobjid
+        """,
+        (table,)
+    )
+    problems.extend(f"被视图 {view} 依赖" for (view,) in cursor.fetchall())
+    if problems:
+        raise RuntimeError(f"表 {table} {'、'.join(problems)}，无法通过影子表切换重建")
+
+
+def _plain_indexes(cursor, table: str) -> List[Tuple[str, str]]:
+    """不属于约束的索引 (名称, 定义)，如HNSW向量索引"""
+    cursor.execute(
+        """
+        SELECT c.relname, pg_get_indexdef(i.indexrelid)
+        FROM pg_index i
+        JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE i.indrelid = %s::regclass
+          AND NOT EXISTS (SELECT 1 FROM pg_constraint k WHERE k.conindid = i.indexrelid)
+        ORDER BY c.relname
+        """,
+        (table,)
+    )
+    return cursor.fetchall()
+
+
+def _columns(cursor, table: str) -> List[str]:
+    """表的全部列名（已按需加引号）"""
+    cursor.execute(
+        """
+        SELECT quote_ident(attname)
+        FROM pg_attribute
+        WHERE attrelid = %s::regclass AND attnum > 0 AND NOT attisdropped
+        ORDER BY attnum
+        """,
+        (table,)
+    )
+    return [row[0] for row in cursor.fetchall()]
+
+
+def _write_horizon(cursor) -> datetime:
+    """此后提交的写入都满足 update_time >= 返回值：当前时间和所有未结束事务开始时间中的最早者
+    
+    写入的 update_time 取事务开始时间（CURRENT_TIMESTAMP），重建开始前已开始、之后才提交的事务也要算在内
+    """
+    cursor.execute(
+        """
+        SELECT LEAST(now(), min(xact_start))
+        FROM pg_stat_activity
+        WHERE datname = current_database() AND pid <> pg_backend_pid()
+        """
+    )
+    return cursor.fetchone()[0]
+
+
+def _table_exists(cursor, table: str) -> bool:
+    cursor.execute("SELECT to_regclass(%s) IS NOT NULL", (table,))
+    return cursor.fetchone()[0]
+
+
+def create_rebuild_table(table: str = FEATURE_TABLE) -> str:
+    """创建（或清空重建）影子表，返回影子表名（应在 FeatureRebuild 中调用，持有锁后才能安全地删除旧影子表）
+    
+    影子表复制正式表的列、默认值（共用同一个id序列）、列注释、主键/唯一/外键约束、触发器、表注释和授权，
+    其余索引在切换前再创建，这样写入时不需要维护HNSW索引，构建一次也比逐行插入快得多
+    """
+    rebuild_table = rebuild_table_name(table)
+    conn = Database.get_connection()
+    try:
+        cursor = conn.cursor()
+        _check_swappable(cursor, table)
+        cursor.execute(f"DROP TABLE IF EXISTS {rebuild_table}")
+        cursor.execute(
+            f"CREATE TABLE {rebuild_table} "
+            f"(LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS INCLUDING STORAGE INCLUDING COMMENTS)"
+        )
+        for name, definition in _constraints(cursor, table):
+            cursor.execute(f"ALTER TABLE {rebuild_table} ADD CONSTRAINT {name}{REBUILD_SUFFIX} {definition}")
+        # 触发器名只需在表内唯一，影子表上使用同名触发器，切换后不需要改名
+        for _, definition in _triggers(cursor, table):
+            cursor.execute(_TRIGGER_TABLE.sub(lambda m: f"{m.group(1)}{rebuild_table}", definition, count=1))
+        cursor.execute("SELECT obj_description(%s::regclass, 'pg_class')", (table,))
+        comment = cursor.fetchone()[0]
+        if comment is not None:
+            cursor.execute(f"COMMENT ON TABLE {rebuild_table} IS %s", (comment,))
+        for grant in _grants(cursor, table):
+            cursor.execute(grant.format(table=rebuild_table))
+        conn.commit()
+        cursor.close()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        Database.return_connection(conn)
+    logger.info(f"已创建影子表 {rebuild_table}")
+    return rebuild_table
+
+
+def drop_rebuild_table(table: str = FEATURE_TABLE):
+    """删除影子表（放弃本次重建）"""
+    conn = Database.get_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(f"DROP TABLE IF EXISTS {rebuild_table_name(table)}")
+        conn.commit()
+        cursor.close()
+    finally:
+        Database.return_connection(conn)
+
+
+def swap_rebuild_table(
+    table: str = FEATURE_TABLE,
+    keep_missing: bool = True,
+    drop_old: bool = True,
+    since: Optional[datetime] = None
+) -> dict:
+    """用影子表替换正式表
+    
+    Args:
+        table: 正式表
+        keep_missing: 是否把影子表中没有的旧行补入影子表（重建中失败或未覆盖的图片保留旧向量）
+        drop_old: 切换后是否删除旧表，False时保留为 <表名>_old
+        since: 重建开始时间，正式表上 update_time 不早于该时间的行（重建期间的在线写入）比影子表中的行新时覆盖影子表，
+               None表示不补入
+    
+    Returns:
+        各阶段耗时和行数
+    """
+    rebuild_table = rebuild_table_name(table)
+    retired_table = f"{table}{RETIRED_SUFFIX}"
+    result = {'carried_over': 0, 'updated_during_rebuild': 0}
+    conn = Database.get_connection()
+    try:
+        cursor = conn.cursor()
+        constraints = _constraints(cursor, table)
+        indexes = _plain_indexes(cursor, table)
+        
+        # 1. 在影子表上创建其余索引（切换前完成，不锁正式表）
+        start = time.perf_counter()
+        for name, definition in indexes:
+            cursor.execute(_INDEX_HEAD.sub(
+                lambda m: f"CREATE {m.group(1) or ''}INDEX {name}{REBUILD_SUFFIX} ON {rebuild_table}",
+                definition,
+                count=1
+            ))
+        conn.commit()
+        result['index_seconds'] = round(time.perf_counter() - start, 3)
+        
+        # 2. 锁定正式表的写入（不阻塞查询），补入旧行后改名切换
+        start = time.perf_counter()
+        cursor.execute(f"LOCK TABLE {table} IN EXCLUSIVE MODE")
+        column_names = _columns(cursor, table)
+        columns = ", ".join(column_names)
+        if since is not None:
+            # 重建期间正式表上的写入（锁定前已提交），保留两边更新时间较晚的一行
+            updates = ", ".join(
+                f"{column} = EXCLUDED.{column}" for column in column_names if column not in ('id', 'image_id', 'create_time')
+            )
+            cursor.execute(
+                f"""
+                INSERT INTO {rebuild_table} ({columns})
+                SELECT {columns} FROM {table} t
+                WHERE t.update_time >= %s
+                ON CONFLICT (image_id) DO UPDATE SET {updates}
+                WHERE {rebuild_table}.update_time < EXCLUDED.update_time
+                """,
+                (since,)
+            )
+            result['updated_during_rebuild'] = cursor.rowcount
+        if keep_missing:
+            cursor.execute(f"""
+                INSERT INTO {rebuild_table} ({columns})
+                SELECT {columns} FROM {table} t
+                WHERE NOT EXISTS (SELECT 1 FROM {rebuild_table} r WHERE r.image_id = t.image_id)
+            """)
+            result['carried_over'] = cursor.rowcount
+        
+        # id序列属于旧表的列，旧表删除前改为属于新表
+        cursor.execute(
+            """
+            SELECT attname, pg_get_serial_sequence(%s, attname)
+            FROM pg_attribute
+            WHERE attrelid = %s::regclass AND attnum > 0 AND NOT attisdropped
+            """,
+            (table, table)
+        )
+        sequences = [(column, sequence) for column, sequence in cursor.fetchall() if sequence]
+        
+        for name, _ in constraints:
+            cursor.execute(f"ALTER TABLE {table} RENAME CONSTRAINT {name} TO {name}{RETIRED_SUFFIX}")
+        for name, _ in indexes:
+            cursor.execute(f"ALTER INDEX {name} RENAME TO {name}{RETIRED_SUFFIX}")
+        cursor.execute(f"ALTER TABLE {table} RENAME TO {retired_table}")
+        cursor.execute(f"ALTER TABLE {rebuild_table} RENAME TO {table}")
+        for name, _ in constraints:
+            cursor.execute(f"ALTER TABLE {table} RENAME CONSTRAINT {name}{REBUILD_SUFFIX} TO {name}")
+        for name, _ in indexes:
+            cursor.execute(f"ALTER INDEX {name}{REBUILD_SUFFIX} RENAME TO {name}")
+        for column, sequence in sequences:
+            cursor.execute(f"ALTER SEQUENCE {sequence} OWNED BY {table}.{column}")
+        conn.commit()
+        result['swap_seconds'] = round(time.perf_counter() - start, 3)
+        
+        cursor.execute(f"SELECT count(*) FROM {table}")
+        result['rows'] = cursor.fetchone()[0]
+        conn.commit()
+        
+        # 3. 删除旧表
+        if drop_old:
+            try:
+                cursor.execute(f"DROP TABLE {retired_table}")
+                conn.commit()
+            except Exception as e:
+                conn.rollback()
+                logger.warning(f"删除旧表 {retired_table} 失败（可能有视图依赖），请手动处理: {e}")
+        cursor.close()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        Database.return_connection(conn)
+    
+    logger.info(
+        f"影子表切换完成: {result['rows']} 行（补入旧行 {result['carried_over']}，重建期间的写入 {result['updated_during_rebuild']}），"
+        f"建索引 {result['index_seconds']}s，切换 {result['swap_seconds']}s"
+    )
+    return result
+
+
+class FeatureRebuild:
+    """一次全量重建：从创建影子表到切换完成全程持有advisory lock
+    
+        with FeatureRebuild() as rebuild:
+            IngestionPipeline(extractor, force_reprocess=True, table=rebuild.rebuild_table).run(images)
+            rebuild.swap()
+    
+    锁属于占用的数据库会话，多个工作进程或脚本同时发起重建时只有一个能拿到，其余抛出
+    RebuildInProgressError；进程异常退出时连接断开，锁自动释放。未调用 swap 就退出时删除影子表。
+    """
+    
+    def __init__(self, table: str = FEATURE_TABLE):
+        self.table = table
+        self.rebuild_table = rebuild_table_name(table)
+        # 重建开始时间（数据库时间），切换时据此补入重建期间正式表上的写入
+        self.started_at: Optional[datetime] = None
+        self._conn = None
+        self._swapped = False
+    
+    def __enter__(self) -> "FeatureRebuild":
+        conn = Database.get_connection()
+        try:
+            conn.autocommit = True
+            cursor = conn.cursor()
+            cursor.execute("SELECT pg_try_advisory_lock(hashtext(%s))", (f"feature_rebuild:{self.table}",))
+            locked = cursor.fetchone()[0]
+            if locked:
+                self.started_at = _write_horizon(cursor)
+            cursor.close()
+        except Exception:
+            conn.autocommit = False
+            Database.return_connection(conn)
+            raise
+        if not locked:
+            conn.autocommit = False
+            Database.return_connection(conn)
+            raise RebuildInProgressError(f"表 {self.table} 已有全量重建在运行")
+        self._conn = conn
+        
+        try:
+            create_rebuild_table(self.table)
+        except Exception:
+            self._release()
+            raise
+        return self
+    
+    def swap(self, keep_missing: bool = True, drop_old: bool = True) -> dict:
+        """用影子表替换正式表，参数同 swap_rebuild_table"""
+        result = swap_rebuild_table(self.table, keep_missing=keep_missing, drop_old=drop_old, since=self.started_at)
+        self._swapped = True
+        return result
+    
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        try:
+            if not self._swapped:
+                drop_rebuild_table(self.table)
+        except Exception as e:
+            logger.warning(f"删除影子表 {self.rebuild_table} 失败: {e}")
+        finally:
+            self._release()
+        return False
+    
+    def _release(self):
+        """释放advisory lock并归还连接"""
+        conn, self._conn = self._conn, None
+        if conn is None:
+            return
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT pg_advisory_unlock(hashtext(%s))", (f"feature_rebuild:{self.table}",))
+            cursor.close()
+        except Exception as e:
+            logger.warning(f"释放全量重建锁失败: {e}")
+        finally:
+            conn.autocommit = False
+            Database.return_connection(conn)
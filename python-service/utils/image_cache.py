@@ -0,0 +1,233 @@
+"""
+本地图片原始字节缓存
+图片内容按SHA-256存放在磁盘上（相同内容只存一份），SQLite索引记录 URL -> 内容摘要、
+ETag/Last-Modified 和最近访问时间；总大小超过上限时按最近最少使用淘汰。
+重新处理（force_reprocess、切换模型）时图片从本地磁盘读取，不再经过CDN。
+"""
+import os
+import time
+import sqlite3
+import hashlib
+import logging
+from threading import Lock
+from typing import NamedTuple, Optional
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class CacheEntry(NamedTuple):
+    """缓存索引中的一条记录"""
+    url: str
+    digest: str
+    size: int
+    etag: Optional[str]
+    last_modified: Optional[str]
+    validated_at: float  # 最近一次从源站下载或确认未修改（304）的时间
+
+
+class ImageCache:
+    """内容寻址的磁盘图片缓存，线程安全"""
+    
+    def __init__(
+        self,
+        cache_dir: Optional[str] = None,
+        max_bytes: Optional[int] = None,
+        fresh_seconds: Optional[float] = None
+    ):
+        self.cache_dir = cache_dir or settings.image_cache_dir
+        self.max_bytes = max_bytes or settings.image_cache_max_bytes
+        self.fresh_seconds = settings.image_cache_fresh_seconds if fresh_seconds is None else fresh_seconds
+        self.blob_dir = os.path.join(self.cache_dir, "blobs")
+        os.makedirs(self.blob_dir, exist_ok=True)
+        
+        self._lock = Lock()
+        self._conn = sqlite3.connect(os.path.join(self.cache_dir, "index.sqlite"), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS entries (
+                url TEXT PRIMARY KEY,
+                digest TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                validated_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_entries_last_access ON entries(last_access)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_entries_digest ON entries(digest)")
+        self._conn.commit()
+        
+        # 多个URL可能指向同一内容，按内容摘要去重统计占用空间
+        row = self._conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM (SELECT MAX(size) AS size FROM entries GROUP BY digest)"
+        ).fetchone()
+        self._total_bytes = row[0]
+        
+        # 统计信息
+        self._hits = 0
+        self._misses = 0
+        self._revalidated = 0
+        self._stores = 0
+        self._evictions = 0
+    
+    def _blob_path(self, digest: str) -> str:
+        return os.path.join(self.blob_dir, digest[:2], digest)
+    
+    def lookup(self, url: str) -> Optional[CacheEntry]:
+        """查询URL的缓存记录，不存在返回None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT url, digest, size, etag, last_modified, validated_at FROM entries WHERE url = ?",
+                (url,)
+            ).fetchone()
+            if row is None:
+                self._misses += 1
+                return None
+        return CacheEntry(*row)
+    
+    def is_fresh(self, entry: CacheEntry) -> bool:
+        """记录在 fresh_seconds 内验证过，可以不经源站确认直接使用"""
+        return time.time() - entry.validated_at < self.fresh_seconds
+    
+    def read(self, entry: CacheEntry, revalidated: bool = False) -> Optional[bytes]:
+        """读取缓存内容并更新访问时间；文件丢失时删除记录并返回None
+        
+        Args:
+            entry: lookup 返回的记录
+            revalidated: 源站返回304确认未修改，同时刷新验证时间
+        """
+        try:
+            with open(self._blob_path(entry.digest), 'rb') as f:
+                content = f.read()
+        except OSError:
+            self._remove(entry.url)
+            return None
+        
+        now = time.time()
+        with self._lock:
+            if revalidated:
+                self._revalidated += 1
+                self._conn.execute(
+                    "UPDATE entries SET last_access = ?, validated_at = ? WHERE url = ?",
+                    (now, now, entry.url)
+                )
+            else:
+                self._conn.execute("UPDATE entries SET last_access = ? WHERE url = ?", (now, entry.url))
+            self._conn.commit()
+            self._hits += 1
+        return content
+    
+    def put(self, url: str, content: bytes, etag: Optional[str] = None, last_modified: Optional[str] = None):
+        """写入（或替换）URL的缓存内容，必要时淘汰最久未访问的记录"""
+        digest = hashlib.sha256(content).hexdigest()
+        path = self._blob_path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # 先写临时文件再替换，并发写入同一内容也不会读到半个文件
+            tmp_path = f"{path}.{os.getpid()}.{id(content)}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(content)
+            os.replace(tmp_path, path)
+        
+        now = time.time()
+        with self._lock:
+            previous = self._conn.execute("SELECT digest FROM entries WHERE url = ?", (url,)).fetchone()
+            if not self._digest_referenced(digest):
+                self._total_bytes += len(content)
+            self._conn.execute(
+                """
+                INSERT INTO entries (url, digest, size, etag, last_modified, validated_at, last_access)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (url) DO UPDATE
+                SET digest = excluded.digest,
+                    size = excluded.size,
+                    etag = excluded.etag,
+                    last_modified = excluded.last_modified,
+                    validated_at = excluded.validated_at,
+                    last_access = excluded.last_access
+                """,
+                (url, digest, len(content), etag, last_modified, now, now)
+            )
+            if previous is not None and previous[0] != digest:
+                self._release_blob(previous[0])
+            self._stores += 1
+            self._evict()
+            self._conn.commit()
+    
+    def _remove(self, url: str):
+        with self._lock:
+            row = self._conn.execute("SELECT digest FROM entries WHERE url = ?", (url,)).fetchone()
+            if row is not None:
+                self._conn.execute("DELETE FROM entries WHERE url = ?", (url,))
+                self._release_blob(row[0])
+                self._conn.commit()
+    
+    def _digest_referenced(self, digest: str) -> bool:
+        return self._conn.execute("SELECT 1 FROM entries WHERE digest = ? LIMIT 1", (digest,)).fetchone() is not None
+    
+    def _release_blob(self, digest: str):
+        """内容不再被任何URL引用时删除文件（调用方持有锁）"""
+        if self._digest_referenced(digest):
+            return
+        path = self._blob_path(digest)
+        try:
+            self._total_bytes -= os.path.getsize(path)
+            os.remove(path)
+        except OSError:
+            pass
+    
+    def _evict(self):
+        """按最近访问时间淘汰，直到总大小不超过上限（调用方持有锁）"""
+        while self._total_bytes > self.max_bytes:
+            rows = self._conn.execute(
+                "SELECT url, digest FROM entries ORDER BY last_access LIMIT 100"
+            ).fetchall()
+            if not rows:
+                break
+            for url, digest in rows:
+                self._conn.execute("DELETE FROM entries WHERE url = ?", (url,))
+                self._release_blob(digest)
+                self._evictions += 1
+                if self._total_bytes <= self.max_bytes:
+                    break
+    
+    def stats(self) -> dict:
+        """获取缓存统计：命中、未命中、304确认、写入、淘汰次数和占用空间"""
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                'hits': self._hits,
+                'misses': self._misses,
+                'revalidated': self._revalidated,
+                'stores': self._stores,
+                'evictions': self._evictions,
+                'hit_ratio': round(self._hits / lookups, 3) if lookups else 0.0,
+                'bytes': self._total_bytes,
+                'max_bytes': self.max_bytes
+            }
+    
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+# 全局缓存实例
+_image_cache: Optional[ImageCache] = None
+_image_cache_lock = Lock()
+
+
+def get_image_cache() -> Optional[ImageCache]:
+    """获取磁盘图片缓存单例，未启用时返回None"""
+    global _image_cache
+    if not settings.image_cache_enabled:
+        return None
+    if _image_cache is None:
+        with _image_cache_lock:
+            if _image_cache is None:
+                _image_cache = ImageCache()
+                logger.info(f"磁盘图片缓存已启用: {_image_cache.cache_dir}（上限 {_image_cache.max_bytes / 1024 ** 3:.1f} GB）")
+    return _image_cache
@@ -0,0 +1,47 @@
+"""
+图片解码与缩放
+把图片字节解码为模型输入尺寸的 uint8 RGB 数组，不依赖TensorFlow。
+启用 jpeg_draft_decode 时，JPEG在DCT域直接按 1/2、1/4、1/8 缩小解码到不小于目标尺寸，
+再缩放到最终尺寸；多百万像素的商品图解码耗时和内存占用成倍下降。
+"""
+from io import BytesIO
+from pathlib import Path
+from typing import Optional, Union
+
+import numpy as np
+from PIL import Image
+
+from config import settings
+
+
+def open_image(source: Union[bytes, str, Path], size: Optional[int] = None, draft: Optional[bool] = None) -> Image.Image:
+    """打开图片（字节或本地路径），只读取文件头，像素在首次使用时解码
+    
+    Args:
+        source: 图片字节或本地路径
+        size: 目标尺寸，None表示使用 model_input_size
+        draft: 是否对JPEG启用缩小解码，None表示使用配置值
+    """
+    image = Image.open(BytesIO(source) if isinstance(source, bytes) else source)
+    if settings.jpeg_draft_decode if draft is None else draft:
+        size = size or settings.model_input_size
+        # draft 只对JPEG生效（其他格式返回None），选择的缩小比例保证宽高都不小于目标尺寸
+        image.draft('RGB', (size, size))
+    return image
+
+
+def resize_to_array(image: Image.Image, size: Optional[int] = None) -> np.ndarray:
+    """转换为RGB并缩放到目标尺寸，返回uint8数组 (H, W, 3)"""
+    size = size or settings.model_input_size
+    # 转换为RGB（处理RGBA等格式）
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    
+    # 调整大小到模型输入尺寸
+    image = image.resize((size, size))
+    return np.asarray(image, dtype=np.uint8)
+
+
+def decode_image(image_bytes: bytes, size: Optional[int] = None, draft: Optional[bool] = None) -> np.ndarray:
+    """解码图片字节并缩放到目标尺寸，返回uint8数组 (H, W, 3)"""
+    return resize_to_array(open_image(image_bytes, size, draft), size)
@@ -0,0 +1,469 @@
+"""
+分阶段图片入库流水线
+下载 -> 解码/预处理 -> 推理 -> 写库，各阶段由独立线程执行，阶段之间使用有界队列连接
+队列满时上游阶段阻塞（背压），从而让网络、CPU/GPU和数据库同时保持忙碌
+"""
+import time
+import queue
+import logging
+import threading
+from threading import Lock
+from itertools import islice
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from config import settings
+from models.inference_batcher import InferenceBatcher, get_inference_batcher
+from utils.db import (
+    FEATURE_TABLE,
+    save_feature_vectors_batch,
+    check_features_exist_batch
+)
+from utils.decode_pool import decode_thread_count
+from utils.tensor_cache import TensorCache, get_tensor_cache
+
+logger = logging.getLogger(__name__)
+
+# 队列结束标记，上游阶段全部退出后向下游每个线程发送一个
+_SENTINEL = object()
+
+# 阶段顺序，每个阶段从同名队列读取数据
+STAGES = ('discover', 'download', 'decode', 'inference', 'db')
+
+# 进程内同时运行的流水线数量上限；每次运行有自己的阶段线程，发现和写库阶段各占用数据库连接，
+# 不加限制时多个接口请求和回填任务同时运行会耗尽连接池（PoolError）
+_run_slots = threading.BoundedSemaphore(max(1, settings.pipeline_max_concurrent_runs))
+
+
+def _chunked(iterable: Iterable, size: int) -> Iterator[list]:
+    """将可迭代对象按固定大小分块"""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class StageStats:
+    """单个阶段的统计信息（线程安全）"""
+    
+    def __init__(self, name: str, workers: int):
+        self.name = name
+        self.workers = workers
+        self.processed = 0
+        self.failed = 0
+        self.busy_seconds = 0.0
+        self._lock = Lock()
+    
+    def record(self, processed: int = 0, failed: int = 0, busy_seconds: float = 0.0):
+        """记录一次处理结果"""
+        with self._lock:
+            self.processed += processed
+            self.failed += failed
+            self.busy_seconds += busy_seconds
+    
+    def snapshot(self, elapsed: float) -> dict:
+        """获取统计快照
+        
+        utilization 为阶段线程忙碌时间占比，接近1说明该阶段是瓶颈
+        """
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'processed': self.processed,
+                'failed': self.failed,
+                'throughput': round(self.processed / elapsed, 2) if elapsed > 0 else 0.0,
+                'busy_seconds': round(self.busy_seconds, 2),
+                'utilization': round(self.busy_seconds / (elapsed * self.workers), 3) if elapsed > 0 else 0.0
+            }
+
+
+class IngestionPipeline:
+    """图片入库流水线
+    
+    discover: 批量检查是否已处理，过滤无效URL；张量缓存命中的图片直接送入decode
+    download: 并行下载图片字节（经共享异步下载器，按主机复用连接）
+    decode:   解码缩放为uint8数组（写入张量缓存）并转换为模型输入
+    inference: 凑满 batch_size（或等待超时）后提交给共享推理批处理器
+    db:       凑满 pipeline_db_batch_size（或等待超时）后批量写库（按行数选择多行VALUES或COPY），
+              写入 table（全量重建时为影子表）
+    """
+    
+    def __init__(
+        self,
+        extractor,
+        force_reprocess: bool = False,
+        check_chunk_size: Optional[int] = None,
+        download_workers: Optional[int] = None,
+        decode_workers: Optional[int] = None,
+        db_workers: Optional[int] = None,
+        queue_size: Optional[int] = None,
+        model_version: Optional[str] = None,
+        batcher: Optional[InferenceBatcher] = None,
+        tensor_cache: Optional[TensorCache] = None,
+        table: str = FEATURE_TABLE
+    ):
+        self.extractor = extractor
+        self.batcher = batcher or get_inference_batcher()
+        self.tensor_cache = tensor_cache if tensor_cache is not None else get_tensor_cache()
+        self.force_reprocess = force_reprocess
+        self.table = table
+        self.check_chunk_size = check_chunk_size or settings.db_batch_size
+        self.model_version = model_version or extractor.model_version
+        self.batch_wait = settings.pipeline_batch_wait_ms / 1000.0
+        
+        self._workers = {
+            'discover': 1,
+            'download': download_workers or settings.pipeline_download_workers,
+            'decode': decode_workers or decode_thread_count(settings.pipeline_decode_workers),
+            'inference': 1,
+            'db': db_workers or settings.pipeline_db_workers
+        }
+        
+        queue_size = queue_size or settings.pipeline_queue_size
+        self._queues = {name: queue.Queue(maxsize=queue_size) for name in STAGES[1:]}
+        self._max_depth = {name: 0 for name in self._queues}
+        self._stats = {name: StageStats(name, self._workers[name]) for name in STAGES}
+        
+        self._alive = dict(self._workers)
+        self._alive_lock = Lock()
+        
+        # 汇总结果
+        self._result_lock = Lock()
+        self.total = 0
+        self.success = 0
+        self.skipped = 0
+        self.tensor_cache_hits = 0
+        self.failed_ids: List[str] = []
+        
+        self._start_time: Optional[float] = None
+        # 读取待处理图片时的异常，run() 结束后重新抛出
+        self._source_error: Optional[BaseException] = None
+    
+    # ------------------------------------------------------------------
+    # 队列与结果辅助方法
+    # ------------------------------------------------------------------
+    
+    def _put(self, stage: str, item) -> None:
+        """放入下游队列（队列满时阻塞），并记录队列深度峰值"""
+        q = self._queues[stage]
+        q.put(item)
+        depth = q.qsize()
+        if depth > self._max_depth[stage]:
+            self._max_depth[stage] = depth
+    
+    def _mark_failed(self, image_ids: List[str]) -> None:
+        with self._result_lock:
+            self.failed_ids.extend(image_ids)
+    
+    def _worker_exit(self, stage: str) -> None:
+        """阶段线程退出；该阶段最后一个线程负责通知下游结束"""
+        with self._alive_lock:
+            self._alive[stage] -= 1
+            last = self._alive[stage] == 0
+        
+        next_index = STAGES.index(stage) + 1
+        if last and next_index < len(STAGES):
+            next_stage = STAGES[next_index]
+            for _ in range(self._workers[next_stage]):
+                self._put(next_stage, _SENTINEL)
+    
+    def _collect_batch(self, stage: str, max_size: int) -> Tuple[list, bool]:
+        """从队列中凑批：阻塞等待第一条数据，之后最多等待 batch_wait 秒
+        
+        Returns:
+            (items, finished) - finished为True表示上游已结束
+        """
+        q = self._queues[stage]
+        first = q.get()
+        if first is _SENTINEL:
+            return [], True
+        
+        items = [first]
+        deadline = time.monotonic() + self.batch_wait
+        while len(items) < max_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = q.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is _SENTINEL:
+                return items, True
+            items.append(item)
+        return items, False
+    
+    # ------------------------------------------------------------------
+    # 各阶段实现
+    # ------------------------------------------------------------------
+    
+    def _discover_worker(self, images: Iterable[Tuple[str, str]]) -> None:
+        """按块检查是否已处理，把需要处理的图片送入下载队列"""
+        stats = self._stats['discover']
+        try:
+            for chunk in _chunked(images, self.check_chunk_size):
+                start = time.perf_counter()
+                with self._result_lock:
+                    self.total += len(chunk)
+                
+                # 强制重新处理时不检查也不删除旧数据，写库阶段的upsert直接覆盖
+                try:
+                    if not self.force_reprocess:
+                        chunk_ids = [img[0] for img in chunk]
+                        existing_ids = check_features_exist_batch(chunk_ids, self.model_version)
+                        # 过滤掉已存在的图片
+                        chunk = [(img_id, url) for img_id, url in chunk if img_id not in existing_ids]
+                        with self._result_lock:
+                            self.skipped += len(existing_ids)
+                except Exception as e:
+                    logger.error(f"[流水线] 检查已处理图片失败: {e}")
+                    stats.record(failed=len(chunk), busy_seconds=time.perf_counter() - start)
+                    self._mark_failed([img[0] for img in chunk])
+                    continue
+                
+                valid = []
+                for image_id, image_url in chunk:
+                    if not image_url:
+                        logger.warning(f"[流水线] 图片ID {image_id} 没有URL，跳过")
+                        self._mark_failed([image_id])
+                        stats.record(failed=1)
+                        continue
+                    valid.append((image_id, image_url))
+                
+                # 张量缓存命中的图片跳过下载和解码
+                cached = {}
+                if self.tensor_cache is not None and valid:
+                    try:
+                        cached = self.tensor_cache.get_many([image_id for image_id, _ in valid])
+                    except Exception as e:
+                        logger.warning(f"[流水线] 读取张量缓存失败: {e}")
+                    with self._result_lock:
+                        self.tensor_cache_hits += len(cached)
+                
+                stats.record(processed=len(valid), busy_seconds=time.perf_counter() - start)
+                for image_id, image_url in valid:
+                    if image_id in cached:
+                        self._put('decode', (image_id, cached[image_id]))
+                    else:
+                        self._put('download', (image_id, image_url))
+        except Exception as e:
+            logger.error(f"[流水线] 读取待处理图片失败: {e}")
+            self._source_error = e
+        finally:
+            self._worker_exit('discover')
+    
+    def _download_worker(self) -> None:
+        """下载图片字节"""
+        stats = self._stats['download']
+        q = self._queues['download']
+        try:
+            while True:
+                item = q.get()
+                if item is _SENTINEL:
+                    break
+                image_id, image_url = item
+                start = time.perf_counter()
+                image_bytes = self.extractor.download_image_bytes(image_url)
+                busy = time.perf_counter() - start
+                if image_bytes is None:
+                    stats.record(failed=1, busy_seconds=busy)
+                    self._mark_failed([image_id])
+                    continue
+                stats.record(processed=1, busy_seconds=busy)
+                self._put('decode', (image_id, image_bytes))
+        finally:
+            self._worker_exit('download')
+    
+    def _decode_worker(self) -> None:
+        """解码并预处理图片；来自张量缓存的uint8数组只做像素缩放"""
+        stats = self._stats['decode']
+        q = self._queues['decode']
+        try:
+            while True:
+                item = q.get()
+                if item is _SENTINEL:
+                    break
+                image_id, payload = item
+                start = time.perf_counter()
+                try:
+                    if isinstance(payload, np.ndarray):
+                        pixels = payload
+                    else:
+                        pixels = self.extractor.decode_image_bytes(payload)
+                        if self.tensor_cache is not None:
+                            self._cache_pixels(image_id, pixels)
+                    img_array = self.extractor.scale_pixels(pixels)
+                except Exception as e:
+                    logger.warning(f"[流水线] 图片 {image_id} 解码失败: {e}")
+                    stats.record(failed=1, busy_seconds=time.perf_counter() - start)
+                    self._mark_failed([image_id])
+                    continue
+                stats.record(processed=1, busy_seconds=time.perf_counter() - start)
+                self._put('inference', (image_id, img_array))
+        finally:
+            self._worker_exit('decode')
+    
+    def _cache_pixels(self, image_id: str, pixels: np.ndarray) -> None:
+        """写入张量缓存，失败只记录警告，不影响本次处理"""
+        try:
+            self.tensor_cache.put(image_id, pixels)
+        except Exception as e:
+            logger.warning(f"[流水线] 图片 {image_id} 写入张量缓存失败: {e}")
+    
+    def _inference_worker(self) -> None:
+        """凑批推理"""
+        stats = self._stats['inference']
+        try:
+            finished = False
+            while not finished:
+                items, finished = self._collect_batch('inference', settings.batch_size)
+                if not items:
+                    continue
+                image_ids = [item[0] for item in items]
+                start = time.perf_counter()
+                try:
+                    futures = self.batcher.submit_many([item[1] for item in items])
+                    feature_vectors = [future.result() for future in futures]
+                except Exception as e:
+                    logger.error(f"[流水线] 批量推理失败（{len(items)} 张）: {e}")
+                    stats.record(failed=len(items), busy_seconds=time.perf_counter() - start)
+                    self._mark_failed(image_ids)
+                    continue
+                stats.record(processed=len(items), busy_seconds=time.perf_counter() - start)
+                for image_id, feature_vector in zip(image_ids, feature_vectors):
+                    self._put('db', (image_id, feature_vector))
+        finally:
+            self._worker_exit('inference')
+    
+    def _db_worker(self) -> None:
+        """凑批写库"""
+        stats = self._stats['db']
+        try:
+            finished = False
+            while not finished:
+                items, finished = self._collect_batch('db', settings.pipeline_db_batch_size)
+                if not items:
+                    continue
+                batch_data = [
+                    (image_id, feature_vector, len(feature_vector), self.model_version)
+                    for image_id, feature_vector in items
+                ]
+                start = time.perf_counter()
+                try:
+                    saved = save_feature_vectors_batch(batch_data, table=self.table)
+                except Exception as e:
+                    logger.error(f"[流水线] 批量保存失败（{len(items)} 条）: {e}")
+                    stats.record(failed=len(items), busy_seconds=time.perf_counter() - start)
+                    self._mark_failed([item[0] for item in items])
+                    continue
+                stats.record(processed=saved, busy_seconds=time.perf_counter() - start)
+                with self._result_lock:
+                    self.success += saved
+        finally:
+            self._worker_exit('db')
+    
+    # ------------------------------------------------------------------
+    # 运行与统计
+    # ------------------------------------------------------------------
+    
+    def stage_report(self) -> dict:
+        """获取各阶段吞吐、队列深度和瓶颈阶段"""
+        elapsed = time.perf_counter() - self._start_time if self._start_time else 0.0
+        stages = {name: self._stats[name].snapshot(elapsed) for name in STAGES}
+        queues = {
+            name: {
+                'capacity': q.maxsize,
+                'depth': q.qsize(),
+                'max_depth': self._max_depth[name]
+            }
+            for name, q in self._queues.items()
+        }
+        bottleneck = max(stages, key=lambda name: stages[name]['utilization']) if elapsed > 0 else None
+        return {
+            'elapsed_seconds': round(elapsed, 2),
+            'stages': stages,
+            'queues': queues,
+            'bottleneck': bottleneck
+        }
+    
+    def _log_report(self) -> None:
+        report = self.stage_report()
+        stage_info = ", ".join(
+            f"{name} {info['throughput']}/s ({info['utilization']:.0%})"
+            for name, info in report['stages'].items()
+        )
+        queue_info = ", ".join(
+            f"{name} {info['depth']}/{info['capacity']}"
+            for name, info in report['queues'].items()
+        )
+        logger.info(f"[流水线] 阶段吞吐: {stage_info} | 队列深度: {queue_info} | 瓶颈: {report['bottleneck']}")
+    
+    def run(self, images: Iterable[Tuple[str, str]]) -> dict:
+        """运行流水线直到所有图片处理完成
+        
+        Args:
+            images: 可迭代的 (image_id, image_url)，可以是生成器
+        
+        Returns:
+            处理结果统计，包含 total/success/failed/skipped/tensor_cache_hits/failed_ids/stage_stats
+        
+        Raises:
+            读取 images 时抛出的异常（已发现的图片处理完成后重新抛出）
+        """
+        # 超过 pipeline_max_concurrent_runs 时排队等待其他流水线结束
+        if not _run_slots.acquire(blocking=False):
+            logger.info(f"[流水线] 已有 {settings.pipeline_max_concurrent_runs} 个流水线在运行，排队等待")
+            _run_slots.acquire()
+        try:
+            return self._run(images)
+        finally:
+            _run_slots.release()
+    
+    def _run(self, images: Iterable[Tuple[str, str]]) -> dict:
+        self._start_time = time.perf_counter()
+        
+        threads = [threading.Thread(target=self._discover_worker, args=(images,), name="pipeline-discover", daemon=True)]
+        for stage, target in (
+            ('download', self._download_worker),
+            ('decode', self._decode_worker),
+            ('inference', self._inference_worker),
+            ('db', self._db_worker)
+        ):
+            for i in range(self._workers[stage]):
+                threads.append(threading.Thread(target=target, name=f"pipeline-{stage}-{i}", daemon=True))
+        
+        for thread in threads:
+            thread.start()
+        
+        next_report = time.monotonic() + settings.pipeline_report_interval
+        for thread in threads:
+            while thread.is_alive():
+                thread.join(timeout=0.5)
+                for name, q in self._queues.items():
+                    depth = q.qsize()
+                    if depth > self._max_depth[name]:
+                        self._max_depth[name] = depth
+                if time.monotonic() >= next_report:
+                    self._log_report()
+                    next_report = time.monotonic() + settings.pipeline_report_interval
+        
+        self._log_report()
+        if self.tensor_cache is not None:
+            self.tensor_cache.flush()
+        
+        # 图片来源中途失败时结果不完整，不能当作正常结束（全量重建据此决定是否切换影子表）
+        if self._source_error is not None:
+            raise self._source_error
+        
+        return {
+            'total': self.total,
+            'success': self.success,
+            'failed': len(self.failed_ids),
+            'skipped': self.skipped,
+            'tensor_cache_hits': self.tensor_cache_hits,
+            'failed_ids': self.failed_ids,
+            'stage_stats': self.stage_report()
+        }
@@ -0,0 +1,247 @@
+"""
+已处理图片ID的内存索引
+启动时从 tb_hsx_img_value 流式读取当前模型版本（由 PREPROCESS_MODE 决定）生成的所有 image_id，
+保存为有序的 int64 数组（每个ID 8字节，1亿条约800MB），存在性检查用二分查找完成，不再访问数据库。
+其他模型版本的向量不计入索引，更换预处理模式后旧版本的图片会被重新提取。
+
+- 写入：db 模块的特征向量写入函数提交事务后通知本索引，当前模型版本的新ID先进入待合并集合，
+  积累到一定数量后合并进有序数组（以其他版本写入的ID忽略）
+- 对账：后台线程定期重新读取全部ID，替换内存数组，修正其他进程写入或删除造成的偏差
+- 重载：全量重建切换正式表后调用 reload()，立即在后台重新读取新表
+- 加载完成前（ready 为 False）存在性检查仍然查询数据库
+"""
+import time
+import logging
+import threading
+from threading import Lock
+from typing import Iterable, List, Optional, Set
+
+import numpy as np
+
+from config import settings
+from models.image_feature_extractor import MODEL_VERSIONS
+from utils import db
+
+logger = logging.getLogger(__name__)
+
+# 待合并集合超过该数量时合并进有序数组
+_MERGE_THRESHOLD = 65536
+
+
+class ProcessedImageIndex:
+    """已处理图片ID索引，线程安全"""
+    
+    def __init__(self, reconcile_seconds: Optional[float] = None, model_version: Optional[str] = None):
+        self.reconcile_seconds = settings.processed_index_reconcile_seconds if reconcile_seconds is None else reconcile_seconds
+        # 索引只记录该模型版本生成的向量，db 的存在性检查只在查询版本一致时使用索引
+        self.model_version = model_version or MODEL_VERSIONS[settings.preprocess_mode]
+        self.ready = False
+        
+        self._ids = np.empty(0, dtype=np.int64)
+        self._pending: Set[int] = set()
+        self._lock = Lock()
+        # 加载期间写入的ID，加载完成后补回新数组
+        self._added_during_load: Optional[Set[int]] = None
+        # reload() 时递增，开始于重载之前的加载结果作废
+        self._generation = 0
+        
+        self._stop = threading.Event()
+        # 唤醒后台线程（关闭或请求重载时设置）
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        
+        # 统计信息
+        self._lookups = 0
+        self._loads = 0
+        self._last_load_seconds = 0.0
+        self._last_loaded_at: Optional[float] = None
+        self._drift_added = 0
+        self._drift_removed = 0
+    
+    def contains(self, image_id) -> bool:
+        """检查单个图片ID是否已处理"""
+        try:
+            value = int(image_id)
+        except (TypeError, ValueError):
+            return False
+        with self._lock:
+            self._lookups += 1
+            if value in self._pending:
+                return True
+            ids = self._ids
+        position = np.searchsorted(ids, value)
+        return bool(position < len(ids) and ids[position] == value)
+    
+    def filter_existing(self, image_ids: Iterable) -> Set[str]:
+        """返回 image_ids 中已处理的图片ID集合（字符串形式，与 db.check_features_exist_batch 一致）"""
+        values = []
+        for image_id in image_ids:
+            try:
+                values.append(int(image_id))
+            except (TypeError, ValueError):
+                continue
+        if not values:
+            return set()
+        
+        with self._lock:
+            self._lookups += len(values)
+            pending = self._pending.copy() if self._pending else None
+            ids = self._ids
+        
+        query = np.asarray(values, dtype=np.int64)
+        positions = np.searchsorted(ids, query)
+        found = np.zeros(len(query), dtype=bool)
+        in_range = positions < len(ids)
+        found[in_range] = ids[positions[in_range]] == query[in_range]
+        
+        existing = {str(value) for value in query[found].tolist()}
+        if pending:
+            existing.update(str(value) for value in values if value in pending)
+        return existing
+    
+    def add_many(self, image_ids: List[int], model_version: str):
+        """记录新写入的图片ID（db 写入监听器），其他模型版本的写入忽略"""
+        if model_version != self.model_version:
+            return
+        with self._lock:
+            for image_id in image_ids:
+                self._pending.add(int(image_id))
+            if self._added_during_load is not None:
+                self._added_during_load.update(int(image_id) for image_id in image_ids)
+            if len(self._pending) >= _MERGE_THRESHOLD:
+                self._merge_pending()
+    
+    def _merge_pending(self):
+        """把待合并集合并入有序数组（调用方持有锁）"""
+        pending = np.fromiter(self._pending, dtype=np.int64, count=len(self._pending))
+        self._ids = np.union1d(self._ids, pending)
+        self._pending.clear()
+    
+    def load(self):
+        """从数据库重新读取全部已处理ID并替换内存数组（首次加载和定期对账共用）"""
+        start = time.perf_counter()
+        with self._lock:
+            generation = self._generation
+            self._added_during_load = set()
+        try:
+            chunks = list(db.iter_processed_image_ids(model_version=self.model_version))
+            ids = np.unique(np.concatenate(chunks)) if chunks else np.empty(0, dtype=np.int64)
+        except Exception:
+            with self._lock:
+                self._added_during_load = None
+            raise
+        
+        with self._lock:
+            # 读取期间写入的ID可能不在快照中，补回
+            added = self._added_during_load
+            self._added_during_load = None
+            if generation != self._generation:
+                logger.info("已处理ID索引加载期间正式表被替换，丢弃本次结果")
+                return
+            if added:
+                ids = np.union1d(ids, np.fromiter(added, dtype=np.int64, count=len(added)))
+            
+            if self.ready:
+                self._merge_pending()
+                self._drift_added += int(len(np.setdiff1d(ids, self._ids, assume_unique=True)))
+                self._drift_removed += int(len(np.setdiff1d(self._ids, ids, assume_unique=True)))
+            self._ids = ids
+            self._pending.clear()
+            self.ready = True
+            self._loads += 1
+            self._last_load_seconds = time.perf_counter() - start
+            self._last_loaded_at = time.time()
+        logger.info(f"已处理ID索引已加载（{self.model_version}）: {len(ids)} 个ID，耗时 {self._last_load_seconds:.2f}s")
+    
+    def start(self):
+        """在后台线程中加载索引，之后按 reconcile_seconds 定期对账"""
+        with self._lock:
+            if self._thread is not None or self._stop.is_set():
+                return
+            self._thread = threading.Thread(target=self._run, name="processed-index", daemon=True)
+        self._thread.start()
+    
+    def reload(self):
+        """正式表被整体替换后调用：立即停用内存数组并在后台重新加载，加载完成前存在性检查查询数据库"""
+        with self._lock:
+            self.ready = False
+            self._generation += 1
+            restart = self._thread is None
+        if restart:
+            self.start()
+        else:
+            self._wake.set()
+    
+    def _run(self):
+        """后台线程：加载失败时按对账间隔重试"""
+        while not self._stop.is_set():
+            self._wake.clear()
+            try:
+                self.load()
+            except Exception as e:
+                logger.warning(f"加载已处理ID索引失败: {e}")
+            with self._lock:
+                # 不定期对账时加载成功即退出，之后的 reload() 重新启动线程
+                if self.reconcile_seconds <= 0 and self.ready:
+                    self._thread = None
+                    return
+            self._wake.wait(self.reconcile_seconds if self.reconcile_seconds > 0 else 60)
+    
+    def stats(self) -> dict:
+        """获取索引统计"""
+        with self._lock:
+            return {
+                'ready': self.ready,
+                'model_version': self.model_version,
+                'ids': int(len(self._ids)) + len(self._pending),
+                'pending': len(self._pending),
+                'bytes': int(self._ids.nbytes),
+                'lookups': self._lookups,
+                'loads': self._loads,
+                'last_load_seconds': round(self._last_load_seconds, 3),
+                'last_loaded_at': self._last_loaded_at,
+                'reconcile_seconds': self.reconcile_seconds,
+                'drift_added': self._drift_added,
+                'drift_removed': self._drift_removed
+            }
+    
+    def close(self):
+        """停止后台对账线程"""
+        self._stop.set()
+        self._wake.set()
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout=5)
+            self._thread = None
+
+
+# 全局已处理ID索引实例
+_processed_index: Optional[ProcessedImageIndex] = None
+_processed_index_lock = Lock()
+
+
+def get_processed_index() -> Optional[ProcessedImageIndex]:
+    """获取已处理ID索引单例并在后台开始加载，未启用时返回None（存在性检查查询数据库）"""
+    global _processed_index
+    if not settings.processed_index_enabled:
+        return None
+    if _processed_index is None:
+        with _processed_index_lock:
+            if _processed_index is None:
+                index = ProcessedImageIndex()
+                db.register_write_listener(index.add_many)
+                db.set_processed_index(index)
+                index.start()
+                _processed_index = index
+    return _processed_index
+
+
+def close_processed_index():
+    """停止已处理ID索引（服务关闭时调用）"""
+    global _processed_index
+    with _processed_index_lock:
+        if _processed_index is not None:
+            db.set_processed_index(None)
+            db.unregister_write_listener(_processed_index.add_many)
+            _processed_index.close()
+            _processed_index = None
@@ -0,0 +1,259 @@
+"""
+预处理张量缓存
+把每张图片解码并缩放后的 uint8 RGB 数组（model_input_size × model_input_size × 3）
+按顺序写入内存映射的分片文件（.npy），SQLite索引记录 image_id -> (分片, 槽位)。
+更换模型或预处理版本重新提取特征时，直接从mmap读取数组送入模型，跳过下载和解码。
+"""
+import os
+import glob
+import sqlite3
+import logging
+from contextlib import contextmanager
+from threading import Lock
+from typing import Dict, Iterable, Optional, Tuple
+
+import numpy as np
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+# 索引提交间隔（写入条数），进程退出前调用 flush 提交剩余部分
+_COMMIT_INTERVAL = 256
+
+# SQLite 单条语句的参数数量上限较小，按块查询
+_QUERY_CHUNK_SIZE = 500
+
+# 等待其他进程释放SQLite写锁的最长时间（秒）
+_BUSY_TIMEOUT = 30.0
+
+
+class TensorCache:
+    """uint8 图片张量的分片 mmap 缓存，线程安全，多个进程可以共用同一个缓存目录
+    
+    槽位在SQLite的 BEGIN IMMEDIATE 事务中从共享计数器分配，不同进程（run.py --workers、
+    与服务同时运行的回填脚本）不会分到同一个槽位；索引条目在分片数据刷盘后才提交，
+    其他进程读到的条目总是指向已写入的数据。
+    """
+    
+    def __init__(
+        self,
+        cache_dir: Optional[str] = None,
+        shard_size: Optional[int] = None,
+        input_size: Optional[int] = None,
+        draft: Optional[bool] = None
+    ):
+        self.cache_dir = cache_dir or settings.tensor_cache_dir
+        self.shard_size = shard_size or settings.tensor_cache_shard_size
+        self.input_size = input_size or settings.model_input_size
+        self.draft = settings.jpeg_draft_decode if draft is None else draft
+        self.item_shape = (self.input_size, self.input_size, 3)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        
+        self._lock = Lock()
+        self._shards: Dict[int, np.memmap] = {}
+        # 自动提交模式，写事务显式使用 BEGIN IMMEDIATE，其他进程等待写锁的时间由 timeout 控制
+        self._conn = sqlite3.connect(
+            os.path.join(self.cache_dir, "index.sqlite"),
+            timeout=_BUSY_TIMEOUT,
+            isolation_level=None,
+            check_same_thread=False
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        with self._transaction():
+            self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS tensors (
+                    image_id INTEGER PRIMARY KEY,
+                    shard INTEGER NOT NULL,
+                    slot INTEGER NOT NULL
+                )
+            """)
+            # 下一个空闲槽位（全局序号 = 分片号 * shard_size + 槽位），旧版本创建的缓存按已有条目初始化
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS allocator (
+                    id INTEGER PRIMARY KEY CHECK (id = 0),
+                    next_position INTEGER NOT NULL
+                )
+            """)
+            self._conn.execute(
+                "INSERT OR IGNORE INTO allocator (id, next_position) "
+                "SELECT 0, COALESCE(MAX(shard * ? + slot) + 1, 0) FROM tensors",
+                (self.shard_size,)
+            )
+            self._check_meta()
+        
+        # 已写入分片、尚未提交到索引的条目 image_id -> (分片, 槽位)
+        self._pending: Dict[int, Tuple[int, int]] = {}
+        
+        # 统计信息
+        self._hits = 0
+        self._misses = 0
+        self._stores = 0
+    
+    @contextmanager
+    def _transaction(self):
+        """SQLite写事务：开始时即获取写锁，多个进程的写入依次进行"""
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+        self._conn.execute("COMMIT")
+    
+    def _check_meta(self):
+        """检查缓存的分片布局和解码配置（调用方已开启写事务）
+        
+        分片大小在创建时确定，之后打开时必须一致；输入尺寸和JPEG解码方式（jpeg_draft_decode）决定了
+        缓存数组的内容，与当前配置不一致时已有条目全部视为未命中，清空后按当前配置重新缓存
+        """
+        expected = {
+            'input_size': str(self.input_size),
+            'shard_size': str(self.shard_size),
+            'jpeg_draft_decode': str(self.draft).lower()
+        }
+        stored = dict(self._conn.execute("SELECT key, value FROM meta").fetchall())
+        if stored == expected:
+            return
+        if stored and stored.get('shard_size') != expected['shard_size']:
+            raise ValueError(f"张量缓存 {self.cache_dir} 的分片大小 {stored.get('shard_size')} 与当前配置 {self.shard_size} 不一致，请更换缓存目录")
+        
+        if stored:
+            logger.warning(f"张量缓存 {self.cache_dir} 的解码配置 {stored} 与当前配置 {expected} 不一致，清空已有条目")
+            self._conn.execute("DELETE FROM tensors")
+            self._conn.execute("UPDATE allocator SET next_position = 0")
+            # 输入尺寸变化后分片形状也不同，删除后按当前尺寸重新创建
+            for path in glob.glob(os.path.join(self.cache_dir, "shard_*.npy")):
+                os.remove(path)
+        self._conn.execute("DELETE FROM meta")
+        self._conn.executemany("INSERT INTO meta (key, value) VALUES (?, ?)", expected.items())
+    
+    def _shard(self, shard: int) -> np.memmap:
+        """打开（不存在时创建）分片文件（调用方持有锁）
+        
+        新分片先在临时文件中创建，再用硬链接放到最终路径：其他进程已经创建时链接失败，改为打开已有文件，
+        不会截断别的进程已写入的数据
+        """
+        memmap = self._shards.get(shard)
+        if memmap is None:
+            path = os.path.join(self.cache_dir, f"shard_{shard:05d}.npy")
+            if not os.path.exists(path):
+                temp_path = f"{path}.{os.getpid()}.tmp"
+                np.lib.format.open_memmap(
+                    temp_path, mode='w+', dtype=np.uint8, shape=(self.shard_size,) + self.item_shape
+                ).flush()
+                try:
+                    os.link(temp_path, path)
+                except FileExistsError:
+                    pass
+                finally:
+                    os.remove(temp_path)
+            memmap = np.load(path, mmap_mode='r+')
+            self._shards[shard] = memmap
+        return memmap
+    
+    def _allocate(self) -> Tuple[int, int]:
+        """从共享计数器分配一个新槽位 (分片, 槽位)"""
+        with self._transaction():
+            position = self._conn.execute("SELECT next_position FROM allocator WHERE id = 0").fetchone()[0]
+            self._conn.execute("UPDATE allocator SET next_position = ? WHERE id = 0", (position + 1,))
+        return divmod(position, self.shard_size)
+    
+    def put(self, image_id: str, pixels: np.ndarray):
+        """写入（或覆盖）一张图片的 uint8 数组"""
+        if pixels.shape != self.item_shape or pixels.dtype != np.uint8:
+            raise ValueError(f"张量形状应为 {self.item_shape} uint8，实际为 {pixels.shape} {pixels.dtype}")
+        image_id = int(image_id)
+        with self._lock:
+            location = self._pending.get(image_id)
+            if location is None:
+                location = self._conn.execute("SELECT shard, slot FROM tensors WHERE image_id = ?", (image_id,)).fetchone()
+            if location is None:
+                location = self._allocate()
+            shard, slot = location
+            self._shard(shard)[slot] = pixels
+            self._pending[image_id] = (shard, slot)
+            self._stores += 1
+            if len(self._pending) >= _COMMIT_INTERVAL:
+                self._commit()
+    
+    def get_many(self, image_ids: Iterable[str]) -> Dict[str, np.ndarray]:
+        """批量读取，返回 {image_id: uint8数组}，未缓存的图片不在结果中"""
+        image_ids = list(image_ids)
+        results = {}
+        with self._lock:
+            for i in range(0, len(image_ids), _QUERY_CHUNK_SIZE):
+                chunk = [int(image_id) for image_id in image_ids[i:i + _QUERY_CHUNK_SIZE]]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT image_id, shard, slot FROM tensors WHERE image_id IN ({placeholders})",
+                    chunk
+                ).fetchall()
+                locations = {image_id: (shard, slot) for image_id, shard, slot in rows}
+                # 本进程写入但尚未提交的条目
+                locations.update((image_id, self._pending[image_id]) for image_id in chunk if image_id in self._pending)
+                for image_id, (shard, slot) in locations.items():
+                    # 拷贝出mmap，调用方持有的数组不依赖分片文件保持打开
+                    results[str(image_id)] = np.array(self._shard(shard)[slot])
+            self._hits += len(results)
+            self._misses += len(image_ids) - len(results)
+        return results
+    
+    def _commit(self):
+        """先把分片数据刷到磁盘，再提交索引，索引中的条目总是指向已写入的数据（调用方持有锁）"""
+        if not self._pending:
+            return
+        for memmap in self._shards.values():
+            memmap.flush()
+        with self._transaction():
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO tensors (image_id, shard, slot) VALUES (?, ?, ?)",
+                [(image_id, shard, slot) for image_id, (shard, slot) in self._pending.items()]
+            )
+        self._pending.clear()
+    
+    def flush(self):
+        """提交尚未提交的写入"""
+        with self._lock:
+            self._commit()
+    
+    def stats(self) -> dict:
+        """获取缓存统计：条目数、分片数、命中/未命中/写入次数"""
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM tensors").fetchone()[0]
+            allocated = self._conn.execute("SELECT next_position FROM allocator WHERE id = 0").fetchone()[0]
+            lookups = self._hits + self._misses
+            return {
+                'entries': entries,
+                'shards': (allocated + self.shard_size - 1) // self.shard_size,
+                'hits': self._hits,
+                'misses': self._misses,
+                'stores': self._stores,
+                'hit_ratio': round(self._hits / lookups, 3) if lookups else 0.0
+            }
+    
+    def close(self):
+        with self._lock:
+            self._commit()
+            self._shards.clear()
+            self._conn.close()
+
+
+# 全局缓存实例
+_tensor_cache: Optional[TensorCache] = None
+_tensor_cache_lock = Lock()
+
+
+def get_tensor_cache() -> Optional[TensorCache]:
+    """获取张量缓存单例，未启用时返回None"""
+    global _tensor_cache
+    if not settings.tensor_cache_enabled:
+        return None
+    if _tensor_cache is None:
+        with _tensor_cache_lock:
+            if _tensor_cache is None:
+                _tensor_cache = TensorCache()
+                logger.info(f"张量缓存已启用: {_tensor_cache.cache_dir}（已缓存 {_tensor_cache.stats()['entries']} 张）")
+    return _tensor_cache
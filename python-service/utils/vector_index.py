@@ -0,0 +1,161 @@
+"""
+HNSW向量索引管理（大批量回填时先删除索引、写完后重建）
+带HNSW索引写入时，每插入一行都要在图中查找邻居并连边，大批量回填时这部分开销远大于写入本身；
+先删除索引、批量写入，再用较大的 maintenance_work_mem 和并行维护进程一次性构建，整体快得多。
+
+索引删除期间向量检索（Node服务的 <=> 查询）会退化为全表扫描，因此删除前检查：
+    - 索引在采样窗口内是否被扫描过（pg_stat_user_indexes.idx_scan 是否增长）
+    - 是否有其他会话正在执行向量距离查询（只看 active 会话，空闲连接的 query 是上一条语句，不代表仍有流量）
+"""
+import time
+import logging
+from typing import List, Optional
+
+from config import settings
+from utils.db import Database, FEATURE_TABLE
+
+logger = logging.getLogger(__name__)
+
+VECTOR_INDEX_NAME = "idx_tb_hsx_img_value_feature_vector"
+
+# 与 scripts/create_table.py 中的定义一致
+DEFAULT_VECTOR_INDEX_SQL = (
+    f"CREATE INDEX IF NOT EXISTS {VECTOR_INDEX_NAME} "
+    f"ON {FEATURE_TABLE} USING hnsw (feature_vector vector_cosine_ops)"
+)
+
+
+def get_vector_index_definition(table: str = FEATURE_TABLE) -> Optional[tuple]:
+    """查找表上的HNSW索引，返回 (索引名, 定义)，不存在时返回None"""
+    conn = Database.get_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            SELECT indexname, indexdef FROM pg_indexes
+            WHERE tablename = %s AND indexdef ILIKE '%% USING hnsw %%'
+            ORDER BY indexname
+            LIMIT 1
+            """,
+            (table,)
+        )
+        row = cursor.fetchone()
+        cursor.close()
+        return row
+    finally:
+        conn.rollback()
+        Database.return_connection(conn)
+
+
+def _index_scans(cursor, index_name: str) -> int:
+    cursor.execute("SELECT COALESCE(sum(idx_scan), 0) FROM pg_stat_user_indexes WHERE indexrelname = %s", (index_name,))
+    return int(cursor.fetchone()[0])
+
+
+def check_search_traffic(index_name: str = VECTOR_INDEX_NAME, sample_seconds: Optional[float] = None) -> List[str]:
+    """检查是否有在线检索依赖向量索引，返回发现的问题列表（为空表示可以删除索引）
+    
+    Args:
+        index_name: 向量索引名
+        sample_seconds: 观察 idx_scan 是否增长的时长，None表示使用配置值
+    """
+    if sample_seconds is None:
+        sample_seconds = settings.bulk_load_idle_check_seconds
+    problems = []
+    conn = Database.get_connection()
+    try:
+        # autocommit下每条语句各自取统计快照，两次读取之间的增长才可见
+        conn.autocommit = True
+        cursor = conn.cursor()
+        
+        cursor.execute(
+            """
+            SELECT pid, state, COALESCE(application_name, ''), left(query, 120)
+            FROM pg_stat_activity
+            WHERE datname = current_database()
+              AND pid <> pg_backend_pid()
+              AND state = 'active'
+              AND query LIKE '%%<=>%%'
+            """
+        )
+        for pid, state, application, query in cursor.fetchall():
+            problems.append(f"会话 {pid}（{application or '未命名'}，{state}）正在执行向量检索: {query}")
+        
+        before = _index_scans(cursor, index_name)
+        time.sleep(sample_seconds)
+        after = _index_scans(cursor, index_name)
+        if after > before:
+            problems.append(f"索引 {index_name} 在 {sample_seconds:.0f}s 内被扫描 {after - before} 次")
+        cursor.close()
+    finally:
+        conn.autocommit = False
+        Database.return_connection(conn)
+    return problems
+
+
+def drop_vector_index(index_name: str = VECTOR_INDEX_NAME) -> float:
+    """删除向量索引，返回耗时（秒）"""
+    start = time.perf_counter()
+    conn = Database.get_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(f"DROP INDEX IF EXISTS {index_name}")
+        conn.commit()
+        cursor.close()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        Database.return_connection(conn)
+    return time.perf_counter() - start
+
+
+def build_vector_index(
+    definition: str = DEFAULT_VECTOR_INDEX_SQL,
+    maintenance_work_mem: Optional[str] = None,
+    parallel_workers: Optional[int] = None
+) -> float:
+    """构建向量索引，返回耗时（秒）
+    
+    Args:
+        definition: CREATE INDEX 语句（通常是删除前从 pg_indexes 读取的原定义）
+        maintenance_work_mem: 构建时的 maintenance_work_mem，图能完整放入内存时构建最快
+        parallel_workers: 构建时的 max_parallel_maintenance_workers（pgvector 0.6+ 支持并行构建HNSW）
+    """
+    maintenance_work_mem = maintenance_work_mem or settings.bulk_load_maintenance_work_mem
+    if parallel_workers is None:
+        parallel_workers = settings.bulk_load_parallel_workers
+    
+    start = time.perf_counter()
+    conn = Database.get_connection()
+    try:
+        cursor = conn.cursor()
+        # SET LOCAL 只在本事务内生效，连接归还连接池后不影响其他请求
+        cursor.execute("SET LOCAL maintenance_work_mem = %s", (maintenance_work_mem,))
+        cursor.execute("SET LOCAL max_parallel_maintenance_workers = %s", (parallel_workers,))
+        cursor.execute(definition)
+        conn.commit()
+        cursor.close()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        Database.return_connection(conn)
+    seconds = time.perf_counter() - start
+    logger.info(f"向量索引构建完成，耗时 {seconds:.1f}s（maintenance_work_mem={maintenance_work_mem}，并行进程 {parallel_workers}）")
+    return seconds
+
+
+def analyze_table(table: str = FEATURE_TABLE) -> float:
+    """更新表的统计信息，返回耗时（秒）"""
+    start = time.perf_counter()
+    conn = Database.get_connection()
+    try:
+        conn.autocommit = True
+        cursor = conn.cursor()
+        cursor.execute(f"ANALYZE {table}")
+        cursor.close()
+    finally:
+        conn.autocommit = False
+        Database.return_connection(conn)
+    return time.perf_counter() - start